@@ -0,0 +1,163 @@
+import datetime
+import logging
+
+from roster import field
+from sheets_backend import ATTENDANCE_SHEET, ATTENDANCE_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+
+# Fixed-size set of bits backed by a bytearray, most significant bit first.
+# Bit i is 1 when the i-th student of the roll call was present.
+class AttendanceBitset:
+    __slots__ = ("size", "data")
+
+    def __init__(self, size, data=None):
+        self.size = size
+        self.data = bytearray(data) if data is not None else bytearray((size + 7) // 8)
+
+    @classmethod
+    def all_present(cls, size):
+        bitset = cls(size, b"\xff" * ((size + 7) // 8))
+        # Keep the padding bits of the last byte clear
+        if size % 8:
+            bitset.data[-1] &= (0xFF << (8 - size % 8)) & 0xFF
+        return bitset
+
+    @classmethod
+    def from_hex(cls, size, text):
+        return cls(size, bytes.fromhex(text) if text else None)
+
+    def to_hex(self):
+        return self.data.hex()
+
+    def __getitem__(self, index):
+        return (self.data[index >> 3] >> (7 - (index & 7))) & 1
+
+    def __setitem__(self, index, present):
+        mask = 1 << (7 - (index & 7))
+        if present:
+            self.data[index >> 3] |= mask
+        else:
+            self.data[index >> 3] &= ~mask & 0xFF
+
+    def toggle(self, index):
+        self.data[index >> 3] ^= 1 << (7 - (index & 7))
+
+    def count(self):
+        return int.from_bytes(self.data, "big").bit_count()
+
+
+# One roll call: a class on a given day. `student_ids` fixes the meaning of each bit,
+# so later roster changes never shift older records.
+class AttendanceRecord:
+    __slots__ = ("date", "classroom", "student_ids", "present", "row")
+
+    def __init__(self, date, classroom, student_ids, present, row=None):
+        self.date = date
+        self.classroom = classroom
+        self.student_ids = student_ids
+        self.present = present
+        self.row = row  # Sheet row, once written
+
+    def absentees(self):
+        return [student_id for i, student_id in enumerate(self.student_ids) if not self.present[i]]
+
+    def to_row(self):
+        return [self.date, self.classroom, ",".join(self.student_ids), self.present.to_hex()]
+
+    @classmethod
+    def from_row(cls, values, row=None):
+        student_ids = [s for s in field(values, ATTENDANCE_COLUMNS, "student_ids").split(",") if s]
+        present = AttendanceBitset.from_hex(len(student_ids), field(values, ATTENDANCE_COLUMNS, "present"))
+        return cls(
+            field(values, ATTENDANCE_COLUMNS, "date"),
+            field(values, ATTENDANCE_COLUMNS, "classroom"),
+            student_ids,
+            present,
+            row,
+        )
+
+
+def ordinal(date):
+    return datetime.date.fromisoformat(date).toordinal()
+
+
+# All attendance records, loaded from the sheet once and kept in memory.
+# Each roll call is written with a single append (or a single batched update
+# when the same class is taken again on the same day).
+#
+# Alongside the records, every student has an absence mask: an int with bit d set
+# when they were absent d days after `origin`. A term's absences are then one AND with
+# the term's range of days instead of a walk over every class's records. Counting from
+# the term start (or the earliest record) keeps a mask to a few dozen bytes.
+class AttendanceStore:
+    def __init__(self, origin=None):
+        self.records = {}  # {(classroom, date): AttendanceRecord}
+        self._absent = {}  # {student_id: absence mask}
+        self._origin = ordinal(origin) if origin else None  # Day of bit 0
+        self._loaded = False
+
+    def ensure_loaded(self, sheets):
+        if self._loaded:
+            return
+        rows = sheets.get_all_values(ATTENDANCE_SHEET)
+        for row_number, values in enumerate(rows[1:], start=2):  # Skip the header
+            record = AttendanceRecord.from_row(values, row_number)
+            try:
+                self._index(record)
+            except ValueError:
+                logger.warning(f"Skipping attendance row {row_number} with invalid date {record.date!r}.")
+        self._loaded = True
+        logger.info(f"Loaded {len(self.records)} attendance records.")
+
+    def _day_bit(self, date):
+        day = ordinal(date)
+        if self._origin is None:
+            self._origin = day
+        elif day < self._origin:  # A record older than any seen so far: move every mask up
+            shift = self._origin - day
+            self._absent = {student_id: mask << shift for student_id, mask in self._absent.items()}
+            self._origin = day
+        return 1 << (day - self._origin)
+
+    def _index(self, record):
+        key = (record.classroom, record.date)
+        day = self._day_bit(record.date)
+        previous = self.records.get(key)
+        if previous is not None:  # Roll call taken again: its absentees replace the earlier ones
+            for student_id in previous.absentees():
+                self._absent[student_id] &= ~day
+        for student_id in record.absentees():
+            self._absent[student_id] = self._absent.get(student_id, 0) | day
+        self.records[key] = record
+
+    def save(self, sheets, record):
+        existing = self.records.get((record.classroom, record.date))
+        if existing is not None and existing.row is not None:
+            record.row = existing.row
+            sheets.update_cells(ATTENDANCE_SHEET, [
+                (record.row, ATTENDANCE_COLUMNS[name], value)
+                for name, value in zip(("date", "classroom", "student_ids", "present"), record.to_row())
+            ])
+        else:
+            # The row Sheets actually used; None while the write is queued
+            record.row = sheets.append_row(ATTENDANCE_SHEET, record.to_row())
+        self._index(record)
+
+    def absences(self, student_id, start=None, end=None):
+        """Dates in [start, end] (ISO strings, inclusive) on which `student_id` was marked absent."""
+        mask = self._absent.get(student_id, 0)
+        if not mask:
+            return []
+        if start:
+            mask &= -1 << max(ordinal(start) - self._origin, 0)
+        if end:
+            last = ordinal(end) - self._origin
+            mask &= (1 << (last + 1)) - 1 if last >= 0 else 0
+        dates = []
+        while mask:
+            lowest = mask & -mask
+            dates.append(datetime.date.fromordinal(self._origin + lowest.bit_length() - 1).isoformat())
+            mask ^= lowest
+        return dates
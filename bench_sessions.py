@@ -0,0 +1,116 @@
+"""
+Memory held by logged-in users' sessions, measured with tracemalloc.
+
+"before" rebuilds the old layout: a dict per user holding a dozen profile fields,
+plus a private copy of every user's sheet row in USER_CACHE. "after" logs the same
+users in with the current code path: a `Session` with `__slots__` in the
+application's user_data, with the row read from the shared roster index. The
+roster itself is loaded up front in both cases and not counted, since search,
+report cards and digests keep it in memory anyway.
+
+    python bench_sessions.py --users 10000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import tracemalloc
+import types
+from collections import defaultdict
+
+import bot
+from sheets_backend import InMemoryBackend, STUDENT_COLUMNS
+
+
+def student_rows(count):
+    return [
+        [
+            "No", f"S{n:05d}", f"Student Number {n}", "F" if n % 2 else "M", f"Grade {n % 8 + 1}{'ABC'[n % 3]}",
+            str(n % 8 + 1), "Paid", "Mathematics", f"pw{n:06d}", "What is your favourite colour?", "blue",
+            str(100000000 + n),
+        ]
+        for n in range(count)
+    ]
+
+
+def fresh(value):
+    # A new string object, as if it had just been decoded from an API response or a message
+    return json.loads(json.dumps(value))
+
+
+def measure(build):
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] - before, kept
+
+
+def legacy_sessions(rows):
+    user_cache = {}
+    user_data = defaultdict(dict)
+    for n, row in enumerate(rows):
+        user_id = fresh(row[1])
+        cached = user_cache[("student", user_id)] = fresh(row)  # row_values() of the sheet
+        user_data[n].update({
+            'role': 'student',
+            'first_time': cached[STUDENT_COLUMNS["first_time"] - 1],
+            'user_id': user_id,
+            'full_name': cached[STUDENT_COLUMNS["full_name"] - 1],
+            'gender': cached[STUDENT_COLUMNS["gender"] - 1],
+            'classroom': cached[STUDENT_COLUMNS["classroom"] - 1],
+            'grade': cached[STUDENT_COLUMNS["grade"] - 1],
+            'subject': None,
+            'children': None,
+            'password': cached[STUDENT_COLUMNS["password"] - 1],
+            'security_question': cached[STUDENT_COLUMNS["security_question"] - 1],
+            'security_answer': cached[STUDENT_COLUMNS["security_answer"] - 1],
+            'current_state': "UNKNOWN",
+        })
+    return user_cache, user_data
+
+
+def current_sessions(application, rows):
+    roster = application.bot_data['roster']
+    for n, row in enumerate(rows):
+        session = application.user_data[n]
+        session.role = 'student'
+        session.user_id = fresh(row[1])
+        assert roster.account(session.role, session.user_id) is row
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    args = parser.parse_args()
+
+    config = bot.load_config()
+    config.update(bot_token="1:bench", journal_path="", record_dir="", admin_ids=[])
+    application = bot.create_application(config, InMemoryBackend())
+    rows = student_rows(args.users)
+    application.bot_data['roster'].load(rows, [])
+
+    tracemalloc.start()
+    legacy_bytes, legacy = measure(lambda: legacy_sessions(rows))
+    del legacy
+    current_bytes, _ = measure(lambda: current_sessions(application, rows))
+
+    # Everyone goes idle; the sweeper drops their sessions
+    for session in application.user_data.values():
+        session.last_seen -= config["session_idle_timeout"]
+    context = types.SimpleNamespace(application=application, bot_data=application.bot_data)
+    swept_bytes, _ = measure(lambda: asyncio.run(bot.sweep_idle_sessions(context)))
+    tracemalloc.stop()
+    application.bot_data['reports'].executor.shutdown()
+
+    users = args.users
+    print(f"{users} logged-in students")
+    print(f"before  dict sessions + USER_CACHE rows  {legacy_bytes / 2**20:7.2f} MiB  {legacy_bytes / users:6.0f} B/user")
+    print(f"after   Session slots + shared roster    {current_bytes / 2**20:7.2f} MiB  {current_bytes / users:6.0f} B/user")
+    print(f"idle sweep freed                         {-swept_bytes / 2**20:7.2f} MiB  "
+          f"({len(application.user_data)} sessions left)")
+
+
+if __name__ == "__main__":
+    main()
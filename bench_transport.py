@@ -0,0 +1,152 @@
+"""
+What the Google API transport from transport.py changes, measured against a local stub server.
+
+1. Token refresh. The stub's tokens live for `--token-lifetime` seconds and every
+   refresh takes `--token-ms`. Calls are made one at a time, like the bot makes
+   them from its event loop. With plain google-auth, the call that finds the
+   token expired waits for the refresh; with `authorized_session` the refresher
+   thread renews it first.
+2. Timeouts. One call goes to an endpoint that stalls for `--stall` seconds.
+   gspread's default session waits for as long as the server does; the tuned
+   client gives up after a single read timeout, since read timeouts are not
+   retried.
+
+    python bench_transport.py --calls 3000 --token-lifetime 1 --token-ms 150
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import statistics
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from google.auth import _helpers
+from google.auth.credentials import Credentials
+from google.auth.transport.requests import AuthorizedSession
+
+from transport import authorized_session
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive
+    disable_nagle_algorithm = True  # Otherwise delayed ACKs add ~40 ms per response
+    token_time = 0.0
+    service_time = 0.0
+    stall_time = 0.0
+
+    def _reply(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(StubHandler.stall_time if self.path.startswith("/stall") else StubHandler.service_time)
+        self._reply(b'{"values": [["id", "full_name"], ["S1", "Abebe"]]}')
+
+    def do_POST(self):  # Token endpoint
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(StubHandler.token_time)
+        self._reply(b'{"access_token": "stub", "expires_in": 3600}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+# The stub runs in its own process so it does not compete with the client for the GIL
+def serve(token_time, service_time, stall_time, ready):
+    StubHandler.token_time = token_time
+    StubHandler.service_time = service_time
+    StubHandler.stall_time = stall_time
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+# Service-account-like credentials whose tokens come from the stub and live `lifetime` seconds
+# past google-auth's own refresh threshold
+class StubCredentials(Credentials):
+    def __init__(self, token_url, lifetime):
+        super().__init__()
+        self.token_url = token_url
+        self.lifetime = lifetime
+        self.refreshes = 0
+
+    def refresh(self, request):
+        response = request(url=self.token_url, method="POST", body=b"")
+        self.token = json.loads(response.data)["access_token"]
+        self.expiry = _helpers.utcnow() + _helpers.REFRESH_THRESHOLD + datetime.timedelta(seconds=self.lifetime)
+        self.refreshes += 1
+
+
+def run(name, session, creds, url, calls, refresh_ms):
+    refreshes = creds.refreshes
+    latencies = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        session.get(url, timeout=(5.0, 20.0))
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    print(
+        f"{name:<22} mean {statistics.mean(latencies):6.2f} ms  "
+        f"p50 {latencies[len(latencies) // 2]:6.2f} ms  "
+        f"p99.9 {latencies[int(len(latencies) * 0.999)]:7.2f} ms  "
+        f"max {latencies[-1]:7.2f} ms  "
+        f"calls that waited for a refresh: {sum(1 for latency in latencies if latency >= refresh_ms)}  "
+        f"refreshes {creds.refreshes - refreshes}"
+    )
+
+
+def timed_stall(name, get):
+    started = time.perf_counter()
+    try:
+        get()
+        outcome = "answered"
+    except requests.exceptions.RequestException as e:
+        outcome = f"gave up ({type(e).__name__})"
+    print(f"{name:<22} {outcome} after {time.perf_counter() - started:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=3000)
+    parser.add_argument("--token-lifetime", type=float, default=1.0, help="seconds a token stays valid")
+    parser.add_argument("--token-ms", type=float, default=150.0, help="delay per token refresh")
+    parser.add_argument("--service-ms", type=float, default=1.0, help="delay per API call")
+    parser.add_argument("--stall", type=float, default=5.0, help="seconds the stalled endpoint takes")
+    parser.add_argument("--read-timeout", type=float, default=1.0)
+    args = parser.parse_args()
+
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=serve, args=(args.token_ms / 1000, args.service_ms / 1000, args.stall, ready), daemon=True
+    )
+    server.start()
+    base = f"http://127.0.0.1:{ready.get()}"
+    url = f"{base}/v4/spreadsheets/stub/values/A1:Z"
+
+    print(f"{args.calls} sequential calls, token lifetime {args.token_lifetime}s, "
+          f"refresh {args.token_ms} ms, service {args.service_ms} ms")
+    creds = StubCredentials(f"{base}/token", args.token_lifetime)
+    run("inline refresh", AuthorizedSession(creds), creds, url, args.calls, args.token_ms)
+
+    creds = StubCredentials(f"{base}/token", args.token_lifetime)
+    # Renew halfway through each token's life, well before google-auth would refresh inline
+    margin = _helpers.REFRESH_THRESHOLD.total_seconds() + args.token_lifetime / 2
+    session, refresher = authorized_session(creds, refresh_margin=margin)
+    run("background refresh", session, creds, url, args.calls, args.token_ms)
+    refresher.stop()
+
+    print(f"\nOne call to a server that stalls for {args.stall}s:")
+    timed_stall("default (no timeout)", lambda: requests.Session().get(f"{base}/stall"))
+    timed_stall(f"read timeout {args.read_timeout}s",
+                lambda: session.get(f"{base}/stall", timeout=(5.0, args.read_timeout)))
+    server.terminate()
+
+
+if __name__ == "__main__":
+    main()
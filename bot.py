@@ -1,124 +1,136 @@
 import logging
 from telegram.error import Forbidden
 from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import Application, CommandHandler, MessageHandler, ConversationHandler, CallbackQueryHandler, CallbackContext, filters
-import gspread
+from telegram.ext import (
+    Application, ApplicationHandlerStop, CommandHandler, MessageHandler, ConversationHandler,
+    CallbackQueryHandler, CallbackContext, ContextTypes, TypeHandler, filters,
+)
 from gspread.exceptions import APIError
 from telegram import ReplyKeyboardRemove
 from httpx import ConnectTimeout
 from debug_utils import debug_state_transition
+from sheets_backend import (
+    GspreadBackend, STUDENT_SHEET, TEACHER_SHEET, RESULTS_SHEET, PARENT_SHEET, ATTENDANCE_SHEET,
+    STUDENT_COLUMNS, TEACHER_COLUMNS, PARENT_COLUMNS, RESULTS_COLUMNS,
+)
+from circuit_breaker import CircuitBreaker, CircuitOpenError, ResilientBackend
+from roster import RosterIndex, field, parse_children
+from digest import build_digests, load_seen, render_student_summary, save_seen, send_paced, split_message
+from attendance import AttendanceBitset, AttendanceRecord, AttendanceStore
+from journal import Journal, ACCOUNT_CREATED, ATTENDANCE_TAKEN, CHAT_ID_SET, PASSWORD_SET, RESULT_POSTED, EVENT_NAMES
+from reports import ReportCardRenderer, build_card, report_filename
+from profiler import SamplingProfiler, StateTimer, handler_codes, profile_path, render_summary
+from recorder import UpdateRecorder, recording_path
+from results_watcher import ResultsWatcher, build_notifications, result_key
+from sessions import Session
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import datetime
+import multiprocessing
 import os
-import json
+import signal
+import threading
+import time
+from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
-import gspread
-import os
-import json
-from google.oauth2 import service_account
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Get the token securely from environment
-TOKEN = os.getenv("BOT_TOKEN")
 
 
 # Set up logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Google Sheets Authentication
-try:
-    scope = [
-        "https://spreadsheets.google.com/feeds",
-        "https://www.googleapis.com/auth/drive"
-    ]
-
-    # Get credentials from environment variable
-    creds_json = os.environ.get("GOOGLE_CREDS")
-    if not creds_json:
-        raise ValueError("GOOGLE_CREDS environment variable not set")
-
-    creds_dict = json.loads(creds_json)
-    # Replace escaped newlines
-    creds_dict["private_key"] = creds_dict["private_key"].replace("\\n", "\n")
 
-    creds = service_account.Credentials.from_service_account_info(creds_dict, scopes=scope)
-
-    # Authenticate gspread client
-    client = gspread.authorize(creds)
-
-    # Test connection
-    client.openall()  # Or any small safe call to verify
-
-except Exception as e:
-    import logging
-    logging.basicConfig(level=logging.ERROR)
-    logger = logging.getLogger(__name__)
-    logger.error(f"Google Sheets authentication failed: {e}")
-    raise
-
-
-def get_sheet(client, sheet_name):
-    try:
-        sheet = client.open(sheet_name).sheet1
-        # Test access
-        sheet.get_all_records()
-        return sheet
-    except gspread.SpreadsheetNotFound:
-        logger.error(f"Spreadsheet '{sheet_name}' not found. Check the name and sharing permissions.")
-        raise
-    except APIError as e:
-        logger.error(f"Google API error accessing '{sheet_name}': {e}")
-        raise
-    except Exception as e:
-        logger.error(f"Unexpected error accessing '{sheet_name}': {e}")
-        raise
-
-# Then initialize your sheets like this:
-try:
-    student_sheet = get_sheet(client, "students")
-    teacher_sheet = get_sheet(client, "teachers")
-    results_sheet = get_sheet(client, "resultsnfeedback")
-except Exception as e:
-    logger.critical("Failed to initialize sheets. Bot cannot start.")
-    raise
-
-# Authenticate with Google Sheets
-client = gspread.authorize(creds)
-student_sheet = client.open("students").sheet1
-teacher_sheet = client.open("teachers").sheet1
-results_sheet = client.open("resultsnfeedback").sheet1
-
-# Cache for user data
-USER_CACHE = {}
-
-# Column indices based on the user's structure
-STUDENT_COLUMNS = {
-    "first_time": 1,
-    "id": 2,
-    "full_name": 3,
-    "gender": 4,
-    "classroom": 5,
-    "grade": 6,
-    "tuition": 7,
-    "subject": 8,
-    "password": 9,
-    "security_question": 10,
-    "security_answer": 11,
-}
-TEACHER_COLUMNS = {
-    "first_time": 1,
-    "id": 2,
-    "full_name": 3,
-    "gender": 4,
-    "subject": 5,
-    "password": 6,
-    "security_question": 7,
-    "security_answer": 8,
+# Read settings from the environment (and the .env file, if present)
+def load_config():
+    load_dotenv()
+    return {
+        "bot_token": os.getenv("BOT_TOKEN"),
+        "google_creds": os.getenv("GOOGLE_CREDS"),
+        # Circuit breaker around Google Sheets
+        "sheets_failure_threshold": int(os.getenv("SHEETS_FAILURE_THRESHOLD", "3")),
+        "sheets_reset_timeout": float(os.getenv("SHEETS_RESET_TIMEOUT", "30")),
+        "sheets_snapshot_interval": float(os.getenv("SHEETS_SNAPSHOT_INTERVAL", "300")),
+        # HTTP transport for Google APIs. Sheets is called from the event loop thread only,
+        # one call at a time, so more than one connection per host is never used.
+        "sheets_pool_size": int(os.getenv("SHEETS_POOL_SIZE", "1")),
+        "sheets_connect_timeout": float(os.getenv("SHEETS_CONNECT_TIMEOUT", "5")),
+        "sheets_read_timeout": float(os.getenv("SHEETS_READ_TIMEOUT", "20")),
+        "token_refresh_margin": float(os.getenv("TOKEN_REFRESH_MARGIN", "300")),
+        # How long the in-memory roster index is reused before re-reading the sheets
+        "roster_ttl": float(os.getenv("ROSTER_TTL", "60")),
+        # Sessions and conversations idle this long are evicted (seconds; 0 keeps them forever)
+        "session_idle_timeout": float(os.getenv("SESSION_IDLE_TIMEOUT", "3600")),
+        "session_sweep_interval": float(os.getenv("SESSION_SWEEP_INTERVAL", "300")),
+        # Weekly digest schedule (day: 0 = Sunday ... 6 = Saturday) and send rate
+        "digest_day": int(os.getenv("DIGEST_DAY", "5")),
+        "digest_time": os.getenv("DIGEST_TIME", "16:00"),
+        "timezone": os.getenv("TIMEZONE", "Africa/Addis_Ababa"),
+        "send_rate": float(os.getenv("SEND_RATE", "20")),
+        "send_concurrency": int(os.getenv("SEND_CONCURRENCY", "8")),
+        # Results included in the last digest, so the next one can mark what is new
+        "digest_state_path": os.getenv("DIGEST_STATE_PATH", "data/digest_seen.json"),
+        # Seconds between checks of the results sheet for new results to push; 0 disables
+        "results_poll_interval": float(os.getenv("RESULTS_POLL_INTERVAL", "30")),
+        # First day of the current term (YYYY-MM-DD); empty counts every record
+        "term_start": os.getenv("TERM_START", ""),
+        # Append-only change journal; set JOURNAL_PATH empty to disable
+        "journal_path": os.getenv("JOURNAL_PATH", "data/journal.bin"),
+        "journal_compact_every": int(os.getenv("JOURNAL_COMPACT_EVERY", "100000")),
+        # PDF report cards
+        "school_name": os.getenv("SCHOOL_NAME", "X School"),
+        "term_name": os.getenv("TERM_NAME", "Current term"),
+        "report_cache_dir": os.getenv("REPORT_CACHE_DIR", "data/report_cache"),
+        "report_workers": int(os.getenv("REPORT_WORKERS", "2")),
+        "report_cache_max": int(os.getenv("REPORT_CACHE_MAX", "2000")),
+        # Telegram user IDs allowed to run /profile and /audit (comma-separated); kill -USR1 also profiles
+        "admin_ids": [int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip()],
+        "profile_seconds": float(os.getenv("PROFILE_SECONDS", "30")),
+        "profile_interval": float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000,
+        "profile_dir": os.getenv("PROFILE_DIR", "data/profiles"),
+        # Set RECORD_DIR to record anonymized updates for replay_updates.py; RECORD_KEY keeps pseudonyms stable
+        "record_dir": os.getenv("RECORD_DIR", ""),
+        "record_key": os.getenv("RECORD_KEY", ""),
+    }
+
+
+# Warn the user when data was served from the saved snapshot because Google Sheets is down
+def stale_notice(context, sheet_name):
+    sheets = context.bot_data['sheets']
+    if not sheets.is_stale(sheet_name):
+        return ""
+    minutes = int((sheets.snapshot_age(sheet_name) or 0) // 60)
+    return f"\n\n⚠️ Google Sheets is unavailable right now. Showing saved data from {minutes} min ago."
+
+
+# Sheet and column layout used by each role
+ROLE_SHEETS = {
+    'student': (STUDENT_SHEET, STUDENT_COLUMNS),
+    'teacher': (TEACHER_SHEET, TEACHER_COLUMNS),
+    'parent': (PARENT_SHEET, PARENT_COLUMNS),
 }
 
 # Conversation states
 CHOOSING_ROLE, STUDENT_AUTH, TEACHER_AUTH, PASSWORD_SETUP, PASSWORD_CONFIRM, SECURITY_SETUP, WELCOME_MESSAGE, STUDENT_MENU, TEACHER_MENU, LOG_OUT = range(10)
+PARENT_AUTH, PARENT_MENU = range(10, 12)
+
+# Readable names for the numbered states, used in profiling reports
+STATE_NAMES = {
+    CHOOSING_ROLE: "CHOOSING_ROLE", STUDENT_AUTH: "STUDENT_AUTH", TEACHER_AUTH: "TEACHER_AUTH",
+    PASSWORD_SETUP: "PASSWORD_SETUP", PASSWORD_CONFIRM: "PASSWORD_CONFIRM", SECURITY_SETUP: "SECURITY_SETUP",
+    WELCOME_MESSAGE: "WELCOME_MESSAGE", STUDENT_MENU: "STUDENT_MENU", TEACHER_MENU: "TEACHER_MENU",
+    LOG_OUT: "LOG_OUT", PARENT_AUTH: "PARENT_AUTH", PARENT_MENU: "PARENT_MENU",
+}
+
+STUDENT_MENU_KEYBOARD = [["📚 Access Textbooks", "🎥 Watch Video Lessons"], ["🗂️ View Results", "💬 Teacher Feedback"], ["🗓️ My Attendance"], ["Log Out"]]
+TEACHER_MENU_KEYBOARD = [["📚 Upload Materials", "📊 View Student Performance"], ["🗓️ Take Attendance", "🔎 Find Student"], ["🧾 Report Cards"], ["🔙 Back to Role Selection"], ["Log Out"]]
+PARENT_MENU_KEYBOARD = [["👨‍👩‍👧 Children Overview"], ["Log Out"]]
+
+# Text that is safe to keep verbatim in recordings: the bot's own fixed labels. Everything else is masked.
+RECORD_PUBLIC_TEXTS = {
+    label for keyboard in (STUDENT_MENU_KEYBOARD, TEACHER_MENU_KEYBOARD, PARENT_MENU_KEYBOARD)
+    for row in keyboard for label in row
+} | {"Student", "Teacher", "Parent", "🔙 Back", "📦 Whole class", "Math", "Science", "History", "Literature",
+     "Student Logout", "Teacher Logout", "Parent Logout", "User Logout"}
 
 # Start command with role selection
 async def start(update: Update, context: CallbackContext):
@@ -126,12 +138,12 @@ async def start(update: Update, context: CallbackContext):
     await debug_state_transition(update, context)
     try:
         logger.info("Received /start command.")
-        keyboard = [["Student"], ["Teacher"]]
+        keyboard = [["Student"], ["Teacher"], ["Parent"]]
         reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
 
         await update.message.reply_text(
             "🌟 Welcome to X School's official bot! 🌟\n\n"
-            "Are you a Student or a Teacher?\n"
+            "Are you a Student, a Teacher or a Parent?\n"
             "Please select your role below:",
             reply_markup=reply_markup
         )
@@ -153,15 +165,22 @@ async def choose_role(update: Update, context: CallbackContext):
             "📚 Excellent! Please enter your *Student Administration Number* to proceed.",
             parse_mode="Markdown"
         )
-        context.user_data['role'] = 'student'
+        context.user_data.role = 'student'
         return STUDENT_AUTH
     elif role == "teacher":
         await update.message.reply_text(
             "👨‍🏫 Welcome, teacher! Please enter your *Teacher ID* to continue.",
             parse_mode="Markdown"
         )
-        context.user_data['role'] = 'teacher'
+        context.user_data.role = 'teacher'
         return TEACHER_AUTH
+    elif role == "parent":
+        await update.message.reply_text(
+            "👪 Welcome! Please enter your *Parent ID* to continue.",
+            parse_mode="Markdown"
+        )
+        context.user_data.role = 'parent'
+        return PARENT_AUTH
     else:
         logger.warning("Invalid role selection.")
         await update.message.reply_text(
@@ -170,58 +189,75 @@ async def choose_role(update: Update, context: CallbackContext):
         return ConversationHandler.END
 
 
-from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+# Append a change to the journal, if it is enabled
+def journal_change(context: CallbackContext, event_type, sheet_name, key, fields):
+    journal = context.bot_data.get('journal')
+    if journal is not None:
+        journal.append(event_type, sheet_name, key, fields)
+
+
+# Journal a change to a user's row, then write it to the sheet in one batched update.
+# Returns False if the write was queued because Google Sheets is unavailable.
+def record_change(context: CallbackContext, event_type, sheet_name, columns, user_id, fields, row=None):
+    journal_change(context, event_type, sheet_name, user_id, fields)
+
+    sheets = context.bot_data['sheets']
+    if row is None:
+        row = sheets.find_row(sheet_name, user_id)
+    written = sheets.update_cells(sheet_name, [(row, columns[name], value) for name, value in fields.items()])
+    return written is not False
 
-# Authenticate user and check for first-time login
-# Updated authenticate_user function to handle teacher login flow like student login
-# Cache for user data
-USER_CACHE = {}
 
+# Tell the user a change is only queued for now
+def queued_notice(written):
+    if written:
+        return ""
+    return "\n\n⚠️ Google Sheets is unavailable right now. Your change will be saved as soon as it is back."
 
-async def authenticate_user(sheet, columns, user_id, role, update, context):
+
+# Sheet row of the logged-in user, read from the shared roster index
+def session_row(context: CallbackContext):
+    session = context.user_data
+    return context.bot_data['roster'].account(session.role, session.user_id) or []
+
+
+# Authenticate user and check for first-time login
+# Updated authenticate_user function to handle teacher login flow like student login
+async def authenticate_user(sheet_name, columns, user_id, role, update, context):
     # Log the state and user input globally
     await debug_state_transition(update, context)
     try:
-        # Check if the user is already cached
-        if user_id in USER_CACHE:
-            user_data = USER_CACHE[user_id]
-        else:
+        # Students come from the roster index, reloaded once it is older than the TTL so password
+        # changes and removals in the sheet apply at the next login; others are read at most once per TTL
+        roster = context.bot_data['roster']
+        if role == 'student':
+            roster.ensure_fresh(context.bot_data['sheets'])
+        user_row = roster.account(role, user_id, max_age=roster.ttl)
+        if user_row is None:
             # Find user in the Google Sheet
-            cell = sheet.find(user_id)
-            if cell:
-                row = cell.row
-                user_data = sheet.row_values(row)
-                USER_CACHE[user_id] = user_data  # Cache the user data
+            sheets = context.bot_data['sheets']
+            row = sheets.find_row(sheet_name, user_id)
+            if row:
+                user_row = sheets.row_values(sheet_name, row)
+                roster.remember_account(role, user_id, user_row)
             else:
                 logger.warning(f"User ID {user_id} not found in the sheet.")
                 await update.message.reply_text(
                     "❌ User not found. Please ensure you are entering the correct ID."
                 )
-                return STUDENT_AUTH if role == 'student' else TEACHER_AUTH
+                return {'student': STUDENT_AUTH, 'teacher': TEACHER_AUTH, 'parent': PARENT_AUTH}[role]
 
-        # Validate and populate user data from the sheet
-        try:
-            context.user_data.update({
-                'first_time': user_data[columns["first_time"] - 1],
-                'user_id': user_id,
-                'full_name': user_data[columns["full_name"] - 1],
-                'gender': user_data[columns["gender"] - 1],
-                'classroom': user_data[columns["classroom"] - 1] if role == 'student' else None,
-                'grade': user_data[columns["grade"] - 1] if role == 'student' else None,
-                'subject': user_data[columns["subject"] - 1] if role == 'teacher' else None,
-                'password': user_data[columns["password"] - 1],
-                'security_question': user_data[columns["security_question"] - 1],
-                'security_answer': user_data[columns["security_answer"] - 1]
-            })
-        except IndexError as e:
-            logger.error(f"Data missing in Google Sheet for user {user_id}: {e}")
+        # Validate the row; password and security columns are still empty before the first login
+        if len(user_row) < columns["gender"]:
+            logger.error(f"Data missing in Google Sheet for user {user_id}: row has {len(user_row)} cells.")
             await update.message.reply_text(
                 "❌ Incomplete data found in the system. Please contact support."
             )
             return ConversationHandler.END
+        context.user_data.user_id = user_id
 
         # Handle first-time login
-        if context.user_data['first_time'].lower() == "yes":
+        if field(user_row, columns, "first_time").lower() == "yes":
             logger.info(f"First-time login detected for user {user_id}.")
             await update.message.reply_text(
                 "👤 First-time login detected.\n\n"
@@ -242,7 +278,7 @@ async def authenticate_user(sheet, columns, user_id, role, update, context):
             )
             return PASSWORD_CONFIRM
 
-    except ConnectTimeout:
+    except (ConnectTimeout, CircuitOpenError):
         logger.error("Connection timed out while trying to access Google Sheets.")
         await update.message.reply_text(
             "❌ Unable to connect to the server. Please try again later."
@@ -260,40 +296,23 @@ async def authenticate_user(sheet, columns, user_id, role, update, context):
             "❌ Something went wrong. Please try again later."
         )
         return ConversationHandler.END
+# Handle student authentication (Student ID input)
+async def student_auth(update: Update, context: CallbackContext):
+    user_id = update.message.text  # Student ID entered by the user
+    return await authenticate_user(STUDENT_SHEET, STUDENT_COLUMNS, user_id, 'student', update, context)
+
 # Handle teacher authentication (Teacher ID input)
 async def teacher_auth(update: Update, context: CallbackContext):
     # Log the state and user input globally
     await debug_state_transition(update, context)
     user_id = update.message.text  # Teacher ID entered by the user
-    return await authenticate_user(teacher_sheet, TEACHER_COLUMNS, user_id, 'teacher', update, context)
-
-# Confirm Password for Returning Users
-async def confirm_password(update: Update, context: CallbackContext):
-    # Log the state and user input globally
-    await debug_state_transition(update, context)
-    entered_password = update.message.text  # User's entered password
-    stored_password = context.user_data.get('password')  # Password from Google Sheet
+    return await authenticate_user(TEACHER_SHEET, TEACHER_COLUMNS, user_id, 'teacher', update, context)
 
-    # Add "Forgot Password" button
-    reply_markup = ReplyKeyboardMarkup(
-        [["Forgot Password"]], one_time_keyboard=True, resize_keyboard=True
-    )
+# Handle parent authentication (Parent ID input)
+async def parent_auth(update: Update, context: CallbackContext):
+    user_id = update.message.text  # Parent ID entered by the user
+    return await authenticate_user(PARENT_SHEET, PARENT_COLUMNS, user_id, 'parent', update, context)
 
-    if entered_password == stored_password:
-        # Password matches, sign the user in
-        await update.message.reply_text(
-            "✅ Password correct! You are now signed in. Here is your profile:",
-            reply_markup=ReplyKeyboardRemove()  # Remove buttons after successful login
-        )
-        return await welcome_message(update, context)  # Redirect to the welcome message
-    else:
-        # Password does not match, prompt the user to try again
-        await update.message.reply_text(
-            "❌ Incorrect password. Please try again:",
-            reply_markup=reply_markup  # Ensure the "Forgot Password" button is visible
-        )
-        return PASSWORD_CONFIRM  # Stay in the PASSWORD_CONFIRM state
-    
 # Handle first-time user password setup
 async def setup_password(update: Update, context: CallbackContext):
     # Log the state and user input globally
@@ -301,7 +320,7 @@ async def setup_password(update: Update, context: CallbackContext):
     password = update.message.text
     if 4 <= len(password) <= 8:
         # Temporarily store the password for confirmation
-        context.user_data['new_password'] = password
+        context.user_data.new_password = password
         await update.message.reply_text("✅ Password set! Please re-enter your password to confirm:")
         return "PASSWORD_CONFIRM_SETUP"  # Transition to password confirmation
     else:
@@ -316,9 +335,8 @@ async def confirm_setup_password(update: Update, context: CallbackContext):
     # Log the state and user input globally
     await debug_state_transition(update, context)
     confirm_password = update.message.text
-    if confirm_password == context.user_data.get('new_password'):
-        # Password confirmation successful
-        context.user_data['password'] = confirm_password  # Save the final password
+    if confirm_password == context.user_data.new_password:
+        # Password confirmation successful; it is saved once the security question is set
         await update.message.reply_text(
             "✅ Password confirmed! Now, please set a security question for password recovery:"
         )
@@ -337,36 +355,43 @@ async def confirm_setup_password(update: Update, context: CallbackContext):
 async def setup_security_question(update: Update, context: CallbackContext):
     # Log the state and user input globally
     await debug_state_transition(update, context)
-    if 'security_question' not in context.user_data:
-        # Save the security question in user_data
-        context.user_data['security_question'] = update.message.text
+    session = context.user_data
+    if session.security_question is None:
+        # Keep the security question until the answer arrives
+        session.security_question = update.message.text
         await update.message.reply_text("✅ Security question set! Now, please provide the answer:")
         return SECURITY_SETUP
     else:
         # Save the security answer and update the spreadsheet
-        context.user_data['security_answer'] = update.message.text
-        sheet = student_sheet if context.user_data['role'] == 'student' else teacher_sheet
-        columns = STUDENT_COLUMNS if context.user_data['role'] == 'student' else TEACHER_COLUMNS
-        user_id = context.user_data['user_id']
-        row = sheet.find(user_id).row
-
-        # Update the spreadsheet with the user's information
-        sheet.update_cell(row, columns["first_time"], "NO")  # Mark as not first-time
-        sheet.update_cell(row, columns["password"], context.user_data['password'])  # Update password
-        sheet.update_cell(row, columns["security_question"], context.user_data['security_question'])  # Update security question
-        sheet.update_cell(row, columns["security_answer"], context.user_data['security_answer'])  # Update security answer
+        sheet_name, columns = ROLE_SHEETS[session.role]
+        fields = {
+            "first_time": "NO",  # Mark as not first-time
+            "password": session.new_password,
+            "security_question": session.security_question,
+            "security_answer": update.message.text,
+        }
+
+        # Update the spreadsheet with the user's information in a single request
+        try:
+            written = record_change(context, ACCOUNT_CREATED, sheet_name, columns, session.user_id, fields)
+        except Exception as e:
+            logger.error(f"Error saving account setup for user {session.user_id}: {e}")
+            await update.message.reply_text("❌ Something went wrong. Please try again later.")
+            return ConversationHandler.END
+        context.bot_data['roster'].update_account(session.role, session.user_id, columns, fields)
+        session.new_password = session.security_question = None
 
         # Confirm account creation
         await update.message.reply_text(
-            "✅ Your account has been created successfully!\n"
-            "Here is your profile:"
+            "✅ Your account has been created successfully!"
+            + queued_notice(written)
+            + "\nHere is your profile:"
         )
         # Automatically display the profile
         return await welcome_message(update, context)
 
 
-from telegram.ext import CallbackQueryHandler
-
+# Confirm Password for Returning Users
 async def confirm_password(update: Update, context: CallbackContext):
     # Log the state and user input globally
     await debug_state_transition(update, context)
@@ -377,7 +402,8 @@ async def confirm_password(update: Update, context: CallbackContext):
             return await forgot_password_start(update, context)  # Redirect to forgot password flow
 
     entered_password = update.message.text  # User's entered password
-    stored_password = context.user_data.get('password')  # Password from Google Sheet
+    columns = ROLE_SHEETS[context.user_data.role][1]
+    stored_password = field(session_row(context), columns, "password")  # Password from Google Sheet
 
     # Add "Forgot Password" inline button
     reply_markup = InlineKeyboardMarkup([
@@ -427,16 +453,15 @@ async def forgot_password_verify_id(update: Update, context: CallbackContext):
     # Log the state and user input globally
     await debug_state_transition(update, context)
     user_id = update.message.text
-    sheet = student_sheet if context.user_data.get('role') == 'student' else teacher_sheet
-    columns = STUDENT_COLUMNS if context.user_data.get('role') == 'student' else TEACHER_COLUMNS
+    sheet_name, columns = ROLE_SHEETS[context.user_data.role or 'teacher']
+    sheets = context.bot_data['sheets']
 
     try:
-        cell = sheet.find(user_id)
-        if cell:
-            row = cell.row
-            security_question = sheet.cell(row, columns["security_question"]).value
+        row = sheets.find_row(sheet_name, user_id)
+        if row:
+            security_question = sheets.cell_value(sheet_name, row, columns["security_question"])
 
-            context.user_data['reset_user_id'] = user_id
+            context.user_data.reset_user_id = user_id
             await update.message.reply_text(
                 f"❓ Security Question: {security_question}\n"
                 "Please answer the question to proceed:"
@@ -464,15 +489,14 @@ async def forgot_password_verify_security(update: Update, context: CallbackConte
     # Log the state and user input globally
     await debug_state_transition(update, context)
     security_answer = update.message.text
-    sheet = student_sheet if context.user_data.get('role') == 'student' else teacher_sheet
-    columns = STUDENT_COLUMNS if context.user_data.get('role') == 'student' else TEACHER_COLUMNS
-    user_id = context.user_data['reset_user_id']
+    sheet_name, columns = ROLE_SHEETS[context.user_data.role or 'teacher']
+    user_id = context.user_data.reset_user_id
+    sheets = context.bot_data['sheets']
 
     try:
-        cell = sheet.find(user_id)
-        if cell:
-            row = cell.row
-            correct_answer = sheet.cell(row, columns["security_answer"]).value
+        row = sheets.find_row(sheet_name, user_id)
+        if row:
+            correct_answer = sheets.cell_value(sheet_name, row, columns["security_answer"])
 
             # Case-sensitive comparison
             if security_answer == correct_answer:
@@ -495,26 +519,33 @@ async def forgot_password_reset(update: Update, context: CallbackContext):
     # Log the state and user input globally
     await debug_state_transition(update, context)
     new_password = update.message.text
+    session = context.user_data
 
-    if 'new_password' not in context.user_data:
+    if session.new_password is None:
         # Temporarily store the new password and ask for confirmation
-        context.user_data['new_password'] = new_password
+        session.new_password = new_password
         await update.message.reply_text("🔑 Please re-enter your new password to confirm:")
         return "FORGOT_PASSWORD_CONFIRM_RESET"
     else:
         # Confirm the password matches
-        if new_password == context.user_data['new_password']:
+        if new_password == session.new_password:
             # Save the password in the database
-            sheet = student_sheet if context.user_data.get('role') == 'student' else teacher_sheet
-            columns = STUDENT_COLUMNS if context.user_data.get('role') == 'student' else TEACHER_COLUMNS
-            user_id = context.user_data['reset_user_id']
+            role = session.role or 'teacher'
+            sheet_name, columns = ROLE_SHEETS[role]
+            user_id = session.reset_user_id
+            sheets = context.bot_data['sheets']
 
             try:
-                cell = sheet.find(user_id)
-                if cell:
-                    row = cell.row
-                    sheet.update_cell(row, columns["password"], new_password)  # Update the password
-                    await update.message.reply_text("✅ Your password has been reset successfully!")
+                row = sheets.find_row(sheet_name, user_id)
+                if row:
+                    written = record_change(
+                        context, PASSWORD_SET, sheet_name, columns, user_id, {"password": new_password}, row=row
+                    )
+                    context.bot_data['roster'].update_account(role, user_id, columns, {"password": new_password})
+                    session.new_password = None
+                    await update.message.reply_text(
+                        "✅ Your password has been reset successfully!" + queued_notice(written)
+                    )
 
                     # Redirect to the role selection
                     return await start(update, context)
@@ -527,41 +558,61 @@ async def forgot_password_reset(update: Update, context: CallbackContext):
             await update.message.reply_text(
                 "❌ Passwords do not match. Please set your password again:"
             )
-            del context.user_data['new_password']  # Clear the temporary password
+            session.new_password = None  # Clear the temporary password
             return "FORGOT_PASSWORD_RESET"
 async def go_back(update: Update, context: CallbackContext):
     # Log the state and user input globally
     await debug_state_transition(update, context)
-    user_role = context.user_data.get('role', 'student').capitalize()
+    user_role = (context.user_data.role or 'student').capitalize()
     logger.info(f"User selected 'Back'. Returning to the {user_role} menu.")
 
     if user_role == "Student":
-        reply_markup = ReplyKeyboardMarkup(
-            [["📚 Access Textbooks", "🎥 Watch Video Lessons"], ["🗂️ View Results", "💬 Teacher Feedback"], ["Log Out"]],
-            one_time_keyboard=True
-        )
-        await update.message.reply_text("🔙 Back to the main menu:", reply_markup=reply_markup)
+        reply_markup = ReplyKeyboardMarkup(STUDENT_MENU_KEYBOARD, one_time_keyboard=True)
+        await update.effective_message.reply_text("🔙 Back to the main menu:", reply_markup=reply_markup)
         return STUDENT_MENU
 
     elif user_role == "Teacher":
-        reply_markup = ReplyKeyboardMarkup(
-            [["📚 Upload Materials", "📊 View Student Performance"], ["🔙 Back to Role Selection"], ["Log Out"]],
-            one_time_keyboard=True
-        )
-        await update.message.reply_text("🔙 Back to the main menu:", reply_markup=reply_markup)
+        reply_markup = ReplyKeyboardMarkup(TEACHER_MENU_KEYBOARD, one_time_keyboard=True)
+        await update.effective_message.reply_text("🔙 Back to the main menu:", reply_markup=reply_markup)
         return TEACHER_MENU
 
+    elif user_role == "Parent":
+        reply_markup = ReplyKeyboardMarkup(PARENT_MENU_KEYBOARD, one_time_keyboard=True)
+        await update.effective_message.reply_text("🔙 Back to the main menu:", reply_markup=reply_markup)
+        return PARENT_MENU
+
+# Store the user's chat ID in their sheet row so scheduled messages can reach them
+def remember_chat_id(update: Update, context: CallbackContext):
+    role = context.user_data.role
+    sheet_name, columns = ROLE_SHEETS[role]
+    if "chat_id" not in columns:
+        return
+
+    user_id = context.user_data.user_id
+    chat_id = str(update.effective_chat.id)
+    if field(session_row(context), columns, "chat_id") == chat_id:
+        return
+
+    try:
+        sheets = context.bot_data['sheets']
+        row = sheets.find_row(sheet_name, user_id)
+        if row:
+            record_change(context, CHAT_ID_SET, sheet_name, columns, user_id, {"chat_id": chat_id}, row=row)
+            context.bot_data['roster'].update_account(role, user_id, columns, {"chat_id": chat_id})
+    except Exception as e:
+        logger.warning(f"Could not store chat ID for user {user_id}: {e}")
+
 # Display welcome message
 async def welcome_message(update: Update, context: CallbackContext):
     # Log the state and user input globally
     await debug_state_transition(update, context)
-    role = context.user_data['role']
-    full_name = context.user_data['full_name']
-    gender = context.user_data['gender']
-    user_id = context.user_data['user_id']
-    grade = context.user_data.get('grade')
-    classroom = context.user_data.get('classroom')
-    subject = context.user_data.get('subject')
+    remember_chat_id(update, context)
+    role = context.user_data.role
+    user_id = context.user_data.user_id
+    sheet_name, columns = ROLE_SHEETS[role]
+    row = session_row(context)
+    full_name = field(row, columns, "full_name")
+    gender = field(row, columns, "gender")
 
     welcome_text = (
         f"🎉 Welcome, {full_name}!\n\n"
@@ -570,54 +621,359 @@ async def welcome_message(update: Update, context: CallbackContext):
         f"🆔 ID: {user_id}\n"
     )
     if role == "student":
-        welcome_text += f"📚 Grade: {grade}\n🛏 Classroom: {classroom}\n\n"
-        reply_markup = ReplyKeyboardMarkup(
-            [["📚 Access Textbooks", "🎥 Watch Video Lessons"], ["🗂️ View Results", "💬 Teacher Feedback"], ["Log Out"]],
-            one_time_keyboard=True
-        )
+        welcome_text += f"📚 Grade: {field(row, columns, 'grade')}\n🛏 Classroom: {field(row, columns, 'classroom')}\n\n"
+        reply_markup = ReplyKeyboardMarkup(STUDENT_MENU_KEYBOARD, one_time_keyboard=True)
         state = STUDENT_MENU
+    elif role == "parent":
+        welcome_text += f"👪 Linked students: {len(parse_children(field(row, columns, 'children')))}\n\n"
+        reply_markup = ReplyKeyboardMarkup(PARENT_MENU_KEYBOARD, one_time_keyboard=True)
+        state = PARENT_MENU
     else:
-        welcome_text += f"📘 Subject: {subject}\n\n"
-        reply_markup = ReplyKeyboardMarkup(
-            [["📚 Upload Materials", "📊 View Student Performance"], ["🔙 Back to Role Selection"], ["Log Out"]],
-            one_time_keyboard=True
-        )
+        welcome_text += f"📘 Subject: {field(row, columns, 'subject')}\n\n"
+        reply_markup = ReplyKeyboardMarkup(TEACHER_MENU_KEYBOARD, one_time_keyboard=True)
         state = TEACHER_MENU
 
     await update.message.reply_text(
-        welcome_text + "What would you like to do?",
+        welcome_text + "What would you like to do?" + stale_notice(context, sheet_name),
         reply_markup=reply_markup
     )
     return state
 
-CHOOSING_ROLE = 0
-STUDENT_AUTH = 1
-TEACHER_AUTH = 2
-STUDENT_MENU = 3
-PROVIDE_FEEDBACK = 4
+# Render profile, results and tuition for several students as one message
+def render_children_overview(entries):
+    return "\n\n".join(
+        render_student_summary(student_id, student, results)
+        for student_id, student, results in entries
+    )
+
 
-# Define handlers for each state
-async def student_menu_handler(update, context):
+# Show every child linked to the parent account, fetched in one batched read
+async def children_overview(update: Update, context: CallbackContext):
     # Log the state and user input globally
     await debug_state_transition(update, context)
-    await update.message.reply_text("Welcome to the Student Menu!")
-    # Add relevant logic here
-    return STUDENT_MENU
+    children = parse_children(field(session_row(context), PARENT_COLUMNS, "children"))
+    reply_markup = ReplyKeyboardMarkup(PARENT_MENU_KEYBOARD, one_time_keyboard=True)
+
+    if not children:
+        await update.message.reply_text(
+            "❌ No students are linked to your account. Please contact the school office.",
+            reply_markup=reply_markup
+        )
+        return PARENT_MENU
+
+    roster = context.bot_data['roster']
+    try:
+        roster.ensure_fresh(context.bot_data['sheets'])
+    except Exception as e:
+        logger.error(f"Error loading roster for children overview: {e}")
+        await update.message.reply_text("❌ Unable to fetch student data. Please try again later.")
+        return PARENT_MENU
+
+    # Several children with long feedback can exceed Telegram's message size
+    chunks = split_message(
+        "👨‍👩‍👧 Children Overview\n\n"
+        + render_children_overview(roster.lookup_many(children))
+        + stale_notice(context, STUDENT_SHEET)
+    )
+    for chunk in chunks[:-1]:
+        await update.message.reply_text(chunk)
+    await update.message.reply_text(chunks[-1], reply_markup=reply_markup)
+    return PARENT_MENU
+
+
+# Today's date in the school's timezone, as stored in the attendance sheet
+def school_today(context: CallbackContext):
+    timezone = ZoneInfo(context.bot_data['config'].get("timezone", "Africa/Addis_Ababa"))
+    return datetime.datetime.now(timezone).date().isoformat()
+
+
+# Inline keyboard for a roll call: one toggle per student, two per row
+def roll_call_keyboard(roll_call):
+    buttons = [
+        InlineKeyboardButton(
+            f"{'✅' if roll_call['present'][i] else '❌'} {name}", callback_data=f"att:{i}"
+        )
+        for i, name in enumerate(roll_call['names'])
+    ]
+    rows = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    rows.append([
+        InlineKeyboardButton("🔙 Back", callback_data="att:back"),
+        InlineKeyboardButton("💾 Submit", callback_data="att:submit"),
+    ])
+    return InlineKeyboardMarkup(rows)
+
 
-async def provide_results_feedback(update, context):
+# Teacher roll call, step 1: choose the class
+async def take_attendance(update: Update, context: CallbackContext):
     # Log the state and user input globally
     await debug_state_transition(update, context)
-    subject = update.message.text
-    if subject == "🔙 Back":
-        await update.message.reply_text(
-            "Returning to the Student Menu...",
-            reply_markup=None  # Add appropriate ReplyKeyboardMarkup here
+    roster = context.bot_data['roster']
+    try:
+        roster.ensure_fresh(context.bot_data['sheets'])
+    except Exception as e:
+        logger.error(f"Error loading roster for attendance: {e}")
+        await update.message.reply_text("❌ Unable to load the class list. Please try again later.")
+        return TEACHER_MENU
+
+    classrooms = roster.classrooms()
+    if not classrooms:
+        await update.message.reply_text("❌ No classes were found in the student list.")
+        return TEACHER_MENU
+
+    reply_markup = ReplyKeyboardMarkup([[classroom] for classroom in classrooms] + [["🔙 Back"]], one_time_keyboard=True)
+    await update.message.reply_text("🗓️ Which class are you taking attendance for?", reply_markup=reply_markup)
+    return "ATTENDANCE_CLASS"
+
+
+# Teacher roll call, step 2: show every student as present, teacher taps the absentees
+async def choose_attendance_class(update: Update, context: CallbackContext):
+    # Log the state and user input globally
+    await debug_state_transition(update, context)
+    classroom = update.message.text
+    if classroom == "🔙 Back":
+        return await go_back(update, context)
+
+    students = context.bot_data['roster'].class_roster(classroom)
+    if not students:
+        await update.message.reply_text("❌ Unknown class. Please choose one from the list.")
+        return "ATTENDANCE_CLASS"
+
+    context.user_data.roll_call = {
+        'classroom': classroom,
+        'student_ids': [student_id for student_id, _ in students],
+        'names': [name for _, name in students],
+        'present': AttendanceBitset.all_present(len(students)),
+    }
+    await update.message.reply_text(
+        f"🗓️ Roll call for {classroom} on {school_today(context)}.\n"
+        "Everyone is marked present. Tap a student to mark them absent, then press Submit.",
+        reply_markup=roll_call_keyboard(context.user_data.roll_call)
+    )
+    return "ATTENDANCE_ROLL"
+
+
+# Teacher roll call, step 3: toggle students and save the whole class in one write
+async def roll_call_callback(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    roll_call = context.user_data.roll_call
+    if roll_call is None:
+        await query.edit_message_text("❌ This roll call has expired. Please start again.")
+        return TEACHER_MENU
+
+    action = query.data.split(":", 1)[1]
+    if action == "back":
+        return await leave_roll_call(update, context)
+    if action != "submit":
+        roll_call['present'].toggle(int(action))
+        await query.edit_message_reply_markup(reply_markup=roll_call_keyboard(roll_call))
+        return "ATTENDANCE_ROLL"
+
+    record = AttendanceRecord(school_today(context), roll_call['classroom'], roll_call['student_ids'], roll_call['present'])
+    sheets = context.bot_data['sheets']
+    store = context.bot_data['attendance']
+    try:
+        store.ensure_loaded(sheets)
+        journal_change(
+            context, ATTENDANCE_TAKEN, ATTENDANCE_SHEET, f"{record.date} {record.classroom}",
+            dict(zip(("date", "classroom", "student_ids", "present"), record.to_row())),
         )
-        return STUDENT_MENU  # Ensure this matches the defined state key
+        store.save(sheets, record)
+    except Exception as e:
+        logger.error(f"Error saving attendance for {record.classroom}: {e}")
+        await query.message.reply_text("❌ Unable to save attendance. Please press Submit again.")
+        return "ATTENDANCE_ROLL"
+
+    names = dict(zip(roll_call['student_ids'], roll_call['names']))
+    absent = [names[student_id] for student_id in record.absentees()]
+    context.user_data.roll_call = None
+    await query.edit_message_text(
+        f"✅ Attendance saved for {record.classroom} on {record.date}: "
+        f"{record.present.count()}/{len(record.student_ids)} present."
+        + (f"\n❌ Absent: {', '.join(absent)}" if absent else "")
+    )
+    await query.message.reply_text(
+        "What would you like to do next?",
+        reply_markup=ReplyKeyboardMarkup(TEACHER_MENU_KEYBOARD, one_time_keyboard=True)
+    )
+    return TEACHER_MENU
+
+
+# Teacher roll call: Back (the inline button or typed) discards it and returns to the menu
+async def leave_roll_call(update: Update, context: CallbackContext):
+    context.user_data.roll_call = None
+    if update.callback_query is not None:
+        await update.callback_query.edit_message_text("🔙 Roll call discarded. Nothing was saved.")
+    return await go_back(update, context)
+
+
+# A roll-call button pressed after the roll call ended; returning None keeps the current state
+async def expired_roll_call(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text("❌ This roll call has expired. Choose 🗓️ Take Attendance to start again.")
+    return None
+
+
+# Student view of their absences this term
+async def my_attendance(update: Update, context: CallbackContext):
+    # Log the state and user input globally
+    await debug_state_transition(update, context)
+    store = context.bot_data['attendance']
+    try:
+        store.ensure_loaded(context.bot_data['sheets'])
+    except Exception as e:
+        logger.error(f"Error loading attendance: {e}")
+        await update.message.reply_text("❌ Unable to fetch attendance. Please try again later.")
+        return STUDENT_MENU
+
+    absent = store.absences(context.user_data.user_id, start=context.bot_data['config'].get("term_start") or None)
+    if absent:
+        text = f"🗓️ You were absent {len(absent)} day(s) this term:\n" + "\n".join(f"  • {date}" for date in absent)
+    else:
+        text = "🗓️ No absences recorded this term. Keep it up!"
+    await update.message.reply_text(text, reply_markup=ReplyKeyboardMarkup(STUDENT_MENU_KEYBOARD, one_time_keyboard=True))
+    return STUDENT_MENU
+
+
+# Teacher search: ask for (part of) a student's name
+async def find_student(update: Update, context: CallbackContext):
+    # Log the state and user input globally
+    await debug_state_transition(update, context)
+    await update.message.reply_text(
+        "🔎 Type a student's name (or part of it). Spelling does not have to be exact.",
+        reply_markup=ReplyKeyboardMarkup([["🔙 Back"]], one_time_keyboard=True)
+    )
+    return "SEARCH_STUDENT"
+
+
+# Teacher search: rank students by name similarity using the in-memory index
+async def search_students(update: Update, context: CallbackContext):
+    # Log the state and user input globally
+    await debug_state_transition(update, context)
+    if context.args is not None:  # /search <name>
+        query = " ".join(context.args)
+    else:
+        query = update.message.text
+    if query == "🔙 Back":
+        return await go_back(update, context)
+    if not query.strip():
+        await update.message.reply_text("🔎 Usage: /search <student name>")
+        return "SEARCH_STUDENT"
+
+    roster = context.bot_data['roster']
+    try:
+        roster.ensure_fresh(context.bot_data['sheets'])
+    except Exception as e:
+        logger.error(f"Error loading roster for student search: {e}")
+        await update.message.reply_text("❌ Unable to search right now. Please try again later.")
+        return "SEARCH_STUDENT"
+
+    matches = roster.search(query, limit=10)
+    if not matches:
+        await update.message.reply_text(f"❌ No students found matching '{query}'. Try another spelling.")
+        return "SEARCH_STUDENT"
+
+    lines = []
+    for position, (student_id, full_name, score) in enumerate(matches, start=1):
+        classroom = field(roster.student(student_id), STUDENT_COLUMNS, "classroom")
+        lines.append(f"{position}. {full_name} — ID {student_id}, {classroom} ({score:.0%})")
+    await update.message.reply_text(
+        f"🔎 Results for '{query}':\n" + "\n".join(lines) + "\n\nType another name or press 🔙 Back.",
+        reply_markup=ReplyKeyboardMarkup([["🔙 Back"]], one_time_keyboard=True)
+    )
+    return "SEARCH_STUDENT"
+
+
+# Report cards, step 1: choose the class
+async def report_cards(update: Update, context: CallbackContext):
+    # Log the state and user input globally
+    await debug_state_transition(update, context)
+    roster = context.bot_data['roster']
+    try:
+        roster.ensure_fresh(context.bot_data['sheets'])
+    except Exception as e:
+        logger.error(f"Error loading roster for report cards: {e}")
+        await update.message.reply_text("❌ Unable to load the class list. Please try again later.")
+        return TEACHER_MENU
+
+    classrooms = roster.classrooms()
+    if not classrooms:
+        await update.message.reply_text("❌ No classes were found in the student list.")
+        return TEACHER_MENU
+
+    reply_markup = ReplyKeyboardMarkup([[classroom] for classroom in classrooms] + [["🔙 Back"]], one_time_keyboard=True)
+    await update.message.reply_text("🧾 Which class do you want report cards for?", reply_markup=reply_markup)
+    return "REPORT_CLASS"
+
+
+# Report cards, step 2: the whole class or a single student
+async def choose_report_class(update: Update, context: CallbackContext):
+    # Log the state and user input globally
+    await debug_state_transition(update, context)
+    classroom = update.message.text
+    if classroom == "🔙 Back":
+        return await go_back(update, context)
+
+    students = context.bot_data['roster'].class_roster(classroom)
+    if not students:
+        await update.message.reply_text("❌ Unknown class. Please choose one from the list.")
+        return "REPORT_CLASS"
+
+    context.user_data.report_class = classroom
+    keyboard = [["📦 Whole class"]] + [[f"{name} ({student_id})"] for student_id, name in students] + [["🔙 Back"]]
+    await update.message.reply_text(
+        f"🧾 {classroom}: send the whole class as one zip file, or pick a student.",
+        reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
+    )
+    return "REPORT_STUDENT"
+
+
+# Report cards, step 3: render in the process pool and send the document
+async def send_report_cards(update: Update, context: CallbackContext):
+    # Log the state and user input globally
+    await debug_state_transition(update, context)
+    choice = update.message.text
+    if choice == "🔙 Back":
+        context.user_data.report_class = None
+        return await go_back(update, context)
 
-    # Handle other logic...
-    return PROVIDE_FEEDBACK  # Example of returning another state
+    config = context.bot_data['config']
+    roster = context.bot_data['roster']
+    renderer = context.bot_data['reports']
+    classroom = context.user_data.report_class
+    class_ids = [student_id for student_id, _ in roster.class_roster(classroom)]
+    if choice == "📦 Whole class":
+        student_ids = class_ids
+    else:
+        student_ids = [student_id for student_id in class_ids if choice.endswith(f"({student_id})")]
+        if not student_ids:
+            await update.message.reply_text("❌ Please pick a student from the list.")
+            return "REPORT_STUDENT"
+
+    cards = [
+        build_card(student_id, roster.student(student_id), roster.results_for(student_id),
+                   config.get("school_name", "X School"), config.get("term_name", "Current term"))
+        for student_id in student_ids
+    ]
+    await update.message.reply_text("⏳ Preparing report cards...")
+    try:
+        if len(cards) == 1 and choice != "📦 Whole class":
+            path = await renderer.render(cards[0])
+            with open(path, "rb") as document:
+                await update.message.reply_document(document=document, filename=report_filename(cards[0]))
+        else:
+            zip_path = await renderer.render_class(cards, classroom)
+            try:
+                with open(zip_path, "rb") as document:
+                    await update.message.reply_document(document=document, filename=f"report_cards_{classroom}.zip")
+            finally:
+                os.remove(zip_path)
+    except Exception as e:
+        logger.error(f"Error generating report cards for {classroom}: {e}")
+        await update.message.reply_text("❌ Unable to generate report cards. Please try again later.")
 
+    return "REPORT_STUDENT"
 
 
 # Example implementation for the "Upload Materials" feature
@@ -648,7 +1004,7 @@ async def view_student_performance(update: Update, context: CallbackContext):
 async def log_out(update: Update, context: CallbackContext):
     # Log the state and user input globally
     await debug_state_transition(update, context)
-    role = context.user_data.get('role', 'user').capitalize()
+    role = (context.user_data.role or 'user').capitalize()
     logger.info(f"User requested logout. Role: {role}")
     await update.message.reply_text(
         f"🔒 To confirm logout, type '{role} Logout'."
@@ -657,16 +1013,14 @@ async def log_out(update: Update, context: CallbackContext):
 
 
 # Updated handle_log_out function
-from debug_utils import debug_state_transition
-
 # Logout confirmation
 async def handle_log_out(update: Update, context: CallbackContext):
     # Log the state and user input for debugging
     await debug_state_transition(update, context)
 
-    logger.debug(f"Current context.user_data: {context.user_data}")
+    logger.debug(f"Current session: {context.user_data}")
     user_input = update.message.text
-    role = context.user_data.get('role', 'User').capitalize()  # Default to "User" if role is missing
+    role = (context.user_data.role or 'User').capitalize()  # Default to "User" if role is missing
     expected_logout = f"{role} Logout"
 
     if user_input.strip() == expected_logout:  # Ensure input matches expected format
@@ -764,16 +1118,15 @@ async def provide_results_feedback(update: Update, context: CallbackContext):
 
     logger.debug("Entering provide_results_feedback function.")
     subject = update.message.text
-    user_id = context.user_data['user_id']
+    user_id = context.user_data.user_id
 
     # Handle the "🔙 Back" button
     if subject == "🔙 Back":
         # Clear unnecessary keys from context.user_data
-        context.user_data.pop('viewing', None)
+        context.user_data.viewing = None
 
         # Redirect the user to the appropriate menu
-        options = [["📚 Access Textbooks", "🎥 Watch Video Lessons"], ["🗂️ View Results", "💬 Teacher Feedback"], ["Log Out"]]
-        reply_markup = ReplyKeyboardMarkup(options, one_time_keyboard=True)
+        reply_markup = ReplyKeyboardMarkup(STUDENT_MENU_KEYBOARD, one_time_keyboard=True)
         await update.message.reply_text(
             "🔙 Back to the main menu:",
             reply_markup=reply_markup
@@ -781,14 +1134,14 @@ async def provide_results_feedback(update: Update, context: CallbackContext):
         return STUDENT_MENU  # Ensure proper state transition
 
     # Logic for fetching feedback from Google Sheets
-    # Example: Retrieve feedback from `results_sheet`
+    # Example: Retrieve feedback from the results sheet
     try:
-        feedback_data = results_sheet.find(user_id)  # Search for user ID in the sheet
-        if feedback_data:
-            row = feedback_data.row
-            feedback_text = results_sheet.cell(row, 2).value  # Adjust column index for feedback
+        sheets = context.bot_data['sheets']
+        row = sheets.find_row(RESULTS_SHEET, user_id)  # Search for user ID in the sheet
+        if row:
+            feedback_text = sheets.cell_value(RESULTS_SHEET, row, 2)  # Adjust column index for feedback
             await update.message.reply_text(
-                f"💬 Feedback for {subject}:\n\n{feedback_text}"
+                f"💬 Feedback for {subject}:\n\n{feedback_text}" + stale_notice(context, RESULTS_SHEET)
             )
         else:
             await update.message.reply_text("❌ No feedback available for this subject.")
@@ -806,9 +1159,9 @@ async def view_results_feedback(update: Update, context: CallbackContext):
     await debug_state_transition(update, context)
     user_choice = update.message.text
     if user_choice == "🗂️ View Results":
-        context.user_data['viewing'] = 'results'
+        context.user_data.viewing = 'results'
     elif user_choice == "💬 Teacher Feedback":
-        context.user_data['viewing'] = 'feedback'
+        context.user_data.viewing = 'feedback'
     else:
         await update.message.reply_text("❌ Invalid choice. Please try again.")
         return "STUDENT_MENU"
@@ -823,108 +1176,449 @@ async def view_results_feedback(update: Update, context: CallbackContext):
     return "CHOOSE_RESULTS"
 
 
+# /cancel ends the conversation and forgets the session
+async def cancel(update: Update, context: CallbackContext):
+    context.user_data.clear()
+    await update.effective_message.reply_text("Operation canceled.", reply_markup=ReplyKeyboardRemove())
+    return ConversationHandler.END
+
+
+# Anything the current state does not expect; returning None keeps the user in that state
+async def invalid_input(update: Update, context: CallbackContext):
+    await update.effective_message.reply_text("❌ Invalid input. Please try again.")
+    return None
+
+
 # Updated ConversationHandler
-conv_handler = ConversationHandler(
-    entry_points=[
-        CommandHandler("start", start),
-        CommandHandler("forgot_password", forgot_password_start)
-    ],
-
-    states={
-        CHOOSING_ROLE: [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, choose_role)
-        ],
-        STUDENT_AUTH: [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, lambda u, c: authenticate_user(student_sheet, STUDENT_COLUMNS, u.message.text, 'student', u, c))
-        ],
-        TEACHER_AUTH: [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, teacher_auth)
-        ],
-        PASSWORD_SETUP: [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, setup_password)
-        ],
-        PASSWORD_CONFIRM: [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_password),
-            CallbackQueryHandler(confirm_password)  # Handle inline "Forgot Password" button
-        ],
-         "FORGOT_PASSWORD_ID": [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, forgot_password_verify_id)
-        ],
-        "FORGOT_PASSWORD_SECURITY": [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, forgot_password_verify_security)
-        ],
-        "FORGOT_PASSWORD_RESET": [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, forgot_password_reset)
-        ],
-        "FORGOT_PASSWORD_CONFIRM_RESET": [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, forgot_password_reset)
-        ],
-        SECURITY_SETUP: [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, setup_security_question)
-        ],
-        WELCOME_MESSAGE: [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, welcome_message)
+def build_conv_handler(conversation_timeout=None):
+    return ConversationHandler(
+        entry_points=[
+            CommandHandler("start", start),
+            CommandHandler("forgot_password", forgot_password_start)
         ],
-        STUDENT_MENU: [
-        MessageHandler(filters.Regex("📚 Access Textbooks"), access_textbooks),
-        MessageHandler(filters.Regex("🎥 Watch Video Lessons"), watch_video_lessons),
-        MessageHandler(filters.Regex("🗂️ View Results"), view_results_feedback),
-        MessageHandler(filters.Regex("💬 Teacher Feedback"), view_results_feedback),
-        MessageHandler(filters.Regex("Log Out"), log_out),
-        MessageHandler(filters.Regex("🔙 Back"), start)  # Back button logic to return to role selection
-        ],
-        TEACHER_MENU: [
-            MessageHandler(filters.Regex("📚 Upload Materials"), upload_materials),
-            MessageHandler(filters.Regex("📊 View Student Performance"), view_student_performance),
-            MessageHandler(filters.Regex("🔙 Back to Role Selection"), start),
-            MessageHandler(filters.Regex("Log Out"), log_out)
-        ],
-        "UPLOAD_MATERIALS": [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, go_back)  # Replace with actual upload handling logic
-        ],
-        "VIEW_PERFORMANCE": [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, go_back)  # Replace with actual performance viewing logic
-        ],
-        "CHOOSE_TEXTBOOK": [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, provide_textbook_link)
-        ],
-        "CHOOSE_VIDEO": [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, provide_video_link)  # New state for video lessons
-        ],
-        "CHOOSE_RESULTS": [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, provide_results_feedback)  # New state for results/feedback
-        ],
-        "LOG_OUT": [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, handle_log_out)  # Log out state
+
+        states={
+            CHOOSING_ROLE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, choose_role)
+            ],
+            STUDENT_AUTH: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, student_auth)
+            ],
+            TEACHER_AUTH: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, teacher_auth)
+            ],
+            PARENT_AUTH: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, parent_auth)
+            ],
+            PASSWORD_SETUP: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, setup_password)
+            ],
+            "PASSWORD_CONFIRM_SETUP": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_setup_password)
+            ],
+            PASSWORD_CONFIRM: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_password),
+                CallbackQueryHandler(confirm_password)  # Handle inline "Forgot Password" button
+            ],
+             "FORGOT_PASSWORD_ID": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, forgot_password_verify_id)
+            ],
+            "FORGOT_PASSWORD_SECURITY": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, forgot_password_verify_security)
+            ],
+            "FORGOT_PASSWORD_RESET": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, forgot_password_reset)
+            ],
+            "FORGOT_PASSWORD_CONFIRM_RESET": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, forgot_password_reset)
+            ],
+            SECURITY_SETUP: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, setup_security_question)
+            ],
+            WELCOME_MESSAGE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, welcome_message)
+            ],
+            STUDENT_MENU: [
+            MessageHandler(filters.Regex("📚 Access Textbooks"), access_textbooks),
+            MessageHandler(filters.Regex("🎥 Watch Video Lessons"), watch_video_lessons),
+            MessageHandler(filters.Regex("🗂️ View Results"), view_results_feedback),
+            MessageHandler(filters.Regex("💬 Teacher Feedback"), view_results_feedback),
+            MessageHandler(filters.Regex("🗓️ My Attendance"), my_attendance),
+            MessageHandler(filters.Regex("Log Out"), log_out),
+            MessageHandler(filters.Regex("🔙 Back"), start)  # Back button logic to return to role selection
+            ],
+            TEACHER_MENU: [
+                MessageHandler(filters.Regex("📚 Upload Materials"), upload_materials),
+                MessageHandler(filters.Regex("📊 View Student Performance"), view_student_performance),
+                MessageHandler(filters.Regex("🗓️ Take Attendance"), take_attendance),
+                MessageHandler(filters.Regex("🔎 Find Student"), find_student),
+                MessageHandler(filters.Regex("🧾 Report Cards"), report_cards),
+                CommandHandler("search", search_students),
+                MessageHandler(filters.Regex("🔙 Back to Role Selection"), start),
+                MessageHandler(filters.Regex("Log Out"), log_out)
+            ],
+            PARENT_MENU: [
+                MessageHandler(filters.Regex("👨‍👩‍👧 Children Overview"), children_overview),
+                MessageHandler(filters.Regex("Log Out"), log_out)
+            ],
+            "ATTENDANCE_CLASS": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, choose_attendance_class)
+            ],
+            "ATTENDANCE_ROLL": [
+                CallbackQueryHandler(roll_call_callback, pattern="^att:"),
+                MessageHandler(filters.Regex("^🔙 Back$"), leave_roll_call)
+            ],
+            "SEARCH_STUDENT": [
+                CommandHandler("search", search_students),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, search_students)
+            ],
+            "REPORT_CLASS": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, choose_report_class)
+            ],
+            "REPORT_STUDENT": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, send_report_cards)
+            ],
+            "UPLOAD_MATERIALS": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, go_back)  # Replace with actual upload handling logic
+            ],
+            "VIEW_PERFORMANCE": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, go_back)  # Replace with actual performance viewing logic
+            ],
+            "CHOOSE_TEXTBOOK": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, provide_textbook_link)
+            ],
+            "CHOOSE_VIDEO": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, provide_video_link)  # New state for video lessons
+            ],
+            "CHOOSE_RESULTS": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, provide_results_feedback)  # New state for results/feedback
+            ],
+            "LOG_OUT": [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_log_out)  # Log out state
+            ],
+        },
+        fallbacks=[
+            CommandHandler("cancel", cancel),
+            MessageHandler(filters.ALL, invalid_input),
+            CallbackQueryHandler(expired_roll_call, pattern="^att:"),  # Leftover roll-call keyboards
+            CallbackQueryHandler(forgot_password_start, pattern="^forgot_password$")
         ],
-    },
-    fallbacks=[
-        CommandHandler("cancel", lambda update, context: update.message.reply_text("Operation canceled.")),
-        MessageHandler(filters.ALL, lambda u, c: u.message.reply_text("❌ Invalid input. Please try again.")),
-        CallbackQueryHandler(forgot_password_start)  # Ensure callback queries are handled
-    ],
-)
+        conversation_timeout=conversation_timeout,  # Idle conversations end, like their sessions
+    )
+
+# Weekly job: read the sheets once, build every digest in one pass and send them paced
+async def send_weekly_digest(context: CallbackContext):
+    sheets = context.bot_data['sheets']
+    config = context.bot_data['config']
+    try:
+        student_rows = sheets.get_all_values(STUDENT_SHEET)[1:]
+        result_rows = sheets.get_all_values(RESULTS_SHEET)[1:]
+        try:
+            parent_rows = sheets.get_all_values(PARENT_SHEET)[1:]
+        except Exception as e:
+            logger.warning(f"Parents sheet unavailable, sending student digests only: {e}")
+            parent_rows = []
+    except Exception as e:
+        logger.error(f"Weekly digest skipped, could not read the sheets: {e}")
+        return
+
+    # The rows are fresh, so let the roster index reuse them
+    context.bot_data['roster'].load(student_rows, result_rows)
+
+    state_path = config.get("digest_state_path")
+    if 'digest_seen' not in context.bot_data:
+        context.bot_data['digest_seen'] = load_seen(state_path)
+    messages, seen = build_digests(student_rows, result_rows, parent_rows, context.bot_data['digest_seen'])
+    logger.info(f"Sending {len(messages)} weekly digests.")
+    stats = await send_paced(
+        context.bot, messages,
+        rate=config.get("send_rate", 20.0), concurrency=config.get("send_concurrency", 8)
+    )
+    logger.info(f"Weekly digest done: {stats}")
+    context.bot_data['digest_seen'] = seen
+    try:
+        save_seen(state_path, seen)
+    except OSError as e:
+        logger.warning(f"Could not save digest state to {state_path}: {e}")
+
+
+# Frequent job: push results that were just posted to the students and parents concerned
+async def check_new_results(context: CallbackContext):
+    sheets = context.bot_data['sheets']
+    config = context.bot_data['config']
+    watcher = context.bot_data['results_watcher']
+    try:
+        changes = watcher.poll(sheets)
+    except Exception as e:
+        logger.warning(f"Results check skipped: {e}")
+        return
+    if changes is None:
+        return
+
+    roster = context.bot_data['roster']
+    if not changes:
+        roster.load_results(watcher.rows)  # Fresh rows for free
+        return
+
+    # Re-read the students too, so chat IDs stored at recent logins are picked up
+    try:
+        roster.load(sheets.get_all_values(STUDENT_SHEET)[1:], watcher.rows)
+    except Exception as e:
+        logger.warning(f"Students sheet unavailable, using the cached roster: {e}")
+        roster.load_results(watcher.rows)
+    try:
+        parent_rows = sheets.get_all_values(PARENT_SHEET)[1:]
+    except Exception as e:
+        logger.warning(f"Parents sheet unavailable, notifying students only: {e}")
+        parent_rows = []
+
+    # Results are posted in the sheet directly; the journal keeps what the bot saw and when
+    for row in changes:
+        student_id, subject = result_key(row)
+        journal_change(
+            context, RESULT_POSTED, RESULTS_SHEET, student_id, {subject: field(row, RESULTS_COLUMNS, "result")}
+        )
+
+    messages = build_notifications(changes, roster.students, parent_rows)
+    logger.info(f"{len(changes)} new or changed results; sending {len(messages)} notifications.")
+    stats = await send_paced(
+        context.bot, messages,
+        rate=config.get("send_rate", 20.0), concurrency=config.get("send_concurrency", 8)
+    )
+    logger.info(f"Result notifications done: {stats}")
+
+
+# Every update marks its user's session as active
+async def touch_session(update: Update, context: CallbackContext):
+    if update.effective_user is not None:
+        context.user_data.touch()
+
+
+# Periodic job: forget the sessions of users who have been idle for too long
+async def sweep_idle_sessions(context: CallbackContext):
+    timeout = context.bot_data['config'].get("session_idle_timeout", 3600.0)
+    now = time.monotonic()
+    application = context.application
+    idle = [user_id for user_id, session in application.user_data.items() if session.idle_for(now) >= timeout]
+    for user_id in idle:
+        application.drop_user_data(user_id)
+    # Cached teacher and parent rows go with the last session that used them (also after logout)
+    forgotten = context.bot_data['roster'].forget_accounts(
+        {(session.role, session.user_id) for session in application.user_data.values()}
+    )
+    if idle or forgotten:
+        logger.info(
+            f"Evicted {len(idle)} idle sessions and {forgotten} cached accounts; "
+            f"{len(application.user_data)} sessions remain."
+        )
+
 
-# Debugging State Transitions
-async def debug_state_transition(update: Update, context: CallbackContext):
-    context.user_data['current_state'] = context.user_data.get('current_state', "UNKNOWN")
-    logger.debug(f"Current state: {context.user_data['current_state']}")
-    logger.debug(f"User input: {update.message.text if update.message else 'No message'}")
+def schedule_jobs(application, config):
+    if application.job_queue is None:
+        logger.warning("JobQueue unavailable (install python-telegram-bot[job-queue]). Scheduled jobs are disabled.")
+        return
+
+    hour, minute = (int(part) for part in config.get("digest_time", "16:00").split(":"))
+    application.job_queue.run_daily(
+        send_weekly_digest,
+        time=datetime.time(hour, minute, tzinfo=ZoneInfo(config.get("timezone", "Africa/Addis_Ababa"))),
+        days=(config.get("digest_day", 5),),
+        name="weekly_digest",
+    )
+    if config.get("results_poll_interval"):
+        application.job_queue.run_repeating(
+            check_new_results, interval=config["results_poll_interval"], first=5, name="results_watcher"
+        )
+    if config.get("session_idle_timeout"):
+        application.job_queue.run_repeating(
+            sweep_idle_sessions, interval=config.get("session_sweep_interval", 300.0), name="session_sweeper"
+        )
+
+
+# Sample the event loop for `seconds` and time every update per conversation state,
+# then send the summary and a flamegraph file to `chat_ids`.
+# Nothing is installed outside of a profiling run.
+async def run_profile(application, seconds, chat_ids):
+    config = application.bot_data['config']
+    conv_handler = application.bot_data['conv_handler']
+    timer = StateTimer(conv_handler, STATE_NAMES)
+    before, after = TypeHandler(Update, timer.before), TypeHandler(Update, timer.after)
+    application.add_handler(before, group=-1)
+    application.add_handler(after, group=1)
+    profiler = SamplingProfiler(
+        threading.get_ident(), interval=config.get("profile_interval", 0.005), handler_codes=handler_codes(conv_handler)
+    ).start()
+    logger.info(f"Profiling for {seconds:.0f}s.")
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+        application.remove_handler(before, group=-1)
+        application.remove_handler(after, group=1)
+        application.bot_data.pop('profiling', None)
+
+    summary = render_summary(profiler, timer)
+    path = profiler.write_collapsed(profile_path(config.get("profile_dir", "data/profiles")))
+    logger.info(f"Profile written to {path}\n{summary}")
+    for chat_id in chat_ids:
+        try:
+            await application.bot.send_message(chat_id, summary)
+            with open(path, "rb") as document:
+                await application.bot.send_document(
+                    chat_id, document, filename=os.path.basename(path),
+                    caption="Collapsed stacks for flamegraph.pl or speedscope.app"
+                )
+        except Exception as e:
+            logger.warning(f"Could not send the profile to {chat_id}: {e}")
+
+
+def start_profile(application, seconds, chat_ids):
+    if application.bot_data.get('profiling') is not None:
+        return False
+    application.bot_data['profiling'] = application.create_task(run_profile(application, seconds, chat_ids))
+    return True
+
+
+# Admin command: /profile [seconds]
+async def profile_command(update: Update, context: CallbackContext):
+    config = context.bot_data['config']
+    seconds = config.get("profile_seconds", 30.0)
+    if context.args:
+        try:
+            seconds = min(max(float(context.args[0]), 1.0), 300.0)
+        except ValueError:
+            await update.message.reply_text("Usage: /profile [seconds]")
+            raise ApplicationHandlerStop
+
+    if start_profile(context.application, seconds, [update.effective_chat.id]):
+        await update.message.reply_text(f"⏱️ Profiling the bot for {seconds:.0f}s...")
+    else:
+        await update.message.reply_text("⏱️ A profile is already running.")
+    # Keep the command away from the conversation
+    raise ApplicationHandlerStop
+
+
+# Admin command: /audit <user ID> lists the journaled changes to that account
+async def audit_command(update: Update, context: CallbackContext):
+    journal = context.bot_data.get('journal')
+    if journal is None:
+        await update.message.reply_text("🧾 The change journal is disabled (JOURNAL_PATH is empty).")
+        raise ApplicationHandlerStop
+    if len(context.args) != 1:
+        await update.message.reply_text("Usage: /audit <user ID>")
+        raise ApplicationHandlerStop
+
+    user_id = context.args[0]
+    timezone = ZoneInfo(context.bot_data['config'].get("timezone", "Africa/Addis_Ababa"))
+    events = journal.history(key=user_id)
+    lines = [f"🧾 Journaled changes to {user_id} since the last compaction: {len(events)}"]
+    for event in events[-20:]:
+        when = datetime.datetime.fromtimestamp(event.timestamp, timezone).strftime("%Y-%m-%d %H:%M")
+        lines.append(f"  {when}  {EVENT_NAMES.get(event.type, event.type)} ({event.sheet}): {', '.join(event.fields)}")
+    for (sheet, key), fields in journal.state.items():
+        if key == user_id:
+            lines.append(f"Latest journaled values in {sheet}: "
+                         + ", ".join(f"{name}={value}" for name, value in fields.items()))
+    for chunk in split_message("\n".join(lines)):
+        await update.message.reply_text(chunk)
+    # Keep the command away from the conversation
+    raise ApplicationHandlerStop
+
+
+# `kill -USR1 <pid>` profiles with the default duration and sends the result to every admin
+async def install_signal_handlers(application):
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    config = application.bot_data['config']
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGUSR1,
+        lambda: start_profile(application, config.get("profile_seconds", 30.0), config.get("admin_ids", [])),
+    )
+
+
+# Release worker processes and files when the bot stops
+async def close_resources(application):
+    application.bot_data['sheets'].close()
+    reports = application.bot_data.get('reports')
+    if reports is not None:
+        reports.executor.shutdown(wait=False, cancel_futures=True)
+    journal = application.bot_data.get('journal')
+    if journal is not None:
+        journal.close()
+    recorder = application.bot_data.get('recorder')
+    if recorder is not None:
+        recorder.close()
+
+
+# Build the Application. Nothing connects to Google until the first handler needs data.
+def create_application(config, sheets_backend=None, request=None):
+    if sheets_backend is None:
+        sheets_backend = GspreadBackend(
+            config["google_creds"],
+            pool_size=config.get("sheets_pool_size", 1),
+            connect_timeout=config.get("sheets_connect_timeout", 5.0),
+            read_timeout=config.get("sheets_read_timeout", 20.0),
+            refresh_margin=config.get("token_refresh_margin", 300.0),
+        )
+
+    breaker = CircuitBreaker(
+        failure_threshold=config.get("sheets_failure_threshold", 3),
+        reset_timeout=config.get("sheets_reset_timeout", 30.0),
+    )
+    sheets_backend = ResilientBackend(
+        sheets_backend, breaker, refresh_interval=config.get("sheets_snapshot_interval", 300.0)
+    )
+
+    builder = Application.builder().token(config["bot_token"]).context_types(ContextTypes(user_data=Session))
+    if request is not None:  # Replays talk to a fake Telegram API
+        builder = builder.request(request)
+    application = builder.post_init(install_signal_handlers).post_shutdown(close_resources).build()
+    application.bot_data['config'] = config
+    application.bot_data['sheets'] = sheets_backend
+    application.bot_data['roster'] = RosterIndex(ttl=config.get("roster_ttl", 60.0))
+    application.bot_data['attendance'] = AttendanceStore(origin=config.get("term_start") or None)
+    application.bot_data['results_watcher'] = ResultsWatcher()
+    # Workers must not be forked from this process: by then it runs threads (token refresh,
+    # asyncio.to_thread, the JobQueue) and a fork can copy a lock some thread is holding
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    application.bot_data['reports'] = ReportCardRenderer(
+        config.get("report_cache_dir", "data/report_cache"),
+        ProcessPoolExecutor(
+            max_workers=config.get("report_workers", 2), mp_context=multiprocessing.get_context(start_method)
+        ),
+        max_entries=config.get("report_cache_max", 2000),
+    )
+    if config.get("journal_path"):
+        application.bot_data['journal'] = Journal(
+            config["journal_path"], compact_every=config.get("journal_compact_every", 100_000)
+        ).open()
+    if config.get("admin_ids"):
+        admins = filters.User(user_id=config["admin_ids"])
+        application.add_handler(CommandHandler("profile", profile_command, filters=admins), group=-2)
+        application.add_handler(CommandHandler("audit", audit_command, filters=admins), group=-2)
+    application.bot_data['conv_handler'] = build_conv_handler(config.get("session_idle_timeout") or None)
+    application.add_handler(application.bot_data['conv_handler'])
+    application.add_handler(TypeHandler(Update, touch_session), group=-4)
+    if config.get("record_dir"):
+        recorder = UpdateRecorder(
+            recording_path(config["record_dir"]), application.bot_data['conv_handler'],
+            state_names=STATE_NAMES, public_texts=RECORD_PUBLIC_TEXTS,
+            key=config.get("record_key"),
+        ).open()
+        application.bot_data['recorder'] = recorder
+        # Groups -1 and 1 are used by profiling runs, -2 by /profile and /audit, -4 by touch_session
+        application.add_handler(TypeHandler(Update, recorder.before), group=-3)
+        application.add_handler(TypeHandler(Update, recorder.after), group=2)
+    schedule_jobs(application, config)
+    return application
 
 
 # Main function
 def main():
-    bot_token = os.getenv("BOT_TOKEN")  # Get the token from .env file
-    application = Application.builder().token(bot_token).build()
-
-  
-    application.add_handler(conv_handler)
+    application = create_application(load_config())
     logger.info("Starting the bot...")
     application.run_polling()
-    
-if __name__ == '__main__':
-    main()
-    
 
- 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from google.auth.exceptions import TransportError
+
+from sheets_backend import SheetsBackend, InMemoryBackend
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the backend while the circuit is open."""
+
+
+def is_outage(error):
+    """
+    True if `error` means Google Sheets is unreachable or overloaded: the circuit is
+    open, the connection failed or timed out, or the API answered 429/5xx.
+
+    Anything else (4xx answers, a missing spreadsheet, a bad value) is a problem with
+    the request itself; retrying it cannot help and it says nothing about the service.
+    """
+    if isinstance(error, CircuitOpenError):
+        return True
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    # requests' ConnectionError and Timeout are OSErrors too
+    return isinstance(error, (OSError, TransportError))
+
+
+# Classic three-state circuit breaker
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self._clock() - self._opened_at < self.reset_timeout:
+                return False
+            # Half-open: let exactly one probe through
+            if self._probing:
+                return False
+            self._state = self.HALF_OPEN
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Google Sheets is reachable again. Closing the circuit.")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"Opening the circuit after {self._failures} consecutive failures.")
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+            self._probing = False
+
+    def call(self, func, *args):
+        if not self.allow_request():
+            raise CircuitOpenError("Google Sheets circuit is open")
+        try:
+            result = func(*args)
+        except Exception as e:
+            if is_outage(e):
+                self.record_failure()
+            else:
+                self.record_success()  # Sheets answered; the request itself was bad
+            raise
+        self.record_success()
+        return result
+
+
+# Backend wrapper that fails fast through the breaker, serves reads from the
+# last known good snapshot while Sheets is unavailable and queues writes until
+# it is back. Errors that are not outages are raised to the caller as usual.
+class ResilientBackend(SheetsBackend):
+    def __init__(self, backend, breaker=None, refresh_interval=300.0, clock=time.time):
+        self.backend = backend
+        self.breaker = breaker or CircuitBreaker()
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._snapshot = InMemoryBackend()
+        self._snapshot_at = {}
+        self._stale = set()
+        self.pending_writes = deque()
+
+    # Snapshot bookkeeping
+
+    def _store_snapshot(self, sheet_name, rows):
+        self._snapshot.sheets[sheet_name] = [list(row) for row in rows]
+        self._snapshot_at[sheet_name] = self._clock()
+        self._stale.discard(sheet_name)
+
+    def _refresh_if_due(self, sheet_name):
+        taken_at = self._snapshot_at.get(sheet_name)
+        if taken_at is not None and self._clock() - taken_at < self.refresh_interval:
+            return
+        try:
+            self._store_snapshot(sheet_name, self.breaker.call(self.backend.get_all_values, sheet_name))
+        except Exception as e:
+            logger.warning(f"Could not refresh snapshot of '{sheet_name}': {e}")
+
+    def snapshot_age(self, sheet_name):
+        """Seconds since the snapshot of `sheet_name` was taken, or None if there is none."""
+        taken_at = self._snapshot_at.get(sheet_name)
+        return None if taken_at is None else self._clock() - taken_at
+
+    def is_stale(self, sheet_name):
+        """True if the last read of `sheet_name` was answered from the snapshot."""
+        return sheet_name in self._stale
+
+    def close(self):
+        self.backend.close()
+
+    def _read(self, sheet_name, method, *args):
+        try:
+            result = self.breaker.call(getattr(self.backend, method), sheet_name, *args)
+        except Exception as e:
+            if not is_outage(e) or sheet_name not in self._snapshot.sheets:
+                raise
+            logger.warning(f"Serving '{sheet_name}' from snapshot ({type(e).__name__}).")
+            self._stale.add(sheet_name)
+            return getattr(self._snapshot, method)(sheet_name, *args)
+
+        self._stale.discard(sheet_name)
+        self.flush_pending()
+        if method == "get_all_values":
+            self._store_snapshot(sheet_name, result)
+        else:
+            self._refresh_if_due(sheet_name)
+        return result
+
+    # Reads
+
+    def find_row(self, sheet_name, value):
+        return self._read(sheet_name, "find_row", value)
+
+    def row_values(self, sheet_name, row):
+        return self._read(sheet_name, "row_values", row)
+
+    def cell_value(self, sheet_name, row, col):
+        return self._read(sheet_name, "cell_value", row, col)
+
+    def get_all_values(self, sheet_name):
+        return self._read(sheet_name, "get_all_values")
+
+    def revision(self, sheet_name):
+        # No snapshot fallback: a stale answer here would hide changes
+        return self.breaker.call(self.backend.revision, sheet_name)
+
+    # Writes
+
+    def update_cell(self, sheet_name, row, col, value):
+        return self.update_cells(sheet_name, [(row, col, value)])
+
+    def update_cells(self, sheet_name, updates):
+        """Returns True once written to the sheet, False while the write is queued."""
+        return self._write("update_cells", sheet_name, list(updates))[0]
+
+    def append_row(self, sheet_name, values):
+        """Returns the row number the row was written to, or None while the write is queued."""
+        return self._write("append_row", sheet_name, list(values))[1]
+
+    def _write(self, method, sheet_name, payload):
+        # Queued first, so the write cannot overtake older ones still waiting for Sheets
+        entry = (method, sheet_name, payload)
+        self.pending_writes.append(entry)
+        result = self._flush(entry)
+
+        if sheet_name in self._snapshot.sheets:
+            getattr(self._snapshot, method)(sheet_name, payload)
+        if self.pending_writes:  # Still holds `entry`, the newest write
+            logger.warning(f"Queued write to '{sheet_name}'; {len(self.pending_writes)} write(s) pending.")
+            return False, None
+        return True, result
+
+    def _flush(self, entry=None):
+        # Returns the backend's answer to `entry`, and raises its error if Sheets rejects it
+        result = None
+        while self.pending_writes:
+            current = self.pending_writes[0]
+            method, sheet_name, payload = current
+            try:
+                answer = self.breaker.call(getattr(self.backend, method), sheet_name, payload)
+            except Exception as e:
+                if is_outage(e):
+                    logger.debug(f"Write to '{sheet_name}' still pending: {e}")
+                    break
+                self.pending_writes.popleft()
+                if current is entry:
+                    raise
+                logger.error(f"Dropping write to '{sheet_name}' rejected by Google Sheets: {e!r}")
+                continue
+            self.pending_writes.popleft()
+            if current is entry:
+                result = answer
+        return result
+
+    def flush_pending(self):
+        """
+        Replay queued writes in order, stopping at the first outage so the rest stay queued.
+        Writes that Sheets rejects are dropped instead, so they cannot hold up later ones.
+
+        Returns:
+            bool: True if nothing is left in the queue.
+        """
+        self._flush()
+        return not self.pending_writes
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from telegram.constants import MessageLimit
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+from roster import field, parse_children
+from sheets_backend import STUDENT_COLUMNS, PARENT_COLUMNS, RESULTS_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+
+# Profile, results and tuition of one student as a message section.
+# Rows whose (result, feedback) differ from `previous` are marked as new.
+def render_student_summary(student_id, student, results, previous=None):
+    if student is None:
+        return f"❓ No student found with ID {student_id}. Please contact the school office."
+
+    lines = [
+        f"👤 {field(student, STUDENT_COLUMNS, 'full_name')} (ID: {student_id})",
+        f"📚 Grade: {field(student, STUDENT_COLUMNS, 'grade')}  🛏 Classroom: {field(student, STUDENT_COLUMNS, 'classroom')}",
+        f"💵 Tuition: {field(student, STUDENT_COLUMNS, 'tuition') or 'No record'}",
+    ]
+    if not results:
+        lines.append("🗂️ No results posted yet.")
+        return "\n".join(lines)
+
+    lines.append("🗂️ Results:")
+    for row in results:
+        subject = field(row, RESULTS_COLUMNS, 'subject') or 'General'
+        result = field(row, RESULTS_COLUMNS, 'result')
+        feedback = field(row, RESULTS_COLUMNS, 'feedback')
+        is_new = previous is not None and previous.get((student_id, subject)) != (result, feedback)
+        line = f"  • {subject}: {result or '-'}{' 🆕' if is_new else ''}"
+        if feedback:
+            line += f"\n    💬 {feedback}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+# Telegram counts message length in UTF-16 code units, so most emoji count twice
+def message_length(text):
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_message(text, limit=MessageLimit.MAX_TEXT_LENGTH, separators=("\n\n", "\n")):
+    """Split `text` into messages Telegram accepts, at blank lines, then line breaks, when possible."""
+    if message_length(text) <= limit:
+        return [text]
+    if not separators:  # A single overlong line: cut it wherever the limit falls
+        chunks, current, size = [], "", 0
+        for char in text:
+            width = 2 if ord(char) > 0xFFFF else 1
+            if size + width > limit:
+                chunks.append(current)
+                current, size = "", 0
+            current += char
+            size += width
+        return chunks + [current]
+
+    separator = separators[0]
+    chunks = []
+    current = None
+    for part in text.split(separator):
+        if current is not None and message_length(current + separator + part) <= limit:
+            current += separator + part
+            continue
+        if current is not None:
+            chunks.append(current)
+        pieces = split_message(part, limit, separators[1:])
+        chunks.extend(pieces[:-1])
+        current = pieces[-1]
+    chunks.append(current)
+    return chunks
+
+
+def build_digests(student_rows, result_rows, parent_rows, previous=None):
+    """
+    Build every weekly digest from already-fetched sheet rows in one pass.
+
+    Args:
+        student_rows, result_rows, parent_rows (list[list[str]]): Sheet rows without the header.
+        previous (dict | None): `{(student_id, subject): (result, feedback)}` from the last digest,
+            used to mark new results. None on the first run.
+
+    Returns:
+        tuple: `([(chat_id, text), ...], seen)` where `seen` is the value to pass as
+        `previous` next time.
+    """
+    results = {}
+    seen = {}
+    for row in result_rows:
+        student_id = field(row, RESULTS_COLUMNS, 'id')
+        if not student_id:
+            continue
+        results.setdefault(student_id, []).append(row)
+        subject = field(row, RESULTS_COLUMNS, 'subject') or 'General'
+        seen[(student_id, subject)] = (field(row, RESULTS_COLUMNS, 'result'), field(row, RESULTS_COLUMNS, 'feedback'))
+
+    messages = []
+    students = {}
+    for row in student_rows:
+        student_id = field(row, STUDENT_COLUMNS, 'id')
+        if not student_id:
+            continue
+        students[student_id] = row
+        chat_id = field(row, STUDENT_COLUMNS, 'chat_id')
+        if chat_id:
+            summary = render_student_summary(student_id, row, results.get(student_id, []), previous)
+            messages.append((chat_id, "📰 Your weekly digest\n\n" + summary))
+
+    for row in parent_rows:
+        chat_id = field(row, PARENT_COLUMNS, 'chat_id')
+        children = parse_children(field(row, PARENT_COLUMNS, 'children'))
+        if not chat_id or not children:
+            continue
+        sections = [
+            render_student_summary(student_id, students.get(student_id), results.get(student_id, []), previous)
+            for student_id in children
+        ]
+        messages.append((chat_id, "📰 Weekly digest for your children\n\n" + "\n\n".join(sections)))
+
+    return messages, seen
+
+
+# Previous digest state, kept on disk so the first digest after a restart still marks new results
+def load_seen(path):
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {(student_id, subject): (result, feedback) for student_id, subject, result, feedback in json.load(f)}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read digest state from {path}: {e}")
+        return None
+
+
+def save_seen(path, seen):
+    if not path:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump([[student_id, subject, result, feedback] for (student_id, subject), (result, feedback) in seen.items()], f)
+    os.replace(temporary, path)
+
+
+# Hands out send slots at `rate` per second. Flood control from Telegram pauses every
+# sender, not only the one that hit it: waiting senders queue up again behind the pause.
+class Pacer:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = time.monotonic()
+        self._paused_until = 0.0
+
+    async def wait(self):
+        while True:
+            now = time.monotonic()
+            slot = max(self._next, self._paused_until, now)
+            self._next = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            if time.monotonic() >= self._paused_until:
+                return
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._next = max(self._next, self._paused_until)
+
+
+async def send_paced(bot, messages, rate=20.0, concurrency=8, attempts=3):
+    """
+    Send `(chat_id, text)` messages concurrently without exceeding `rate` messages per second.
+    Texts over Telegram's size limit are sent as several messages, in order.
+
+    Returns:
+        dict: Counts of `sent`, `blocked` (user stopped the bot) and `failed` messages.
+    """
+    stats = {"sent": 0, "blocked": 0, "failed": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+    pacer = Pacer(rate)
+
+    async def send_chunk(chat_id, text):
+        for attempt in range(attempts):
+            await pacer.wait()
+            async with semaphore:
+                try:
+                    await bot.send_message(chat_id=chat_id, text=text)
+                    return "sent"
+                except RetryAfter as e:
+                    logger.warning(f"Flood control hit, pausing every send for {e.retry_after}s.")
+                    pacer.pause(e.retry_after)
+                except Forbidden:
+                    return "blocked"
+                except TelegramError as e:
+                    logger.error(f"Failed to send message to {chat_id}: {e}")
+                    return "failed"
+        logger.error(f"Gave up sending to {chat_id} after {attempts} flood control pauses.")
+        return "failed"
+
+    async def send(chat_id, text):
+        for chunk in split_message(text):
+            outcome = await send_chunk(chat_id, chunk)
+            if outcome != "sent":
+                break
+        stats[outcome] += 1
+
+    await asyncio.gather(*(send(chat_id, text) for chat_id, text in messages))
+    return stats
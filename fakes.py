@@ -0,0 +1,54 @@
+"""
+Stand-ins shared by the tests and replay_updates.py: sheet rows built by column
+name, and a Bot API that answers locally.
+"""
+import json
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+
+def header(columns):
+    return [name for name, _ in sorted(columns.items(), key=lambda item: item[1])]
+
+
+def make_row(columns, **values):
+    row = [""] * max(columns.values())
+    for name, value in values.items():
+        row[columns[name] - 1] = value
+    return row
+
+
+# Answers Bot API calls locally: counts every call and keeps the text of every message sent or edited
+class FakeTelegramRequest(BaseRequest):
+    def __init__(self, default_chat_id=1):
+        self.default_chat_id = default_chat_id
+        self.calls = Counter()
+        self.texts = []
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif endpoint.startswith(("send", "edit")):
+            parameters = request_data.parameters if request_data is not None else {}
+            if "text" in parameters:
+                self.texts.append(parameters["text"])
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": int(parameters.get("chat_id", self.default_chat_id)), "type": "private"},
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
@@ -0,0 +1,280 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Event types. Tuition is only ever edited in the sheet by the school office, so
+# there is nothing for the bot to journal for it (type 4 stays unused).
+PASSWORD_SET = 1
+ACCOUNT_CREATED = 2
+RESULT_POSTED = 3
+CHAT_ID_SET = 5
+ATTENDANCE_TAKEN = 6
+
+EVENT_NAMES = {
+    PASSWORD_SET: "password_set",
+    ACCOUNT_CREATED: "account_created",
+    RESULT_POSTED: "result_posted",
+    CHAT_ID_SET: "chat_id_set",
+    ATTENDANCE_TAKEN: "attendance_taken",
+}
+
+# Only the fact that these changed is journaled, never their values
+SECRET_FIELDS = frozenset({"password", "security_question", "security_answer"})
+REDACTED = "<redacted>"
+
+MAGIC = b"SBJ1"
+FILE_HEADER = struct.Struct("<4sQ")  # magic, generation
+# Record header: payload length, CRC32 of (type, timestamp, payload), type, timestamp
+RECORD_HEADER = struct.Struct("<IIBd")
+SEPARATOR = "\x1f"
+
+
+class JournalEvent:
+    __slots__ = ("type", "timestamp", "sheet", "key", "fields")
+
+    def __init__(self, type, timestamp, sheet, key, fields):
+        self.type = type
+        self.timestamp = timestamp
+        self.sheet = sheet
+        self.key = key
+        self.fields = fields
+
+    def __repr__(self):
+        return f"JournalEvent({EVENT_NAMES.get(self.type, self.type)}, {self.sheet}/{self.key}, {self.fields})"
+
+
+def redact(fields):
+    return {name: REDACTED if name in SECRET_FIELDS else value for name, value in fields.items()}
+
+
+def encode_payload(sheet, key, fields):
+    parts = [sheet, key]
+    for name, value in fields.items():
+        parts.append(name)
+        parts.append(str(value))
+    return SEPARATOR.join(part.replace(SEPARATOR, " ") for part in parts).encode("utf-8")
+
+
+def decode_payload(payload):
+    parts = payload.decode("utf-8").split(SEPARATOR)
+    return parts[0], parts[1], dict(zip(parts[2::2], parts[3::2]))
+
+
+def iter_records(buffer, offset):
+    """
+    Yield `(type, timestamp, payload, next_offset)` from `buffer` starting at `offset`.
+    Stops quietly at a torn or corrupt tail, which is what a crash mid-append leaves behind.
+    """
+    end = len(buffer)
+    header_size = RECORD_HEADER.size
+    unpack = RECORD_HEADER.unpack_from
+    while offset + header_size <= end:
+        length, crc, event_type, timestamp = unpack(buffer, offset)
+        start = offset + header_size
+        stop = start + length
+        if stop > end:
+            break
+        if zlib.crc32(buffer[offset + 8:stop]) != crc:
+            logger.warning(f"Journal record at offset {offset} is corrupt; ignoring the tail.")
+            break
+        yield event_type, timestamp, buffer[start:stop], stop
+        offset = stop
+
+
+def replay_into(state, buffer, offset):
+    """
+    Fold every record from `offset` into `state` ({(sheet, key): {field: value}}).
+    This is the startup hot path, so it inlines `iter_records` and `decode_payload`.
+
+    Returns:
+        tuple: `(events_replayed, end_of_last_valid_record)`.
+    """
+    view = memoryview(buffer)
+    end = len(buffer)
+    header_size = RECORD_HEADER.size
+    unpack = RECORD_HEADER.unpack_from
+    crc32 = zlib.crc32
+    count = 0
+    try:
+        while offset + header_size <= end:
+            length, crc, _, _ = unpack(buffer, offset)
+            start = offset + header_size
+            stop = start + length
+            if stop > end or crc32(view[offset + 8:stop]) != crc:
+                break
+            parts = str(view[start:stop], "utf-8").split(SEPARATOR)
+            fields = state.get((parts[0], parts[1]))
+            if fields is None:
+                fields = state[(parts[0], parts[1])] = {}
+            if len(parts) == 4:
+                fields[parts[2]] = parts[3]
+            else:
+                fields.update(zip(parts[2::2], parts[3::2]))
+            count += 1
+            offset = stop
+    finally:
+        view.release()
+    return count, offset
+
+
+# Append-only, length-prefixed binary log of every change the bot makes, plus the
+# results it sees posted, for audits (`history()`, the admin /audit command).
+# `state` is rebuilt at startup from the latest snapshot plus the journal tail, read
+# through mmap. Once enough events pile up the state is snapshotted and the journal
+# restarted, so replay time stays bounded.
+#
+# What the replayed `state` holds, keyed by (sheet, key):
+# - attendance: every roll call as its full sheet row, keyed "<date> <classroom>"
+# - students/teachers/parents: chat IDs and first_time flags as last written
+# - results: the latest result per subject of each student, as the results watcher saw it
+# What it cannot rebuild: passwords and security questions and answers are redacted
+# before they are written, so only the fact and time of the change survive; those
+# values live in the sheets alone. Nothing is replayed into the sheets at startup.
+class Journal:
+    def __init__(self, path, compact_every=100_000, fsync=False):
+        self.path = path
+        self.snapshot_path = path + ".snapshot"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.state = {}  # {(sheet, key): {field: value}}
+        self.generation = 0
+        self.events_since_snapshot = 0
+        self._file = None
+
+    # Startup
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        snapshot_generation, offset = self._load_snapshot()
+        if not os.path.exists(self.path):
+            self._write_header(self.path, snapshot_generation + 1)
+
+        started = time.perf_counter()
+        count = 0
+        with open(self.path, "rb") as f:
+            header = f.read(FILE_HEADER.size)
+            magic, self.generation = FILE_HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} is not a journal file")
+            # A journal newer than the snapshot was started after it was taken: replay all of it
+            if self.generation != snapshot_generation:
+                offset = FILE_HEADER.size
+            valid_end = offset
+            if os.fstat(f.fileno()).st_size > offset:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    count, valid_end = replay_into(self.state, buffer, offset)
+                    if valid_end < len(buffer):
+                        logger.warning(f"Dropping {len(buffer) - valid_end} bytes of torn journal tail.")
+
+        self._file = open(self.path, "r+b")
+        self._file.truncate(max(valid_end, FILE_HEADER.size))  # Drop a torn tail
+        self._file.seek(0, os.SEEK_END)
+        self.events_since_snapshot = count
+        logger.info(f"Replayed {count} journal events in {time.perf_counter() - started:.3f}s.")
+
+        # Journals written before secrets were redacted: rewrite them without the values
+        if self._redact_state():
+            logger.warning("Journal contained unredacted secrets; compacting it to remove them.")
+            self.compact()
+        return self
+
+    def _redact_state(self):
+        redacted = 0
+        for fields in self.state.values():
+            for name in SECRET_FIELDS.intersection(fields):
+                if fields[name] != REDACTED:
+                    fields[name] = REDACTED
+                    redacted += 1
+        return redacted
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return 0, FILE_HEADER.size
+        with open(self.snapshot_path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        self.state = {(sheet, key): fields for sheet, key, fields in snapshot["state"]}
+        return snapshot["generation"], snapshot["offset"]
+
+    @staticmethod
+    def _write_header(path, generation):
+        with open(path, "wb") as f:
+            f.write(FILE_HEADER.pack(MAGIC, generation))
+            f.flush()
+            os.fsync(f.fileno())
+
+    # Writing
+
+    def _apply(self, sheet, key, fields):
+        self.state.setdefault((sheet, key), {}).update(fields)
+
+    def append(self, event_type, sheet, key, fields, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        fields = redact(fields)
+        payload = encode_payload(sheet, key, fields)
+        head = struct.pack("<Bd", event_type, timestamp)
+        crc = zlib.crc32(payload, zlib.crc32(head))
+        self._file.write(struct.pack("<II", len(payload), crc) + head + payload)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+        self._apply(sheet, key, {name: str(value) for name, value in fields.items()})
+        self.events_since_snapshot += 1
+        if self.compact_every and self.events_since_snapshot >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Snapshot the current state, then start an empty journal of the next generation."""
+        offset = self._file.tell()
+        temporary = self.snapshot_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({
+                "generation": self.generation,
+                "offset": offset,
+                "state": [[sheet, key, fields] for (sheet, key), fields in self.state.items()],
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.snapshot_path)
+
+        temporary = self.path + ".tmp"
+        self._write_header(temporary, self.generation + 1)
+        self._file.close()
+        os.replace(temporary, self.path)
+        self.generation += 1
+        self._file = open(self.path, "r+b")
+        self._file.seek(0, os.SEEK_END)
+        logger.info(f"Journal compacted at {self.events_since_snapshot} events (generation {self.generation}).")
+        self.events_since_snapshot = 0
+
+    # Audit queries
+
+    def history(self, sheet=None, key=None, since=None):
+        """Events of the current journal generation, oldest first, optionally filtered."""
+        self._file.flush()
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size <= FILE_HEADER.size:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                events = []
+                for event_type, timestamp, payload, _ in iter_records(buffer, FILE_HEADER.size):
+                    if since is not None and timestamp < since:
+                        continue
+                    event_sheet, event_key, fields = decode_payload(payload)
+                    if (sheet is None or event_sheet == sheet) and (key is None or event_key == key):
+                        events.append(JournalEvent(event_type, timestamp, event_sheet, event_key, fields))
+                return events
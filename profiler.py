@@ -0,0 +1,178 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Modules whose frames on the event loop thread mean the loop is blocked on synchronous I/O
+BLOCKING_MODULES = ("sheets_backend", "circuit_breaker", "transport", "gspread", "google.auth",
+                    "requests", "urllib3", "http.client", "socket", "ssl")
+
+
+def frame_label(frame):
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{frame.f_code.co_qualname}"
+
+
+def is_blocking(module):
+    return any(module == name or module.startswith(name + ".") for name in BLOCKING_MODULES)
+
+
+# Samples the stack of one thread (the event loop) from a background thread.
+# Nothing is installed until `start()`, so there is no cost while profiling is off.
+class SamplingProfiler:
+    def __init__(self, thread_id, interval=0.005, handler_codes=None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.handler_codes = handler_codes or {}  # {code object: handler name}
+        self.samples = 0
+        self.idle = 0
+        self.blocked = Counter()  # {outermost blocking function: samples}
+        self.stacks = Counter()  # {"root;...;leaf": samples}, idle samples excluded
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self.handlers = Counter()
+        self.started = self.stopped = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.stopped = time.perf_counter()
+
+    @property
+    def duration(self):
+        return (self.stopped or time.perf_counter()) - self.started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.sample(frame)
+
+    def sample(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame)
+            frame = frame.f_back
+        stack.reverse()  # Root first
+        self.samples += 1
+
+        # The loop waiting in select() has nothing to do
+        leaf = stack[-1]
+        if leaf.f_code.co_name == "select" and leaf.f_globals.get("__name__") == "selectors":
+            self.idle += 1
+            return
+
+        labels = [frame_label(frame) for frame in stack]
+        self.stacks[";".join(labels)] += 1
+        self.self_counts[labels[-1]] += 1
+        self.total_counts.update(set(labels))
+
+        handler = next((self.handler_codes[f.f_code] for f in stack if f.f_code in self.handler_codes), "(other)")
+        self.handlers[handler] += 1
+
+        for frame, label in zip(stack, labels):
+            if is_blocking(frame.f_globals.get("__name__", "")):
+                self.blocked[label] += 1
+                break
+
+    def write_collapsed(self, path):
+        """Write stacks in the collapsed format read by flamegraph.pl and speedscope."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+# Wall time per conversation state, measured around each update while profiling.
+# `before` runs in a group ahead of the conversation handler and `after` in one behind it.
+class StateTimer:
+    def __init__(self, conv_handler, state_names=None):
+        self.conv_handler = conv_handler
+        self.state_names = state_names or {}
+        self.timings = {}  # {state: [updates, total seconds, max seconds]}
+        self._pending = {}  # {update_id: (state, started)}
+
+    def state_label(self, update):
+        check = self.conv_handler.check_update(update)
+        if not check:
+            return "(not in conversation)"
+        state = check[0]
+        if state is None:
+            return "(entry point)"
+        return self.state_names.get(state, str(state))
+
+    async def before(self, update, context):
+        self._pending[update.update_id] = (self.state_label(update), time.perf_counter())
+
+    async def after(self, update, context):
+        pending = self._pending.pop(update.update_id, None)
+        if pending is None:
+            return
+        state, started = pending
+        elapsed = time.perf_counter() - started
+        timing = self.timings.setdefault(state, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += elapsed
+        timing[2] = max(timing[2], elapsed)
+
+
+def _seconds(samples, interval):
+    return f"{samples * interval:.2f}s"
+
+
+def render_summary(profiler, timer=None, limit=8):
+    """Compact text report of a finished profile, small enough for one Telegram message."""
+    interval = profiler.interval
+    busy = profiler.samples - profiler.idle
+    share = busy / profiler.samples if profiler.samples else 0.0
+    lines = [
+        f"⏱️ Profile: {profiler.duration:.1f}s, {profiler.samples} samples every {interval * 1000:.0f} ms",
+        f"Event loop busy {share:.0%} ({_seconds(busy, interval)}), idle {1 - share:.0%}",
+    ]
+
+    blocked = sum(profiler.blocked.values())
+    lines.append("")
+    lines.append(f"Blocked in synchronous calls: {_seconds(blocked, interval)}"
+                 + (f" ({blocked / busy:.0%} of busy time)" if busy else ""))
+    for label, count in profiler.blocked.most_common(limit):
+        lines.append(f"  {_seconds(count, interval):>8}  {label}")
+
+    lines.append("")
+    lines.append("Hottest handlers (busy time):")
+    for name, count in profiler.handlers.most_common(limit):
+        lines.append(f"  {_seconds(count, interval):>8}  {name}")
+
+    lines.append("")
+    lines.append("Hottest functions (self / total):")
+    for label, count in profiler.self_counts.most_common(limit):
+        lines.append(f"  {_seconds(count, interval):>8} / {_seconds(profiler.total_counts[label], interval):>8}  {label}")
+
+    if timer is not None and timer.timings:
+        lines.append("")
+        lines.append("Wall time per conversation state:")
+        ordered = sorted(timer.timings.items(), key=lambda item: -item[1][1])
+        for state, (count, total, longest) in ordered[:limit]:
+            lines.append(f"  {state}: {count} updates, mean {total / count * 1000:.0f} ms, "
+                         f"max {longest * 1000:.0f} ms, total {total:.2f}s")
+    return "\n".join(lines)
+
+
+def profile_path(directory):
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S.folded"))
+
+
+def handler_codes(conv_handler):
+    """Map each conversation callback's code object to its name, to attribute samples to handlers."""
+    handlers = list(conv_handler.entry_points) + list(conv_handler.fallbacks)
+    for state_handlers in conv_handler.states.values():
+        handlers.extend(state_handlers)
+    return {handler.callback.__code__: handler.callback.__qualname__ for handler in handlers}
@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+# Opt-in recorder of incoming updates for replay benchmarks (see replay_updates.py).
+# `before` runs in a group ahead of the conversation handler and `after` in one behind it,
+# so each record carries the conversation state the update arrived in and the one it left.
+#
+# Records are anonymized before they are written:
+# - Telegram user and chat IDs become keyed pseudonyms (stable within one recording)
+# - names, usernames and dates are dropped
+# - text is kept only when it is one of the bot's own fixed labels (keyboard buttons,
+#   the logout phrases), in any letter case; anything else, including free text typed
+#   where a button was expected (IDs, passwords, security answers, names), is replaced
+#   by a keyed digest of the same length, so equal inputs stay equal and length checks
+#   still apply
+# The key is never written; without RECORD_KEY a fresh one is used for every run.
+class UpdateRecorder:
+    def __init__(self, path, conv_handler, state_names=None, public_texts=(), key=None, flush_every=50):
+        self.path = path
+        self.conv_handler = conv_handler
+        self.state_names = state_names or {}
+        self.public_texts = {text.casefold() for text in public_texts}
+        self.key = key.encode("utf-8") if key else secrets.token_bytes(32)
+        self.flush_every = flush_every
+        self.count = 0
+        self._pending = {}  # {update_id: record}
+        self._file = None
+        self._started = None
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = gzip.open(self.path, "at", encoding="utf-8")
+        logger.info(f"Recording anonymized updates to {self.path}.")
+        return self
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f"Recorded {self.count} updates to {self.path}.")
+
+    # Anonymization
+
+    def _digest(self, value):
+        return hmac.new(self.key, str(value).encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def pseudonym(self, telegram_id):
+        return int(self._digest(telegram_id)[:12], 16) + 1
+
+    def mask(self, text):
+        digest = self._digest(text)
+        return (digest * (len(text) // len(digest) + 1))[:len(text)]
+
+    def scrub_text(self, text):
+        if text.strip().casefold() in self.public_texts:
+            return text
+        if text.startswith("/"):  # Keep the command, mask its arguments
+            command, _, arguments = text.partition(" ")
+            return f"{command} {self.mask(arguments)}" if arguments else command
+        return self.mask(text)
+
+    def state_name(self, update):
+        check = self.conv_handler.check_update(update)
+        if not check or check[0] is None:
+            return None
+        # Always a string, so a state a handler got wrong cannot break json.dumps
+        return self.state_names.get(check[0], str(check[0]))
+
+    # Handlers
+
+    async def before(self, update, context):
+        if update.message is None and update.callback_query is None:
+            return
+        now = time.monotonic()
+        if self._started is None:
+            self._started = now
+        # Updates stopped before `after` (admin commands) would otherwise pile up here
+        if len(self._pending) > 100:
+            self._pending.clear()
+
+        state = self.state_name(update)
+        record = {
+            "t": round(now - self._started, 3),
+            "user": self.pseudonym(update.effective_user.id) if update.effective_user else None,
+            "chat": self.pseudonym(update.effective_chat.id) if update.effective_chat else None,
+            "state": state,
+        }
+        if update.callback_query is not None:
+            record["data"] = update.callback_query.data  # Generated by the bot itself
+        elif update.message.text is not None:
+            record["text"] = self.scrub_text(update.message.text)
+        else:
+            record["attachment"] = True
+        self._pending[update.update_id] = record
+
+    async def after(self, update, context):
+        record = self._pending.pop(update.update_id, None)
+        if record is None or self._file is None:
+            return
+        record["next"] = self.state_name(update)
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self._file.flush()  # A sync point, so a crash loses at most the last few records
+
+
+def read_recording(path):
+    """Yield the records of a recording, stopping quietly at a truncated tail."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, zlib.error, gzip.BadGzipFile, json.JSONDecodeError) as e:
+            logger.warning(f"Recording {path} ends early: {e}")
+
+
+def recording_path(directory):
+    return os.path.join(directory, time.strftime("updates-%Y%m%d-%H%M%S.jsonl.gz"))
@@ -0,0 +1,256 @@
+"""
+Replay a recording of real updates (see recorder.py) against an in-memory copy of
+the sheets and a fake Telegram API, and report throughput, latency and API calls.
+
+Sheet rows are synthesized from the recording itself: every ID that got past an
+authentication step becomes an account, with the (masked) password and security
+answer the user was seen to enter successfully, so mistyped IDs and wrong
+passwords fail again on replay.
+
+    python replay_updates.py data/recordings/updates-20250301-080000.jsonl.gz --speed 0
+    python replay_updates.py recording.jsonl.gz --speed 1 --sheets-latency-ms 150
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import tempfile
+import time
+from collections import Counter
+from itertools import cycle
+
+from telegram import Update
+
+import bot
+from fakes import FakeTelegramRequest, header, make_row
+from recorder import read_recording
+from sheets_backend import (
+    SheetsBackend, InMemoryBackend, STUDENT_SHEET, TEACHER_SHEET, RESULTS_SHEET, PARENT_SHEET, ATTENDANCE_SHEET,
+    STUDENT_COLUMNS, TEACHER_COLUMNS, PARENT_COLUMNS, RESULTS_COLUMNS, ATTENDANCE_COLUMNS,
+)
+
+AUTH_STATES = {"STUDENT_AUTH": "student", "TEACHER_AUTH": "teacher", "PARENT_AUTH": "parent"}
+MENU_STATES = {"STUDENT_MENU", "TEACHER_MENU", "PARENT_MENU"}
+ROLE_LAYOUT = {
+    "student": (STUDENT_SHEET, STUDENT_COLUMNS),
+    "teacher": (TEACHER_SHEET, TEACHER_COLUMNS),
+    "parent": (PARENT_SHEET, PARENT_COLUMNS),
+}
+SUBJECTS = ["Mathematics", "English", "Amharic", "Science"]
+
+
+# Counts every call and optionally sleeps like a real (blocking) Sheets round trip
+class CountingBackend(SheetsBackend):
+    def __init__(self, backend, latency=0.0):
+        self.backend = backend
+        self.latency = latency
+        self.calls = Counter()
+
+    def _call(self, method, *args):
+        self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return getattr(self.backend, method)(*args)
+
+    def find_row(self, sheet_name, value):
+        return self._call("find_row", sheet_name, value)
+
+    def row_values(self, sheet_name, row):
+        return self._call("row_values", sheet_name, row)
+
+    def cell_value(self, sheet_name, row, col):
+        return self._call("cell_value", sheet_name, row, col)
+
+    def update_cell(self, sheet_name, row, col, value):
+        return self._call("update_cell", sheet_name, row, col, value)
+
+    def update_cells(self, sheet_name, cells):
+        return self._call("update_cells", sheet_name, cells)
+
+    def get_all_values(self, sheet_name):
+        return self._call("get_all_values", sheet_name)
+
+    def append_row(self, sheet_name, values):
+        return self._call("append_row", sheet_name, values)
+
+    def revision(self, sheet_name):
+        return self._call("revision", sheet_name)
+
+
+# Answers Bot API calls locally and counts them
+def build_sheets(records, min_students=30):
+    """Synthesize the sheet rows the recorded conversations need."""
+    accounts = {}  # {(role, id): {field: value}}
+    roles = {}  # {user: role}
+    current = {}  # {user: (role, id)} the account being logged into or reset
+    classrooms = []
+
+    for record in records:
+        user, state, next_state, text = record["user"], record["state"], record.get("next"), record.get("text")
+        if text is None:
+            continue
+        if state == "CHOOSING_ROLE" and text.lower() in ROLE_LAYOUT:
+            roles[user] = text.lower()
+        elif state in AUTH_STATES:
+            roles[user] = AUTH_STATES[state]
+            if next_state != state:  # The ID was found (an error after the lookup ends the conversation)
+                account = accounts.setdefault((roles[user], text), {"first_time": "No"})
+                if next_state == "PASSWORD_SETUP":
+                    account["first_time"] = "Yes"
+                current[user] = (roles[user], text)
+        elif state == "PASSWORD_CONFIRM" and next_state in MENU_STATES and user in current:
+            accounts[current[user]].setdefault("password", text)
+        elif state == "FORGOT_PASSWORD_ID" and next_state == "FORGOT_PASSWORD_SECURITY":
+            current[user] = (roles.get(user, "teacher"), text)
+            accounts.setdefault(current[user], {"first_time": "No"})
+        elif state == "FORGOT_PASSWORD_SECURITY" and next_state == "FORGOT_PASSWORD_RESET" and user in current:
+            accounts[current[user]].setdefault("security_answer", text)
+        elif state in ("ATTENDANCE_CLASS", "REPORT_CLASS") and next_state != state and text not in classrooms:
+            if text != "🔙 Back":
+                classrooms.append(text)
+
+    student_ids = [key for role, key in accounts if role == "student"]
+    student_ids += [f"R{n:04d}" for n in range(max(0, min_students - len(student_ids)))]
+    classroom_cycle = cycle(classrooms or ["Grade 1A", "Grade 2B", "Grade 3C"])
+    children_cycle = cycle(student_ids)
+
+    sheets = {name: [header(columns)] for name, columns in (
+        (STUDENT_SHEET, STUDENT_COLUMNS), (TEACHER_SHEET, TEACHER_COLUMNS), (PARENT_SHEET, PARENT_COLUMNS),
+        (RESULTS_SHEET, RESULTS_COLUMNS), (ATTENDANCE_SHEET, ATTENDANCE_COLUMNS),
+    )}
+    for n, student_id in enumerate(student_ids):
+        account = accounts.get(("student", student_id), {"first_time": "No"})
+        sheets[STUDENT_SHEET].append(make_row(STUDENT_COLUMNS, **{
+            "first_time": account["first_time"], "id": student_id, "full_name": f"Student {n + 1}",
+            "gender": "F" if n % 2 else "M", "classroom": next(classroom_cycle), "grade": str(n % 8 + 1),
+            "tuition": "Paid" if n % 3 else "Due", "password": account.get("password", "-"),
+            "security_question": "Favourite colour?", "security_answer": account.get("security_answer", "-"),
+        }))
+        for position, subject in enumerate(SUBJECTS[:3]):
+            sheets[RESULTS_SHEET].append(make_row(RESULTS_COLUMNS, **{
+                "id": student_id, "subject": subject, "result": str(60 + (n + position * 7) % 40),
+                "feedback": "Good progress." if position else "Keep practising.",
+            }))
+    for (role, key), account in accounts.items():
+        if role == "student":
+            continue
+        sheet_name, columns = ROLE_LAYOUT[role]
+        values = {
+            "first_time": account["first_time"], "id": key, "full_name": f"{role.title()} {key[:4]}",
+            "gender": "F", "password": account.get("password", "-"),
+            "security_question": "Favourite colour?", "security_answer": account.get("security_answer", "-"),
+        }
+        if role == "teacher":
+            values["subject"] = SUBJECTS[len(sheets[sheet_name]) % len(SUBJECTS)]
+        else:
+            values["children"] = f"{next(children_cycle)},{next(children_cycle)}"
+        sheets[sheet_name].append(make_row(columns, **values))
+    return sheets
+
+
+def make_update(record, update_id, bot_instance):
+    user = {"id": record["user"], "is_bot": False, "first_name": "User"}
+    chat = {"id": record["chat"], "type": "private"}
+    if "data" in record:
+        data = {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user, "chat_instance": str(record["chat"]), "data": record["data"],
+            "message": {"message_id": update_id, "date": 0, "chat": chat},
+        }}
+    else:
+        message = {"message_id": update_id, "date": int(time.time()), "chat": chat, "from": user}
+        text = record.get("text")
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        else:
+            message["document"] = {"file_id": "replay", "file_unique_id": "replay"}
+        data = {"update_id": update_id, "message": message}
+    return Update.de_json(data, bot_instance)
+
+
+def state_name(conv_handler, update):
+    check = conv_handler.check_update(update)
+    if not check or check[0] is None:
+        return None
+    return bot.STATE_NAMES.get(check[0], str(check[0]))
+
+
+async def replay(records, speed, sheets_latency):
+    backend = CountingBackend(InMemoryBackend(build_sheets(records)), latency=sheets_latency)
+    request = FakeTelegramRequest()
+    config = bot.load_config()
+    config.update(
+        bot_token="1:replay", journal_path="", record_dir="", admin_ids=[], session_idle_timeout=0,
+        report_cache_dir=tempfile.mkdtemp(prefix="replay_reports_"),
+    )
+    application = bot.create_application(config, backend, request=request)
+    conv_handler = application.bot_data['conv_handler']
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(context.error)
+
+    application.add_error_handler(on_error)
+    await application.initialize()
+    request.calls.clear()
+
+    latencies = []
+    matched = 0
+    started = time.perf_counter()
+    for update_id, record in enumerate(records, start=1):
+        arrival = started + record["t"] / speed if speed else time.perf_counter()
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        update = make_update(record, update_id, application.bot)
+        await application.process_update(update)
+        latencies.append(time.perf_counter() - arrival)  # Includes waiting behind earlier updates
+        matched += state_name(conv_handler, update) == record.get("next")
+    elapsed = time.perf_counter() - started
+
+    await application.shutdown()
+    await bot.close_resources(application)
+    return {
+        "updates": len(records), "elapsed": elapsed, "latencies": sorted(latencies), "matched": matched,
+        "errors": errors, "sheets_calls": backend.calls, "telegram_calls": request.calls,
+    }
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(stats):
+    latencies = stats["latencies"]
+    updates = stats["updates"]
+    print(f"{updates} updates in {stats['elapsed']:.2f}s ({updates / stats['elapsed']:.0f} updates/s)")
+    print(f"latency  mean {statistics.mean(latencies) * 1000:.2f} ms  p50 {percentile(latencies, 0.5) * 1000:.2f} ms  "
+          f"p90 {percentile(latencies, 0.9) * 1000:.2f} ms  p99 {percentile(latencies, 0.99) * 1000:.2f} ms  "
+          f"max {latencies[-1] * 1000:.2f} ms")
+    print(f"recorded state transitions reproduced: {stats['matched']}/{updates}")
+    if stats["errors"]:
+        print(f"handler errors: {len(stats['errors'])} (first: {stats['errors'][0]!r})")
+    for title, calls in (("Sheets calls", stats["sheets_calls"]), ("Telegram calls", stats["telegram_calls"])):
+        total = sum(calls.values())
+        print(f"{title}: {total} ({total / updates:.2f} per update)")
+        for name, count in calls.most_common():
+            print(f"  {count:>7}  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="recording written with RECORD_DIR set")
+    parser.add_argument("--speed", type=float, default=0.0, help="1 = recorded pace, 0 = as fast as possible")
+    parser.add_argument("--sheets-latency-ms", type=float, default=0.0, help="simulated delay per Sheets call")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    records = [record for record in read_recording(args.recording) if record.get("user") is not None]
+    if not records:
+        parser.error(f"{args.recording} has no records")
+    report(asyncio.run(replay(records, args.speed, args.sheets_latency_ms / 1000)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import textwrap
+import time
+import zipfile
+
+from roster import field
+from sheets_backend import STUDENT_COLUMNS, RESULTS_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout changes so cached PDFs are regenerated
+RENDERER_VERSION = 2
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 56
+LINE_HEIGHT = {"title": 24, "heading": 18, "text": 15}
+FONT_SIZE = {"title": 18, "heading": 12, "text": 10}
+# Characters per line that fit between the margins, with room for wide letters
+WRAP_WIDTH = {"title": 42, "heading": 64, "text": 85}
+
+
+def build_card(student_id, student, results, school_name, term):
+    """Plain-data report card (picklable, so it can be sent to a worker process)."""
+    return {
+        "school": school_name,
+        "term": term,
+        "id": student_id,
+        "full_name": field(student, STUDENT_COLUMNS, "full_name"),
+        "grade": field(student, STUDENT_COLUMNS, "grade"),
+        "classroom": field(student, STUDENT_COLUMNS, "classroom"),
+        "results": [
+            [
+                field(row, RESULTS_COLUMNS, "subject") or "General",
+                field(row, RESULTS_COLUMNS, "result"),
+                field(row, RESULTS_COLUMNS, "feedback"),
+            ]
+            for row in results
+        ],
+    }
+
+
+def card_hash(card):
+    data = json.dumps([RENDERER_VERSION, card], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _pdf_text(text):
+    # The built-in Helvetica font only covers Latin-1
+    text = text.encode("latin-1", "replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def wrap(style, text, indent=""):
+    """Split `text` into `(style, line)` pairs that fit the page width; blank text stays one blank line."""
+    if not text:
+        return [(style, "")]
+    lines = textwrap.wrap(text, WRAP_WIDTH[style], initial_indent=indent, subsequent_indent=indent)
+    return [(style, line) for line in lines]
+
+
+def card_lines(card):
+    lines = (
+        wrap("title", f"{card['school']} - Report Card")
+        + wrap("text", f"Term: {card['term']}")
+        + wrap("text", "")
+        + wrap("heading", card["full_name"])
+        + wrap("text", f"ID: {card['id']}    Grade: {card['grade']}    Classroom: {card['classroom']}")
+        + wrap("text", "")
+        + wrap("heading", "Results")
+    )
+    if not card["results"]:
+        lines += wrap("text", "No results recorded.")
+    for subject, result, feedback in card["results"]:
+        lines += wrap("text", f"{subject}: {result or '-'}")
+        if feedback:
+            lines += wrap("text", feedback, indent="    ")
+    return lines
+
+
+def render_report_card(card, path):
+    """
+    Write `card` as a PDF to `path`. Runs in a worker process.
+
+    The file is written incrementally and moved into place at the end, so a
+    half-written PDF is never picked up from the cache.
+    """
+    pages = [[]]
+    y = PAGE_HEIGHT - MARGIN
+    for style, text in card_lines(card):
+        if y - LINE_HEIGHT[style] < MARGIN:
+            pages.append([])
+            y = PAGE_HEIGHT - MARGIN
+        y -= LINE_HEIGHT[style]
+        font = "F2" if style in ("title", "heading") else "F1"
+        pages[-1].append(f"BT /{font} {FONT_SIZE[style]} Tf {MARGIN} {y} Td ({_pdf_text(text)}) Tj ET")
+
+    # Objects: 1 catalog, 2 pages, 3-4 fonts, then (page, content) pairs
+    page_ids = [5 + 2 * i for i in range(len(pages))]
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    offsets = []
+    with os.fdopen(handle, "wb") as f:
+        def write_object(body):
+            offsets.append(f.tell())
+            f.write(f"{len(offsets)} 0 obj\n".encode("latin-1") + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+        write_object(b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+        write_object(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode("latin-1"))
+        write_object(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        write_object(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+        for page_id, commands in zip(page_ids, pages):
+            write_object(
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {page_id + 1} 0 R >>".encode("latin-1")
+            )
+            stream = "\n".join(commands).encode("latin-1")
+            write_object(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+        xref = f.tell()
+        f.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+        for offset in offsets:
+            f.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+        f.write(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    os.replace(temporary, path)
+    return path
+
+
+# Report cards rendered in a process pool and cached on disk by content hash.
+# The cache keeps the `max_entries` most recently used PDFs; older ones are deleted.
+class ReportCardRenderer:
+    def __init__(self, cache_dir, executor, max_entries=2000):
+        self.cache_dir = cache_dir
+        self.executor = executor
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cached_path(self, card):
+        return os.path.join(self.cache_dir, card_hash(card) + ".pdf")
+
+    async def _render(self, card):
+        path = self.cached_path(card)
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, render_report_card, card, path)
+        return path
+
+    async def render(self, card):
+        """Return the path of the PDF for `card`, rendering it only if its content changed."""
+        path = await self._render(card)
+        await asyncio.to_thread(self.prune, keep=path)
+        return path
+
+    async def render_class(self, cards, classroom):
+        """
+        Render every card and zip them into a temporary file.
+        The caller sends and then deletes the returned path.
+        """
+        cached = sum(1 for card in cards if os.path.exists(self.cached_path(card)))
+        paths = await asyncio.gather(*(self._render(card) for card in cards))
+        logger.info(f"Report cards for {classroom}: {len(cards) - cached} rendered, {cached} from cache.")
+        zip_path = await asyncio.to_thread(self._zip, cards, paths, classroom)
+        await asyncio.to_thread(self.prune)
+        return zip_path
+
+    def prune(self, keep=None):
+        """Delete the least recently used PDFs beyond `max_entries`, and temporary files left by crashed workers."""
+        entries = []
+        stale_before = time.time() - 3600
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                try:
+                    modified = entry.stat().st_mtime
+                    if entry.name.endswith(".pdf"):
+                        entries.append((modified, entry.path))
+                    elif entry.name.endswith(".tmp") and modified < stale_before:
+                        os.remove(entry.path)
+                except FileNotFoundError:  # Removed by a concurrent prune
+                    continue
+        entries.sort(reverse=True)
+        removed = 0
+        for _, path in entries[self.max_entries:]:
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                continue
+        if removed:
+            logger.info(f"Pruned {removed} cached report cards.")
+        return removed
+
+    @staticmethod
+    def _zip(cards, paths, classroom):
+        safe_classroom = "".join(ch if ch.isalnum() else "_" for ch in classroom)
+        handle, zip_path = tempfile.mkstemp(prefix=f"report_cards_{safe_classroom}_", suffix=".zip")
+        with os.fdopen(handle, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as archive:
+            for card, path in zip(cards, paths):
+                archive.write(path, arcname=report_filename(card))
+        return zip_path
+
+
+def report_filename(card):
+    safe_name = "".join(ch if ch.isalnum() else "_" for ch in card["full_name"]).strip("_") or "student"
+    return f"{card['id']}_{safe_name}.pdf"
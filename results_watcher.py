@@ -0,0 +1,131 @@
+import hashlib
+import logging
+
+from roster import field, parse_children
+from sheets_backend import RESULTS_SHEET, STUDENT_COLUMNS, PARENT_COLUMNS, RESULTS_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Rows per hashed block of the results sheet
+BLOCK_SIZE = 100
+
+
+def result_key(row):
+    return field(row, RESULTS_COLUMNS, "id"), field(row, RESULTS_COLUMNS, "subject") or "General"
+
+
+def block_hashes(rows, block_size=BLOCK_SIZE):
+    hashes = []
+    for start in range(0, len(rows), block_size):
+        digest = hashlib.blake2b(digest_size=16)
+        for row in rows[start:start + block_size]:
+            digest.update("\x1f".join(row).encode("utf-8"))
+            digest.update(b"\x1e")
+        hashes.append(digest.digest())
+    return hashes
+
+
+# Detects which (student, subject) rows of the results sheet were added or changed.
+# Each poll first asks the backend for the sheet's revision, which costs a tiny
+# metadata request; the sheet itself is only read when the revision moved. The
+# new rows are then hashed in blocks and only blocks whose hash differs from
+# the previous snapshot are compared row by row.
+class ResultsWatcher:
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.revision = None
+        self.rows = None  # Last snapshot, header excluded
+        self.hashes = []
+
+    def poll(self, sheets):
+        """
+        Check the results sheet for changes.
+
+        Returns:
+            list | None: Added or changed result rows (empty on the first poll, which only
+            takes the baseline), or None if the sheet was not read.
+        """
+        revision = sheets.revision(RESULTS_SHEET)
+        if revision is not None and revision == self.revision:
+            return None
+
+        rows = sheets.get_all_values(RESULTS_SHEET)[1:]
+        # Rows served from the offline snapshot may be older than the last poll
+        if sheets.is_stale(RESULTS_SHEET):
+            return None
+
+        changes = self.diff(rows)
+        self.revision = revision
+        return changes
+
+    def diff(self, rows):
+        hashes = block_hashes(rows, self.block_size)
+        previous_rows, previous_hashes = self.rows, self.hashes
+        self.rows, self.hashes = rows, hashes
+        if previous_rows is None:
+            return []
+
+        size = self.block_size
+        changed_blocks = [
+            index for index, digest in enumerate(hashes)
+            if index >= len(previous_hashes) or previous_hashes[index] != digest
+        ]
+        previous = {}
+        for index in changed_blocks:
+            for row in previous_rows[index * size:(index + 1) * size]:
+                previous[result_key(row)] = row
+
+        changes = []
+        for index in changed_blocks:
+            for row in rows[index * size:(index + 1) * size]:
+                key = result_key(row)
+                if key[0] and field(row, RESULTS_COLUMNS, "result") and previous.get(key) != row:
+                    changes.append(row)
+        logger.debug(f"Results sheet: {len(changed_blocks)} of {len(hashes)} blocks changed.")
+        return changes
+
+
+def render_result_lines(rows):
+    lines = []
+    for row in rows:
+        line = f"  • {result_key(row)[1]}: {field(row, RESULTS_COLUMNS, 'result')}"
+        feedback = field(row, RESULTS_COLUMNS, "feedback")
+        if feedback:
+            line += f"\n    💬 {feedback}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def build_notifications(changes, students, parent_rows):
+    """
+    One message per affected student and per parent of an affected student.
+
+    Args:
+        changes (list[list[str]]): Result rows returned by `ResultsWatcher.poll`.
+        students (dict): `{student_id: student row}`, e.g. `RosterIndex.students`.
+        parent_rows (list[list[str]]): Parents sheet without the header.
+
+    Returns:
+        list[tuple]: `(chat_id, text)` pairs for `send_paced`.
+    """
+    changed = {}
+    for row in changes:
+        changed.setdefault(result_key(row)[0], []).append(row)
+
+    messages = []
+    for student_id, rows in changed.items():
+        chat_id = field(students.get(student_id, []), STUDENT_COLUMNS, "chat_id")
+        if chat_id:
+            messages.append((chat_id, "🆕 New results posted:\n" + render_result_lines(rows)))
+
+    for row in parent_rows:
+        chat_id = field(row, PARENT_COLUMNS, "chat_id")
+        children = parse_children(field(row, PARENT_COLUMNS, "children"))
+        sections = [
+            f"👤 {field(students.get(student_id, []), STUDENT_COLUMNS, 'full_name') or student_id}:\n"
+            + render_result_lines(changed[student_id])
+            for student_id in children if student_id in changed
+        ]
+        if chat_id and sections:
+            messages.append((chat_id, "🆕 New results for your children:\n\n" + "\n\n".join(sections)))
+    return messages
@@ -0,0 +1,142 @@
+import logging
+import time
+
+from sheets_backend import STUDENT_SHEET, RESULTS_SHEET, STUDENT_COLUMNS, RESULTS_COLUMNS
+from trigram import TrigramIndex
+
+logger = logging.getLogger(__name__)
+
+
+# Read a named column from a sheet row, tolerating the short rows gspread returns
+def field(row, columns, name, default=""):
+    index = columns[name] - 1
+    return row[index] if index < len(row) else default
+
+
+# Student IDs linked to a parent are stored comma-separated in a single cell
+def parse_children(value):
+    return [student_id.strip() for student_id in value.split(",") if student_id.strip()]
+
+
+# In-memory index of the students and results sheets.
+# Both sheets are read with one request each and then looked up by student ID,
+# so a page covering several students costs the same as a page covering one.
+class RosterIndex:
+    def __init__(self, ttl=60.0, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self.loaded_at = None
+        self.students = {}  # {student_id: row}
+        self.results = {}  # {student_id: [row, ...]}
+        self.classes = {}  # {classroom: [student_id, ...]} sorted by name
+        self.names = TrigramIndex()  # Fuzzy name search, updated incrementally on refresh
+        self.accounts = {}  # {(role, user_id): (row, read_at)} read at login for users not covered by `students`
+
+    def refresh(self, sheets):
+        student_rows = sheets.get_all_values(STUDENT_SHEET)[1:]  # Skip the header
+        result_rows = sheets.get_all_values(RESULTS_SHEET)[1:]
+        self.load(student_rows, result_rows)
+
+    def load(self, student_rows, result_rows):
+        """Rebuild the index from rows that were already fetched (header excluded)."""
+        students = {}
+        for row in student_rows:
+            student_id = field(row, STUDENT_COLUMNS, "id")
+            if student_id:
+                students[student_id] = row
+
+        classes = {}
+        for student_id, row in students.items():
+            classroom = field(row, STUDENT_COLUMNS, "classroom")
+            if classroom:
+                classes.setdefault(classroom, []).append(student_id)
+        for student_ids in classes.values():
+            student_ids.sort(key=lambda student_id: field(students[student_id], STUDENT_COLUMNS, "full_name"))
+
+        self.students = students
+        self.accounts = {key: row for key, row in self.accounts.items() if key[0] != "student"}
+        self.load_results(result_rows)
+        self.classes = classes
+        changed = self.names.sync({
+            student_id: field(row, STUDENT_COLUMNS, "full_name") for student_id, row in students.items()
+        })
+        self.loaded_at = self._clock()
+        logger.debug(f"Name index updated for {changed} students.")
+        logger.info(f"Roster index refreshed: {len(students)} students, {len(result_rows)} result rows.")
+
+    def load_results(self, result_rows):
+        """Replace only the results, e.g. with rows the results watcher just fetched."""
+        results = {}
+        for row in result_rows:
+            student_id = field(row, RESULTS_COLUMNS, "id")
+            if student_id:
+                results.setdefault(student_id, []).append(row)
+        self.results = results
+
+    def ensure_fresh(self, sheets):
+        if self.loaded_at is None or self._clock() - self.loaded_at >= self.ttl:
+            self.refresh(sheets)
+
+    # Logged-in users' rows, shared by every session instead of copied into each one.
+    # Student rows come from `students`, which the login calls `ensure_fresh` on. Teacher and
+    # parent rows are read again at login once older than the TTL, and dropped when no session
+    # uses them any more (see `forget_accounts`).
+
+    def account(self, role, user_id, max_age=None):
+        if role == "student" and user_id in self.students:
+            return self.students[user_id]
+        cached = self.accounts.get((role, user_id))
+        if cached is None:
+            return None
+        row, read_at = cached
+        if max_age is not None and self._clock() - read_at >= max_age:
+            return None
+        return row
+
+    def remember_account(self, role, user_id, row):
+        self.accounts[(role, user_id)] = (row, self._clock())
+
+    def forget_accounts(self, keep):
+        """Drop the cached rows of every account not in `keep` ({(role, user_id), ...})."""
+        stale = [key for key in self.accounts if key not in keep]
+        for key in stale:
+            del self.accounts[key]
+        return len(stale)
+
+    def update_account(self, role, user_id, columns, fields):
+        """Apply a write to the in-memory row, so it is visible before the next refresh."""
+        row = self.account(role, user_id)
+        if row is None:
+            return
+        for name, value in fields.items():
+            index = columns[name] - 1
+            if index >= len(row):
+                row.extend([""] * (index + 1 - len(row)))
+            row[index] = str(value)
+
+    def student(self, student_id):
+        return self.students.get(student_id)
+
+    def classrooms(self):
+        return sorted(self.classes)
+
+    def class_roster(self, classroom):
+        """Return `[(student_id, full_name), ...]` for a class, sorted by name."""
+        return [
+            (student_id, field(self.students[student_id], STUDENT_COLUMNS, "full_name"))
+            for student_id in self.classes.get(classroom, [])
+        ]
+
+    def search(self, query, limit=10):
+        """Fuzzy-match student names; returns `(student_id, full_name, score)` best first."""
+        return self.names.search(query, limit=limit)
+
+    def results_for(self, student_id):
+        return self.results.get(student_id, [])
+
+    def lookup_many(self, student_ids):
+        """Return `(student_id, student_row or None, result_rows)` for each ID, in order."""
+        return [
+            (student_id, self.students.get(student_id), self.results.get(student_id, []))
+            for student_id in student_ids
+        ]
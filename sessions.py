@@ -0,0 +1,36 @@
+import time
+
+
+# Per-user conversation state, used as `context.user_data` (see `ContextTypes` in bot.py).
+# Only what the menus need between two messages is kept here; profile fields such as
+# the name or classroom are read from the shared roster index when they are shown,
+# so thousands of logged-in users do not each carry a copy of their sheet row.
+class Session:
+    __slots__ = (
+        "role",  # 'student', 'teacher' or 'parent'
+        "user_id",  # School ID the user logged in with
+        "new_password",  # Password being set or reset, until it is confirmed and saved
+        "security_question",  # Question being set up, until the answer arrives
+        "reset_user_id",  # Account whose password is being reset
+        "roll_call",  # Teacher roll call in progress
+        "report_class",  # Class chosen for report cards
+        "viewing",  # 'results' or 'feedback'
+        "last_seen",  # time.monotonic() of the user's last update, for the idle sweeper
+    )
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.touch()
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def idle_for(self, now=None):
+        return (time.monotonic() if now is None else now) - self.last_seen
+
+    def __repr__(self):
+        return f"Session(role={self.role!r}, user_id={self.user_id!r})"
@@ -0,0 +1,283 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Names of the spreadsheets the bot works with
+STUDENT_SHEET = "students"
+TEACHER_SHEET = "teachers"
+RESULTS_SHEET = "resultsnfeedback"
+PARENT_SHEET = "parents"
+ATTENDANCE_SHEET = "attendance"
+
+# Column indices based on the user's structure
+STUDENT_COLUMNS = {
+    "first_time": 1,
+    "id": 2,
+    "full_name": 3,
+    "gender": 4,
+    "classroom": 5,
+    "grade": 6,
+    "tuition": 7,
+    "subject": 8,
+    "password": 9,
+    "security_question": 10,
+    "security_answer": 11,
+    "chat_id": 12,  # Telegram chat, recorded at login
+}
+TEACHER_COLUMNS = {
+    "first_time": 1,
+    "id": 2,
+    "full_name": 3,
+    "gender": 4,
+    "subject": 5,
+    "password": 6,
+    "security_question": 7,
+    "security_answer": 8,
+}
+PARENT_COLUMNS = {
+    "first_time": 1,
+    "id": 2,
+    "full_name": 3,
+    "gender": 4,
+    "children": 5,  # Comma-separated student IDs
+    "password": 6,
+    "security_question": 7,
+    "security_answer": 8,
+    "chat_id": 9,  # Telegram chat, recorded at login
+}
+# One row per (student, subject)
+RESULTS_COLUMNS = {
+    "id": 1,
+    "feedback": 2,
+    "subject": 3,
+    "result": 4,
+}
+# One row per (date, classroom); see attendance.py for the encoding
+ATTENDANCE_COLUMNS = {
+    "date": 1,
+    "classroom": 2,
+    "student_ids": 3,
+    "present": 4,
+}
+
+SCOPES = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/drive"
+]
+
+
+# Interface every Sheets backend implements.
+# Rows and columns are 1-based, exactly like in gspread.
+class SheetsBackend:
+    """
+    Minimal storage interface used by the bot's handlers.
+
+    The real implementation talks to Google Sheets through gspread; the
+    in-memory one keeps plain lists so the conversation flow can run offline.
+    """
+
+    def find_row(self, sheet_name, value):
+        """Return the row number of the first cell equal to `value`, or None."""
+        raise NotImplementedError
+
+    def row_values(self, sheet_name, row):
+        """Return the values of `row` as a list of strings."""
+        raise NotImplementedError
+
+    def cell_value(self, sheet_name, row, col):
+        """Return the value of a single cell."""
+        raise NotImplementedError
+
+    def update_cell(self, sheet_name, row, col, value):
+        """Write a single cell."""
+        raise NotImplementedError
+
+    def update_cells(self, sheet_name, updates):
+        """Write several `(row, col, value)` cells in one request."""
+        for row, col, value in updates:
+            self.update_cell(sheet_name, row, col, value)
+
+    def get_all_values(self, sheet_name):
+        """Return the whole sheet as a list of rows."""
+        raise NotImplementedError
+
+    def append_row(self, sheet_name, values):
+        """Add a row after the table and return the row number it was written to (None if unknown)."""
+        raise NotImplementedError
+
+    def revision(self, sheet_name):
+        """
+        Cheap token that changes whenever `sheet_name` changes, or None if the
+        backend cannot tell without reading the sheet.
+        """
+        return None
+
+    def is_stale(self, sheet_name):
+        """True if the last read of `sheet_name` was served from saved data."""
+        return False
+
+    def snapshot_age(self, sheet_name):
+        """Age in seconds of the saved data for `sheet_name`, if any."""
+        return None
+
+    def close(self):
+        """Release connections and background threads."""
+
+
+# Google Sheets backend. Nothing touches the network until the first call.
+class GspreadBackend(SheetsBackend):
+    def __init__(self, creds_json, pool_size=1, connect_timeout=5.0, read_timeout=20.0, refresh_margin=300.0):
+        self._creds_json = creds_json
+        self._transport_options = {
+            "pool_size": pool_size,
+            "connect_timeout": connect_timeout,
+            "read_timeout": read_timeout,
+            "refresh_margin": refresh_margin,
+        }
+        self._client = None
+        self._refresher = None
+        self._worksheets = {}
+
+    def _connect(self):
+        from google.oauth2 import service_account
+        from transport import authorize
+
+        if not self._creds_json:
+            raise ValueError("GOOGLE_CREDS environment variable not set")
+
+        creds_dict = json.loads(self._creds_json)
+        # Replace escaped newlines
+        creds_dict["private_key"] = creds_dict["private_key"].replace("\\n", "\n")
+        creds = service_account.Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
+        client, self._refresher = authorize(creds, **self._transport_options)
+        return client
+
+    def close(self):
+        if self._refresher is not None:
+            self._refresher.stop()
+        if self._client is not None:
+            self._client.http_client.session.close()
+
+    @property
+    def client(self):
+        if self._client is None:
+            try:
+                self._client = self._connect()
+            except Exception as e:
+                logger.error(f"Google Sheets authentication failed: {e}")
+                raise
+        return self._client
+
+    def worksheet(self, sheet_name):
+        if sheet_name not in self._worksheets:
+            import gspread
+            from gspread.exceptions import APIError
+
+            try:
+                self._worksheets[sheet_name] = self.client.open(sheet_name).sheet1
+            except gspread.SpreadsheetNotFound:
+                logger.error(f"Spreadsheet '{sheet_name}' not found. Check the name and sharing permissions.")
+                raise
+            except APIError as e:
+                logger.error(f"Google API error accessing '{sheet_name}': {e}")
+                raise
+        return self._worksheets[sheet_name]
+
+    def find_row(self, sheet_name, value):
+        cell = self.worksheet(sheet_name).find(value)
+        return cell.row if cell else None
+
+    def row_values(self, sheet_name, row):
+        return self.worksheet(sheet_name).row_values(row)
+
+    def cell_value(self, sheet_name, row, col):
+        return self.worksheet(sheet_name).cell(row, col).value
+
+    def update_cell(self, sheet_name, row, col, value):
+        self.worksheet(sheet_name).update_cell(row, col, value)
+
+    def update_cells(self, sheet_name, updates):
+        from gspread.utils import rowcol_to_a1
+
+        if not updates:
+            return
+        self.worksheet(sheet_name).batch_update([
+            {"range": rowcol_to_a1(row, col), "values": [[value]]}
+            for row, col, value in updates
+        ])
+
+    def get_all_values(self, sheet_name):
+        return self.worksheet(sheet_name).get_all_values()
+
+    def append_row(self, sheet_name, values):
+        from gspread.utils import a1_to_rowcol
+
+        response = self.worksheet(sheet_name).append_row(values, value_input_option="RAW")
+        # Sheets picks the row itself (after the table it detects), e.g. "attendance!A7:D7"
+        updated_range = response.get("updates", {}).get("updatedRange", "")
+        if "!" not in updated_range:
+            return None
+        return a1_to_rowcol(updated_range.split("!")[-1].split(":")[0])[0]
+
+    def revision(self, sheet_name):
+        # Drive file metadata only: a few hundred bytes instead of the whole sheet
+        return self.worksheet(sheet_name).spreadsheet.get_lastUpdateTime()
+
+
+# In-memory backend used for tests, benchmarks and offline runs.
+class InMemoryBackend(SheetsBackend):
+    def __init__(self, sheets=None):
+        # {sheet_name: [[cell, ...], ...]}, row 1 is the header
+        self.sheets = {name: [list(row) for row in rows] for name, rows in (sheets or {}).items()}
+        self.revisions = {}  # {sheet_name: number of writes}
+
+    def _rows(self, sheet_name):
+        if sheet_name not in self.sheets:
+            raise KeyError(f"Spreadsheet '{sheet_name}' not found")
+        return self.sheets[sheet_name]
+
+    def find_row(self, sheet_name, value):
+        for index, row in enumerate(self._rows(sheet_name), start=1):
+            if value in row:
+                return index
+        return None
+
+    def row_values(self, sheet_name, row):
+        rows = self._rows(sheet_name)
+        if row > len(rows):
+            return []
+        values = list(rows[row - 1])
+        # gspread drops trailing empty cells
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def cell_value(self, sheet_name, row, col):
+        rows = self._rows(sheet_name)
+        if row > len(rows) or col > len(rows[row - 1]):
+            return None
+        return rows[row - 1][col - 1]
+
+    def update_cell(self, sheet_name, row, col, value):
+        rows = self._rows(sheet_name)
+        while len(rows) < row:
+            rows.append([])
+        cells = rows[row - 1]
+        while len(cells) < col:
+            cells.append("")
+        cells[col - 1] = str(value)
+        self.revisions[sheet_name] = self.revisions.get(sheet_name, 0) + 1
+
+    def get_all_values(self, sheet_name):
+        return [list(row) for row in self._rows(sheet_name)]
+
+    def append_row(self, sheet_name, values):
+        rows = self._rows(sheet_name)
+        rows.append([str(value) for value in values])
+        self.revisions[sheet_name] = self.revisions.get(sheet_name, 0) + 1
+        return len(rows)
+
+    def revision(self, sheet_name):
+        self._rows(sheet_name)  # Unknown sheets raise, like every other method
+        return self.revisions.get(sheet_name, 0)
@@ -0,0 +1,72 @@
+from attendance import AttendanceBitset, AttendanceRecord, AttendanceStore
+from sheets_backend import GspreadBackend, InMemoryBackend, ATTENDANCE_SHEET
+
+
+def roll_call(date, absent, classroom="Grade 1A", student_ids=("S1", "S2", "S3")):
+    present = AttendanceBitset.all_present(len(student_ids))
+    for index in absent:
+        present[index] = 0
+    return AttendanceRecord(date, classroom, list(student_ids), present)
+
+
+def test_retake_overwrites_the_row_the_append_landed_on():
+    # A blank row left behind by an edit: the next append lands after it, not on row 3
+    sheets = InMemoryBackend({ATTENDANCE_SHEET: [
+        ["date", "classroom", "student_ids", "present"],
+        ["2025-03-03", "Grade 2B", "S4", "80"],
+        [],
+    ]})
+    store = AttendanceStore()
+    store.ensure_loaded(sheets)
+
+    store.save(sheets, roll_call("2025-03-04", absent=[1]))
+    assert store.records[("Grade 1A", "2025-03-04")].row == 4
+    store.save(sheets, roll_call("2025-03-04", absent=[2]))
+
+    rows = sheets.get_all_values(ATTENDANCE_SHEET)
+    assert len(rows) == 4
+    assert rows[1] == ["2025-03-03", "Grade 2B", "S4", "80"]
+    assert rows[3] == ["2025-03-04", "Grade 1A", "S1,S2,S3", "c0"]
+
+
+def test_absences_over_a_term():
+    sheets = InMemoryBackend({ATTENDANCE_SHEET: [["date", "classroom", "student_ids", "present"]]})
+    store = AttendanceStore()
+    store.ensure_loaded(sheets)
+    store.save(sheets, roll_call("2025-01-20", absent=[0]))
+    store.save(sheets, roll_call("2025-03-03", absent=[0, 1]))
+    store.save(sheets, roll_call("2025-03-03", absent=[1], classroom="Grade 2B", student_ids=("S4", "S2")))
+    store.save(sheets, roll_call("2025-03-04", absent=[0]))
+    store.save(sheets, roll_call("2025-03-04", absent=[]))  # Retaken: nobody was absent after all
+
+    assert store.absences("S1") == ["2025-01-20", "2025-03-03"]
+    assert store.absences("S1", start="2025-02-01") == ["2025-03-03"]
+    assert store.absences("S1", end="2025-01-31") == ["2025-01-20"]
+    assert store.absences("S2") == ["2025-03-03"]
+    assert store.absences("S3") == []
+
+    reloaded = AttendanceStore()
+    reloaded.ensure_loaded(sheets)
+    assert reloaded.absences("S1") == store.absences("S1")
+
+
+def test_gspread_append_returns_the_updated_row():
+    class Worksheet:
+        def append_row(self, values, value_input_option):
+            return {"updates": {"updatedRange": "'attendance'!A7:D7", "updatedRows": 1}}
+
+    backend = GspreadBackend(creds_json=None)
+    backend._worksheets[ATTENDANCE_SHEET] = Worksheet()
+    assert backend.append_row(ATTENDANCE_SHEET, ["2025-03-04", "Grade 1A", "S1", "80"]) == 7
+
+
+def test_absence_masks_count_from_the_term_start():
+    store = AttendanceStore(origin="2025-01-13")
+    store._index(roll_call("2025-03-03", absent=[0]))
+    assert store._absent["S1"].bit_length() == 50  # Not ~20,000 bits counted from 1970
+
+    # A record from before the origin moves every mask instead of losing the older day
+    store._index(roll_call("2025-01-06", absent=[0, 1]))
+    assert store.absences("S1") == ["2025-01-06", "2025-03-03"]
+    assert store.absences("S1", start="2025-01-13") == ["2025-03-03"]
+    assert store.absences("S2", end="2024-12-31") == []
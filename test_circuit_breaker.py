@@ -0,0 +1,76 @@
+import json
+
+import pytest
+import requests
+from gspread.exceptions import APIError
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError, ResilientBackend, is_outage
+from sheets_backend import InMemoryBackend
+
+
+# In-memory backend whose reads and writes fail with `error` while it is set
+class FlakyBackend(InMemoryBackend):
+    error = None
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def get_all_values(self, sheet_name):
+        self._check()
+        return super().get_all_values(sheet_name)
+
+    def update_cells(self, sheet_name, updates):
+        self._check()
+        super().update_cells(sheet_name, updates)
+
+
+@pytest.fixture
+def backend():
+    return FlakyBackend({"students": [["id", "password"], ["S001", "pass1"]]})
+
+
+def api_error(status):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({"error": {"code": status, "message": "", "status": ""}}).encode("utf-8")
+    return APIError(response)
+
+
+def test_outage_classification():
+    assert is_outage(CircuitOpenError())
+    assert is_outage(api_error(503))
+    assert is_outage(api_error(429))
+    assert not is_outage(api_error(403))
+    assert is_outage(ConnectionResetError())
+    assert not is_outage(KeyError("Spreadsheet 'missing' not found"))
+    assert not is_outage(TypeError("'NoneType' object is not iterable"))
+
+
+def test_rejected_write_is_raised_and_does_not_block_later_writes(backend):
+    sheets = ResilientBackend(backend)
+    with pytest.raises(KeyError):
+        sheets.update_cells("missing", [(1, 1, "x")])
+
+    assert sheets.update_cells("students", [(2, 2, "newpw")]) is True
+    assert backend.sheets["students"][1] == ["S001", "newpw"]
+    assert not sheets.pending_writes
+    assert sheets.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_writes_are_queued_during_an_outage_and_flushed_in_order(backend):
+    sheets = ResilientBackend(backend, CircuitBreaker(failure_threshold=1))
+    sheets.get_all_values("students")  # Take a snapshot
+
+    backend.error = ConnectionResetError()
+    assert sheets.update_cells("students", [(2, 2, "first")]) is False
+    assert sheets.update_cells("students", [(2, 2, "second")]) is False
+    assert sheets.breaker.state == CircuitBreaker.OPEN
+    assert sheets.get_all_values("students")[1] == ["S001", "second"]  # From the snapshot
+    assert len(sheets.pending_writes) == 2
+
+    backend.error = None
+    sheets.breaker.record_success()
+    assert sheets.flush_pending() is True
+    assert backend.sheets["students"][1] == ["S001", "second"]
+    assert not sheets.pending_writes
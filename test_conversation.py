@@ -0,0 +1,424 @@
+"""
+Conversation flow tests: the real handlers over an in-memory sheet and a fake Telegram API.
+
+    python -m pytest -q
+"""
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+
+import bot
+from fakes import FakeTelegramRequest, header, make_row
+from sheets_backend import (
+    InMemoryBackend, STUDENT_SHEET, TEACHER_SHEET, RESULTS_SHEET, PARENT_SHEET, ATTENDANCE_SHEET,
+    STUDENT_COLUMNS, TEACHER_COLUMNS, PARENT_COLUMNS, RESULTS_COLUMNS, ATTENDANCE_COLUMNS,
+)
+
+USER_ID = 1001
+
+
+# One private chat with the bot
+class Chat:
+    def __init__(self, application, request):
+        self.application = application
+        self.request = request
+        self.conv_handler = application.bot_data['conv_handler']
+        self._update_id = 0
+
+    def _update(self, data):
+        self._update_id += 1
+        return Update.de_json({"update_id": self._update_id, **data}, self.application.bot)
+
+    def _message(self, text):
+        message = {
+            "message_id": self._update_id + 1, "date": int(time.time()), "text": text,
+            "chat": {"id": USER_ID, "type": "private"},
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Test"},
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"message": message}
+
+    async def send(self, text):
+        """Send a text message and return the texts the bot replied with."""
+        return await self._process(self._update(self._message(text)))
+
+    async def press(self, data):
+        """Press an inline button and return the texts the bot replied with."""
+        return await self._process(self._update({"callback_query": {
+            "id": str(self._update_id), "chat_instance": "1", "data": data,
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Test"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": USER_ID, "type": "private"}},
+        }}))
+
+    async def _process(self, update):
+        sent = len(self.request.texts)
+        await self.application.process_update(update)
+        return self.request.texts[sent:]
+
+    @property
+    def state(self):
+        """Conversation state the next text message would be handled in (None outside the conversation)."""
+        check = self.conv_handler.check_update(Update.de_json(
+            {"update_id": 0, **self._message("probe")}, self.application.bot
+        ))
+        return check[0] if check else None
+
+    @property
+    def session(self):
+        return self.application.user_data[USER_ID]
+
+
+@pytest.fixture
+def sheets():
+    return InMemoryBackend({
+        STUDENT_SHEET: [
+            header(STUDENT_COLUMNS),
+            make_row(STUDENT_COLUMNS, first_time="No", id="S001", full_name="Abebe Kebede", gender="M",
+                     classroom="Grade 1A", grade="1", tuition="Paid", password="pass1",
+                     security_question="Favourite colour?", security_answer="Blue"),
+            # A new account: password and security columns are still empty
+            ["Yes", "S002", "Hana Girma", "F", "Grade 1A", "1"],
+        ],
+        TEACHER_SHEET: [
+            header(TEACHER_COLUMNS),
+            make_row(TEACHER_COLUMNS, first_time="No", id="T001", full_name="Sara Tesfaye", gender="F",
+                     subject="Mathematics", password="teach1", security_question="First school?",
+                     security_answer="Bole"),
+        ],
+        PARENT_SHEET: [header(PARENT_COLUMNS)],
+        RESULTS_SHEET: [header(RESULTS_COLUMNS)],
+        ATTENDANCE_SHEET: [header(ATTENDANCE_COLUMNS)],
+    })
+
+
+@pytest.fixture
+def run_chat(sheets, tmp_path):
+    """Run `scenario(chat)` against a fresh application backed by `sheets`."""
+    def run(scenario, **overrides):
+        async def main():
+            request = FakeTelegramRequest(default_chat_id=USER_ID)
+            config = {
+                "bot_token": "1:test", "journal_path": "", "record_dir": "", "admin_ids": [],
+                "session_idle_timeout": 0, "results_poll_interval": 0, "report_workers": 1,
+                "report_cache_dir": str(tmp_path / "reports"), **overrides,
+            }
+            application = bot.create_application(config, sheets, request=request)
+            await application.initialize()
+            try:
+                await scenario(Chat(application, request))
+            finally:
+                await application.shutdown()
+                await bot.close_resources(application)
+        asyncio.run(main())
+    return run
+
+
+def test_returning_student_logs_in(run_chat):
+    async def scenario(chat):
+        assert "Please select your role" in (await chat.send("/start"))[0]
+        await chat.send("Student")
+        assert "enter your password" in (await chat.send("S001"))[0]
+        assert chat.state == bot.PASSWORD_CONFIRM
+
+        assert "Incorrect password" in (await chat.send("wrong"))[0]
+        assert chat.state == bot.PASSWORD_CONFIRM
+
+        replies = await chat.send("pass1")
+        assert "Password correct" in replies[0]
+        assert "Welcome, Abebe Kebede" in replies[1]
+        assert chat.state == bot.STUDENT_MENU
+        assert chat.session.user_id == "S001"
+    run_chat(scenario)
+
+
+def test_unknown_id_asks_again(run_chat):
+    async def scenario(chat):
+        await chat.send("/start")
+        await chat.send("Student")
+        assert "User not found" in (await chat.send("S999"))[0]
+        assert chat.state == bot.STUDENT_AUTH
+    run_chat(scenario)
+
+
+def test_first_time_setup(run_chat, sheets):
+    async def scenario(chat):
+        await chat.send("/start")
+        await chat.send("Student")
+        assert "First-time login" in (await chat.send("S002"))[0]
+        assert chat.state == bot.PASSWORD_SETUP
+
+        assert "between 4 and 8" in (await chat.send("abc"))[0]
+        await chat.send("abcd")
+        assert chat.state == "PASSWORD_CONFIRM_SETUP"
+        assert "do not match" in (await chat.send("abce"))[0]
+        assert chat.state == bot.PASSWORD_SETUP
+
+        await chat.send("abcd")
+        assert "security question" in (await chat.send("abcd"))[0]
+        assert chat.state == bot.SECURITY_SETUP
+        await chat.send("First pet?")
+        replies = await chat.send("Rex")
+        assert "account has been created" in replies[0]
+        assert "Welcome, Hana Girma" in replies[1]
+        assert chat.state == bot.STUDENT_MENU
+
+    run_chat(scenario)
+    row = sheets.row_values(STUDENT_SHEET, 3)
+    assert row[STUDENT_COLUMNS["first_time"] - 1] == "NO"
+    assert row[STUDENT_COLUMNS["password"] - 1] == "abcd"
+    assert row[STUDENT_COLUMNS["security_question"] - 1] == "First pet?"
+    assert row[STUDENT_COLUMNS["security_answer"] - 1] == "Rex"
+
+
+def test_forgot_password(run_chat, sheets):
+    async def scenario(chat):
+        await chat.send("/start")
+        await chat.send("Teacher")
+        await chat.send("T001")
+        assert "provide your ID" in (await chat.press("forgot_password"))[0]
+        assert chat.state == "FORGOT_PASSWORD_ID"
+
+        assert "First school?" in (await chat.send("T001"))[0]
+        assert "Incorrect answer" in (await chat.send("bole"))[0]
+        assert "verified" in (await chat.send("Bole"))[0]
+        await chat.send("newpw")
+        assert chat.state == "FORGOT_PASSWORD_CONFIRM_RESET"
+        replies = await chat.send("newpw")
+        assert "reset successfully" in replies[0]
+        assert chat.state == bot.CHOOSING_ROLE
+
+        # The new password works straight away
+        await chat.send("Teacher")
+        await chat.send("T001")
+        assert "Welcome, Sara Tesfaye" in (await chat.send("newpw"))[1]
+        assert chat.state == bot.TEACHER_MENU
+
+    run_chat(scenario)
+    assert sheets.row_values(TEACHER_SHEET, 2)[TEACHER_COLUMNS["password"] - 1] == "newpw"
+
+
+def test_journal_keeps_secrets_out(run_chat, tmp_path):
+    journal_path = tmp_path / "journal.bin"
+
+    async def scenario(chat):
+        await chat.send("/start")
+        await chat.send("Student")
+        await chat.send("S002")
+        await chat.send("abcd")
+        await chat.send("abcd")
+        await chat.send("First pet?")
+        await chat.send("Rex")
+
+        replies = await chat.send("/audit S002")
+        assert "account_created (students): first_time, password, security_question, security_answer" in replies[0]
+        assert "password=<redacted>" in replies[0]
+        assert "abcd" not in replies[0] and "Rex" not in replies[0]
+        assert chat.state == bot.STUDENT_MENU  # Admin commands stay out of the conversation
+
+    run_chat(scenario, journal_path=str(journal_path), admin_ids=[USER_ID])
+    assert b"abcd" not in journal_path.read_bytes()
+    assert b"Rex" not in journal_path.read_bytes()
+
+
+def test_log_out(run_chat):
+    async def scenario(chat):
+        await chat.send("/start")
+        await chat.send("Student")
+        await chat.send("S001")
+        await chat.send("pass1")
+
+        assert "Student Logout" in (await chat.send("Log Out"))[0]
+        assert "Invalid logout confirmation" in (await chat.send("logout"))[0]
+        assert chat.state == "LOG_OUT"
+        assert "logged out" in (await chat.send("Student Logout"))[0]
+        assert chat.state is None
+        assert chat.session.user_id is None and chat.session.role is None
+    run_chat(scenario)
+
+
+def test_long_children_overview_is_split(run_chat, sheets):
+    sheets.sheets[PARENT_SHEET].append(make_row(
+        PARENT_COLUMNS, first_time="No", id="P001", full_name="Kebede Alemu", gender="M",
+        children="S001, S002", password="parent1",
+    ))
+    for student_id in ("S001", "S002"):
+        for subject in ("Mathematics", "English", "Amharic", "Science"):
+            sheets.sheets[RESULTS_SHEET].append(make_row(
+                RESULTS_COLUMNS, id=student_id, subject=subject, result="85", feedback="Works hard. " * 60,
+            ))
+
+    async def scenario(chat):
+        await chat.send("/start")
+        await chat.send("Parent")
+        await chat.send("P001")
+        assert "Linked students: 2" in (await chat.send("parent1"))[1]
+
+        replies = await chat.send("👨‍👩‍👧 Children Overview")
+        assert len(replies) > 1
+        assert all(len(reply.encode("utf-16-le")) // 2 <= 4096 for reply in replies)
+        assert "Abebe Kebede" in replies[0] and "Hana Girma" in "".join(replies)
+        assert chat.state == bot.PARENT_MENU
+    run_chat(scenario)
+
+
+def test_invalid_input_keeps_the_state(run_chat):
+    async def scenario(chat):
+        await chat.send("/start")
+        await chat.send("Student")
+        await chat.send("S001")
+        await chat.send("pass1")
+
+        assert (await chat.send("/nonsense")) == ["❌ Invalid input. Please try again."]
+        assert chat.state == bot.STUDENT_MENU
+        assert "Welcome" not in "".join(await chat.send("Log Out"))
+        assert chat.state == "LOG_OUT"
+
+        assert (await chat.send("/cancel")) == ["Operation canceled."]
+        assert chat.state is None
+    run_chat(scenario)
+
+
+def test_recording_masks_everything_but_labels(run_chat, tmp_path):
+    from recorder import read_recording
+
+    async def scenario(chat):
+        await chat.send("/start")
+        await chat.send("pass1")  # Typed where a button was expected
+        await chat.send("student")
+        await chat.send("S001")
+        await chat.send("pass1")
+
+    run_chat(scenario, record_dir=str(tmp_path / "recordings"))
+    [path] = (tmp_path / "recordings").iterdir()
+    records = list(read_recording(str(path)))
+    assert records[0]["text"] == "/start" and records[2]["text"] == "student"
+    assert all("pass1" not in record["text"] and "S001" not in record["text"] for record in records)
+    assert all(record["state"] is None or isinstance(record["state"], str) for record in records)
+    json.dumps(records)
+
+
+def test_teacher_rows_are_reread_and_evicted(run_chat, sheets):
+    async def scenario(chat):
+        roster = chat.application.bot_data['roster']
+        await chat.send("/start")
+        await chat.send("Teacher")
+        await chat.send("T001")
+        await chat.send("teach1")
+        assert ("teacher", "T001") in roster.accounts
+
+        # An edit in the sheet shows up at the next login once the cached row is older than the TTL
+        sheets.sheets[TEACHER_SHEET][1][TEACHER_COLUMNS["full_name"] - 1] = "Sara Tesfaye Alemu"
+        await chat.send("Log Out")
+        await chat.send("Teacher Logout")
+        await chat.send("/start")
+        await chat.send("Teacher")
+        await chat.send("T001")
+        assert "Welcome, Sara Tesfaye Alemu" in (await chat.send("teach1"))[1]
+
+        # Sweeping keeps the rows of live sessions and drops the rest
+        sweep = SimpleNamespace(application=chat.application, bot_data=chat.application.bot_data)
+        await bot.sweep_idle_sessions(sweep)
+        assert ("teacher", "T001") in roster.accounts
+        await chat.send("Log Out")
+        await chat.send("Teacher Logout")
+        await bot.sweep_idle_sessions(sweep)
+        assert roster.accounts == {}
+
+    run_chat(scenario, roster_ttl=0, session_idle_timeout=3600)
+
+
+def test_student_rows_are_reloaded_at_login(run_chat, sheets):
+    async def scenario(chat):
+        roster = chat.application.bot_data['roster']
+        roster.refresh(sheets)
+        sheets.sheets[STUDENT_SHEET][1][STUDENT_COLUMNS["password"] - 1] = "pass2"
+
+        await chat.send("/start")
+        await chat.send("Student")
+        await chat.send("S001")
+        assert "Incorrect password" in (await chat.send("pass1"))[0]
+        assert "Welcome, Abebe Kebede" in (await chat.send("pass2"))[1]
+        await chat.send("Log Out")
+        await chat.send("Student Logout")
+
+        # A student removed from the sheet can no longer log in
+        del sheets.sheets[STUDENT_SHEET][1]
+        await chat.send("/start")
+        await chat.send("Student")
+        assert "User not found" in (await chat.send("S001"))[0]
+
+    run_chat(scenario, roster_ttl=0)
+
+
+def test_roll_call_can_be_left(run_chat):
+    async def scenario(chat):
+        await chat.send("/start")
+        await chat.send("Teacher")
+        await chat.send("T001")
+        await chat.send("teach1")
+        await chat.send("🗓️ Take Attendance")
+        assert "Roll call for Grade 1A" in (await chat.send("Grade 1A"))[0]
+        await chat.press("att:0")
+
+        replies = await chat.press("att:back")
+        assert "Nothing was saved" in replies[0]
+        assert chat.state == bot.TEACHER_MENU
+        assert chat.session.roll_call is None
+
+        # A button of the old roll call pressed later does not start a password reset
+        assert "expired" in (await chat.press("att:1"))[0]
+        assert chat.state == bot.TEACHER_MENU
+
+        await chat.send("🗓️ Take Attendance")
+        await chat.send("Grade 1A")
+        await chat.send("🔙 Back")
+        assert chat.state == bot.TEACHER_MENU
+    run_chat(scenario)
+
+
+def test_journal_rebuilds_attendance_chat_ids_and_results(run_chat, sheets, tmp_path):
+    from journal import Journal
+
+    journal_path = tmp_path / "journal.bin"
+
+    async def scenario(chat):
+        await chat.send("/start")
+        await chat.send("Teacher")
+        await chat.send("T001")
+        await chat.send("teach1")
+        await chat.send("🗓️ Take Attendance")
+        await chat.send("Grade 1A")
+        await chat.press("att:0")
+        assert "Attendance saved" in (await chat.press("att:submit"))[0]
+
+        jobs = SimpleNamespace(bot=chat.application.bot, bot_data=chat.application.bot_data)
+        await bot.check_new_results(jobs)  # Baseline
+        sheets.append_row(RESULTS_SHEET, make_row(RESULTS_COLUMNS, id="S001", subject="Mathematics", result="91"))
+        await bot.check_new_results(jobs)
+
+        await chat.send("Log Out")
+        await chat.send("Teacher Logout")
+        await chat.send("/start")
+        await chat.send("Student")
+        await chat.send("S001")
+        await chat.send("pass1")
+
+    run_chat(scenario, journal_path=str(journal_path))
+    journal = Journal(str(journal_path)).open()
+    try:
+        assert [bot.EVENT_NAMES[event.type] for event in journal.history()] == [
+            "attendance_taken", "result_posted", "chat_id_set",
+        ]
+        [(date_and_class, roll_call)] = [(key, fields) for (sheet, key), fields in journal.state.items()
+                                         if sheet == ATTENDANCE_SHEET]
+        assert date_and_class.endswith(" Grade 1A")
+        assert roll_call["student_ids"] == "S001,S002" and roll_call["present"] == "40"
+        assert journal.state[(STUDENT_SHEET, "S001")] == {"chat_id": str(USER_ID)}
+        assert journal.state[(RESULTS_SHEET, "S001")] == {"Mathematics": "91"}
+    finally:
+        journal.close()
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+from digest import build_digests, load_seen, save_seen, send_paced, split_message
+from fakes import make_row
+from sheets_backend import STUDENT_COLUMNS, PARENT_COLUMNS, RESULTS_COLUMNS
+
+
+# Records (time, chat_id, text) for every send; the first send hits flood control
+class FakeBot:
+    def __init__(self, retry_after=0):
+        self.sent = []
+        self.retry_after = retry_after
+
+    async def send_message(self, chat_id, text):
+        if self.retry_after:
+            retry_after, self.retry_after = self.retry_after, 0
+            raise RetryAfter(retry_after)
+        self.sent.append((time.monotonic(), chat_id, text))
+
+
+def test_split_message_keeps_the_text_and_the_limit():
+    text = "\n\n".join(f"Student {i}\n" + "\n".join("💬 feedback " * 30 for _ in range(8)) for i in range(6))
+    chunks = split_message(text, limit=1000)
+    assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
+    assert chunks[1].startswith("💬") or chunks[1].startswith("Student")  # Cut at a line break
+    assert all(len(chunk.encode("utf-16-le")) // 2 <= 1000 for chunk in chunks)
+    assert split_message("x" * 2500, limit=1000) == ["x" * 1000, "x" * 1000, "x" * 500]
+
+
+def test_long_parent_digest_is_sent_in_parts():
+    students = [make_row(STUDENT_COLUMNS, id=f"S{i}", full_name=f"Student {i}") for i in range(3)]
+    results = [
+        make_row(RESULTS_COLUMNS, id=f"S{i}", subject=f"Subject {j}", result="80", feedback="Very good work. " * 40)
+        for i in range(3) for j in range(4)
+    ]
+    parents = [make_row(PARENT_COLUMNS, id="P1", children="S0,S1,S2", chat_id="42")]
+    messages, _ = build_digests(students, results, parents)
+
+    bot = FakeBot()
+    stats = asyncio.run(send_paced(bot, messages, rate=1000))
+    assert stats == {"sent": 1, "blocked": 0, "failed": 0}
+    assert len(bot.sent) > 1
+    assert "".join(text for _, _, text in bot.sent).replace("\n", "") == messages[0][1].replace("\n", "")
+
+
+def test_flood_control_pauses_every_send():
+    bot = FakeBot(retry_after=1)
+    messages = [(str(chat_id), "hello") for chat_id in range(5)]
+    started = time.monotonic()
+    stats = asyncio.run(send_paced(bot, messages, rate=1000, concurrency=5))
+    assert stats["sent"] == 5
+    assert all(sent_at - started >= 0.9 for sent_at, _, _ in bot.sent)
+
+
+def test_digest_state_survives_a_restart(tmp_path):
+    path = str(tmp_path / "digest_seen.json")
+    assert load_seen(path) is None
+    save_seen(path, {("S1", "Mathematics"): ("80", "Good")})
+    assert load_seen(path) == {("S1", "Mathematics"): ("80", "Good")}
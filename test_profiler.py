@@ -0,0 +1,113 @@
+import asyncio
+import sys
+import time
+from types import SimpleNamespace
+
+import bot
+from fakes import FakeTelegramRequest
+from profiler import SamplingProfiler, StateTimer, render_summary
+from sheets_backend import InMemoryBackend
+
+
+# A function defined as if it lived in `module`, that samples the stack it runs in
+def sampling_function(module, name):
+    namespace = {"__name__": module, "sys": sys}
+    exec(f"def {name}(profiler):\n    profiler.sample(sys._getframe())", namespace)
+    return namespace[name]
+
+
+def handle_results(call, profiler):
+    call(profiler)
+
+
+def test_sample_classifies_idle_blocked_and_handlers():
+    profiler = SamplingProfiler(thread_id=0, handler_codes={handle_results.__code__: "handle_results"})
+    sampling_function("selectors", "select")(profiler)
+    handle_results(sampling_function("gspread.http_client", "request"), profiler)
+    handle_results(sampling_function("roster", "search"), profiler)
+
+    assert profiler.samples == 3
+    assert profiler.idle == 1
+    assert profiler.blocked == {"gspread.http_client:request": 1}
+    assert profiler.handlers == {"handle_results": 2}
+    assert profiler.self_counts == {"gspread.http_client:request": 1, "roster:search": 1}
+    assert all(stack.endswith(("http_client:request", "roster:search")) for stack in profiler.stacks)
+
+
+class FakeConversation:
+    def __init__(self, states):
+        self.states = states  # {update_id: check_update result}
+
+    def check_update(self, update):
+        return self.states[update.update_id]
+
+
+def test_state_timer_times_each_state():
+    conversation = FakeConversation({1: (1, None, None), 2: (1, None, None), 3: (None, None, None), 4: None})
+    timer = StateTimer(conversation, state_names={1: "STUDENT_MENU"})
+
+    async def handle(update_id, seconds):
+        update = SimpleNamespace(update_id=update_id)
+        await timer.before(update, None)
+        await asyncio.sleep(seconds)
+        await timer.after(update, None)
+
+    async def main():
+        await handle(1, 0.02)
+        await handle(2, 0.0)
+        await handle(3, 0.0)
+        await handle(4, 0.0)
+        await timer.after(SimpleNamespace(update_id=5), None)  # Started before profiling began
+    asyncio.run(main())
+
+    count, total, longest = timer.timings["STUDENT_MENU"]
+    assert count == 2 and total >= 0.02 and longest >= 0.02
+    assert timer.timings["(entry point)"][0] == 1
+    assert timer.timings["(not in conversation)"][0] == 1
+
+
+def test_render_summary():
+    profiler = SamplingProfiler(thread_id=0, interval=0.01, handler_codes={handle_results.__code__: "handle_results"})
+    profiler.started = time.perf_counter() - 2
+    profiler.stopped = profiler.started + 2
+    sampling_function("selectors", "select")(profiler)
+    for _ in range(3):
+        handle_results(sampling_function("gspread.http_client", "request"), profiler)
+    timer = StateTimer(FakeConversation({}))
+    timer.timings["TEACHER_MENU"] = [2, 0.5, 0.4]
+
+    summary = render_summary(profiler, timer)
+    assert "⏱️ Profile: 2.0s, 4 samples every 10 ms" in summary
+    assert "Event loop busy 75% (0.03s), idle 25%" in summary
+    assert "Blocked in synchronous calls: 0.03s (100% of busy time)" in summary
+    assert "0.03s  handle_results" in summary
+    assert "TEACHER_MENU: 2 updates, mean 250 ms, max 400 ms, total 0.50s" in summary
+
+
+def test_profile_run_removes_its_handlers(tmp_path):
+    async def main():
+        request = FakeTelegramRequest()
+        config = {
+            "bot_token": "1:test", "journal_path": "", "record_dir": "", "admin_ids": [],
+            "session_idle_timeout": 0, "results_poll_interval": 0, "report_workers": 1,
+            "report_cache_dir": str(tmp_path / "reports"), "profile_dir": str(tmp_path / "profiles"),
+        }
+        application = bot.create_application(config, InMemoryBackend({}), request=request)
+        await application.initialize()
+        try:
+            handlers_before = {group: list(handlers) for group, handlers in application.handlers.items() if handlers}
+            assert bot.start_profile(application, 0.05, [42])
+            assert not bot.start_profile(application, 0.05, [42])  # One run at a time
+            await asyncio.sleep(0.01)
+            assert application.handlers.get(-1) and application.handlers.get(1)
+
+            await application.bot_data['profiling']
+            handlers_after = {group: list(handlers) for group, handlers in application.handlers.items() if handlers}
+            assert handlers_after == handlers_before
+            assert 'profiling' not in application.bot_data
+            assert request.calls["sendMessage"] == 1 and request.calls["sendDocument"] == 1
+            assert len(list((tmp_path / "profiles").iterdir())) == 1
+        finally:
+            await application.shutdown()
+            await bot.close_resources(application)
+    asyncio.run(main())
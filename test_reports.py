@@ -0,0 +1,41 @@
+import asyncio
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from reports import ReportCardRenderer, WRAP_WIDTH, card_lines
+
+
+def make_card(student_id="S1", subject="Mathematics", feedback="Good work."):
+    return {
+        "school": "X School", "term": "Term 1", "id": student_id, "full_name": f"Student {student_id}",
+        "grade": "3", "classroom": "Grade 3C", "results": [[subject, "88", feedback]],
+    }
+
+
+def test_long_lines_are_wrapped():
+    card = make_card(subject="Environmental Science and Social Studies " * 4, feedback="Keeps improving. " * 20)
+    card["school"] = "Saint Mary International Kindergarten and Elementary School of Addis Ababa"
+    for style, text in card_lines(card):
+        assert len(text) <= WRAP_WIDTH[style]
+
+
+def test_class_is_rendered_in_a_forkserver_pool_and_the_cache_is_pruned(tmp_path):
+    async def main():
+        executor = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("forkserver"))
+        renderer = ReportCardRenderer(str(tmp_path), executor, max_entries=3)
+        try:
+            cards = [make_card(f"S{i}") for i in range(5)]
+            zip_path = await renderer.render_class(cards, "Grade 3C")
+            with zipfile.ZipFile(zip_path) as archive:
+                assert len(archive.namelist()) == 5
+                assert archive.read(archive.namelist()[0]).startswith(b"%PDF-1.4")
+            os.remove(zip_path)
+            assert len([name for name in os.listdir(tmp_path) if name.endswith(".pdf")]) == 3
+
+            path = await renderer.render(cards[0])
+            assert os.path.exists(path)
+        finally:
+            executor.shutdown()
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+from fakes import header, make_row
+from results_watcher import ResultsWatcher, build_notifications
+from sheets_backend import InMemoryBackend, RESULTS_SHEET, STUDENT_COLUMNS, PARENT_COLUMNS, RESULTS_COLUMNS
+
+
+def result(student_id, subject, value, feedback=""):
+    return make_row(RESULTS_COLUMNS, id=student_id, subject=subject, result=value, feedback=feedback)
+
+
+def class_results():
+    return [result(f"S{i}", subject, "70") for i in range(3) for subject in ("Mathematics", "English")]
+
+
+# Counts full reads, and can pretend every read came from the offline snapshot
+class WatchedBackend(InMemoryBackend):
+    def __init__(self, rows):
+        super().__init__({RESULTS_SHEET: [header(RESULTS_COLUMNS)] + rows})
+        self.reads = 0
+        self.stale = False
+
+    def get_all_values(self, sheet_name):
+        self.reads += 1
+        return super().get_all_values(sheet_name)
+
+    def is_stale(self, sheet_name):
+        return self.stale
+
+
+def test_first_poll_only_takes_the_baseline():
+    watcher = ResultsWatcher(block_size=2)
+    assert watcher.diff(class_results()) == []
+    assert len(watcher.hashes) == 3
+
+
+def test_insert_at_the_top_reports_only_the_new_row():
+    watcher = ResultsWatcher(block_size=2)
+    rows = class_results()
+    watcher.diff(rows)
+    # Every block shifts, but rows that only moved are not reported again
+    assert watcher.diff([result("S9", "Science", "88")] + rows) == [result("S9", "Science", "88")]
+
+
+def test_edit_of_one_row():
+    watcher = ResultsWatcher(block_size=2)
+    rows = class_results()
+    watcher.diff(rows)
+    edited = [list(row) for row in rows]
+    edited[3] = result("S1", "English", "95", "Much better")
+    assert watcher.diff(edited) == [edited[3]]
+
+
+def test_moved_row_is_not_reported_again():
+    watcher = ResultsWatcher(block_size=2)
+    rows = class_results()
+    watcher.diff(rows)
+    moved = rows[1:] + rows[:1]  # Sorted differently in the sheet
+    assert watcher.diff(moved) == []
+
+
+def test_unchanged_revision_skips_the_read():
+    sheets = WatchedBackend(class_results())
+    watcher = ResultsWatcher(block_size=2)
+    assert watcher.poll(sheets) == []
+    assert watcher.poll(sheets) is None
+    assert sheets.reads == 1
+
+    sheets.append_row(RESULTS_SHEET, result("S0", "Science", "81"))
+    assert watcher.poll(sheets) == [result("S0", "Science", "81")]
+    assert sheets.reads == 2
+
+
+def test_stale_read_is_not_pushed():
+    sheets = WatchedBackend(class_results())
+    watcher = ResultsWatcher(block_size=2)
+    watcher.poll(sheets)
+
+    sheets.append_row(RESULTS_SHEET, result("S0", "Science", "81"))
+    sheets.stale = True
+    assert watcher.poll(sheets) is None
+    # Once Sheets answers again the change is still reported
+    sheets.stale = False
+    assert watcher.poll(sheets) == [result("S0", "Science", "81")]
+
+
+def test_notifications_fan_out_to_students_and_parents():
+    students = {
+        "S0": make_row(STUDENT_COLUMNS, id="S0", full_name="Abebe Kebede", chat_id="100"),
+        "S1": make_row(STUDENT_COLUMNS, id="S1", full_name="Hana Girma"),  # Never logged in
+    }
+    parents = [
+        make_row(PARENT_COLUMNS, id="P0", children="S0, S1", chat_id="200"),
+        make_row(PARENT_COLUMNS, id="P1", children="S2", chat_id="300"),  # Nothing new for them
+        make_row(PARENT_COLUMNS, id="P2", children="S1"),  # No chat yet
+    ]
+    changes = [result("S0", "Mathematics", "91", "Excellent"), result("S1", "English", "77")]
+    messages = dict(build_notifications(changes, students, parents))
+
+    assert set(messages) == {"100", "200"}
+    assert "Mathematics: 91" in messages["100"] and "💬 Excellent" in messages["100"]
+    assert "English" not in messages["100"]
+    assert "👤 Abebe Kebede" in messages["200"] and "👤 Hana Girma" in messages["200"]
+    assert "English: 77" in messages["200"]
@@ -0,0 +1,69 @@
+import pytest
+
+from trigram import TrigramIndex, normalize
+
+
+@pytest.mark.parametrize("variant, spelling", [
+    ("Hayle", "Haile"),
+    ("Mekonen", "Mekonnen"),
+    ("T'ekle", "Tekle"),
+    ("T’ekle", "Tekle"),
+    ("Qelemu", "Kelemu"),
+    ("Yohanes", "Yohannes"),
+    ("Tesfaye", "Tesfaie"),
+    ("Sélam", "SELAM"),
+])
+def test_spelling_variants_normalize_alike(variant, spelling):
+    assert normalize(variant) == normalize(spelling)
+
+
+def test_words_stay_apart():
+    assert normalize("  Abebe   Kebede-Alemu ") == "abebe kebede alemu"
+
+
+@pytest.fixture
+def index():
+    index = TrigramIndex()
+    index.sync({
+        "S1": "Haile Gebreselassie", "S2": "Hailu Tesfaye", "S3": "Mihret Haile",
+        "S4": "Abebe Bikila", "S5": "Mekonnen Qelemu",
+    })
+    return index
+
+
+def test_search_finds_variant_spellings(index):
+    assert index.search("Hayle")[0][0] in {"S1", "S3"}
+    assert index.search("Mekonen Kelemu")[0][:2] == ("S5", "Mekonnen Qelemu")
+    assert index.search("Mekonen Kelemu")[0][2] == 1.0
+    assert index.search("zzz") == []
+
+
+def test_prefix_boost_ranks_word_starts_first(index):
+    matches = index.search("Hayle")
+    # Full word matches (first or last name) come before the merely similar "Hailu"
+    assert [student_id for student_id, _, _ in matches] == ["S1", "S3", "S2"]
+    assert matches[0][2] == matches[1][2] == 0.9
+    assert matches[2][2] < 0.9
+
+    # A prefix of a word gets the boost too; ties are ordered by name
+    assert [student_id for student_id, _, score in index.search("hail") if score == 0.9] == ["S1", "S2", "S3"]
+
+
+def test_sync_touches_only_changed_students(index):
+    grams = dict(index._grams)
+    changed = index.sync({
+        "S1": "Haile Gebreselassie",  # Unchanged
+        "S2": "Hailu Tesfaye",  # Unchanged
+        "S3": "Mihret Hayle",  # Renamed
+        "S5": "Mekonnen Qelemu",  # Unchanged
+        "S6": "Selam Tadesse",  # Added; S4 removed
+    })
+    assert changed == 3
+    assert all(index._grams[student_id] is grams[student_id] for student_id in ("S1", "S2", "S5"))
+    assert index.names["S3"] == "Mihret Hayle"
+    assert "S4" not in index.names and len(index) == 5
+    assert index.search("Abebe") == []
+    assert index.search("Selam")[0][0] == "S6"
+    # No postings left behind for the removed name
+    assert not any("S4" in postings for postings in index._postings.values())
+    assert index.sync(dict(index.names)) == 0
@@ -0,0 +1,119 @@
+import datetime
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+def build_adapter(pool_size, retries=2):
+    """
+    Keep-alive adapter with at most `pool_size` connections per host.
+
+    `pool_block=True` makes callers wait for a free connection instead of opening
+    throwaway ones once the pool is full. Retries cover failed connection setup and
+    429/5xx answers for idempotent methods only, so writes are never sent twice.
+    Read timeouts are not retried: Sheets calls run on the event loop thread, so a
+    hung read stalls the bot for one read timeout only, and the circuit breaker sees
+    the failure straight away.
+    """
+    retry = Retry(
+        total=retries,
+        read=0,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    return HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+
+
+def build_session(session, pool_size, retries=2):
+    adapter = build_adapter(pool_size, retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Refreshes the service-account token in the background shortly before it expires,
+# so no user request has to wait for the OAuth round trip. The margin must stay above
+# google-auth's own refresh threshold (3m45s), otherwise requests refresh inline first.
+class TokenRefresher:
+    def __init__(self, creds, auth_request, margin=300.0, retry_delay=30.0):
+        self.creds = creds
+        self.auth_request = auth_request
+        self.margin = margin
+        self.retry_delay = retry_delay
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="token-refresher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def seconds_until_refresh(self):
+        expiry = self.creds.expiry  # Naive UTC datetime, None before the first refresh
+        if not self.creds.token or expiry is None:
+            return 0.0
+        return expiry.replace(tzinfo=datetime.timezone.utc).timestamp() - time.time() - self.margin
+
+    def _run(self):
+        while not self._stop.is_set():
+            delay = self.seconds_until_refresh()
+            if delay > 0:
+                self._stop.wait(delay)
+                continue
+            try:
+                self.creds.refresh(self.auth_request)
+                logger.info(f"Refreshed Google API token; valid until {self.creds.expiry} UTC.")
+            except Exception as e:
+                logger.warning(f"Background token refresh failed, retrying in {self.retry_delay}s: {e}")
+                self._stop.wait(self.retry_delay)
+
+
+def authorized_session(creds, pool_size=1, refresh_margin=300.0):
+    """
+    Session that signs requests with `creds`, whose token is kept fresh in the background.
+
+    Token refreshes go through their own small session, so they never wait behind
+    API calls for a connection.
+
+    Returns:
+        tuple: `(session, refresher)`; call `refresher.stop()` on shutdown.
+    """
+    from google.auth.transport.requests import AuthorizedSession, Request
+
+    auth_request = Request(session=build_session(requests.Session(), 1))
+    session = build_session(AuthorizedSession(creds, auth_request=auth_request), pool_size)
+
+    # Fetch the first token now so the first user request does not pay for it either
+    creds.refresh(auth_request)
+    refresher = TokenRefresher(creds, auth_request, margin=refresh_margin).start()
+    return session, refresher
+
+
+def authorize(creds, pool_size=1, connect_timeout=5.0, read_timeout=20.0, refresh_margin=300.0):
+    """
+    Build a gspread client with explicit timeouts and background token refresh.
+
+    The bot calls Sheets from the event loop thread, one call at a time, so one
+    keep-alive connection per host is all it ever uses; `pool_size` only matters
+    if calls are made from several threads. gspread talks to Google through
+    requests, which speaks HTTP/1.1 only.
+
+    Returns:
+        tuple: `(client, refresher)`; call `refresher.stop()` on shutdown.
+    """
+    import gspread
+
+    session, refresher = authorized_session(creds, pool_size, refresh_margin)
+    client = gspread.Client(auth=creds, session=session)
+    client.set_timeout((connect_timeout, read_timeout))
+    return client, refresher
@@ -0,0 +1,118 @@
+import re
+import unicodedata
+from collections import Counter
+
+# Spelling variants common in Latin transliterations of Amharic names
+# (Haile/Hayle, Mekonnen/Mekonen, Yohannes/Yohanes, Tekle/T'ekle, Qelemu/Kelemu, ...)
+TRANSLITERATION_RULES = [
+    (re.compile(r"['`’ʼ]"), ""),
+    (re.compile(r"ph"), "f"),
+    (re.compile(r"q"), "k"),
+    (re.compile(r"(?<=[aeiou])ye\b"), "i"),
+    (re.compile(r"(?<=[aeiou])y(?![aeiou])"), "i"),
+    (re.compile(r"ee|ie"), "i"),
+    (re.compile(r"oo|ou"), "u"),
+    (re.compile(r"(.)\1+"), r"\1"),
+    (re.compile(r"[^\w]+"), " "),
+]
+
+
+def normalize(name):
+    """Fold case, accents and transliteration variants so similar spellings compare equal."""
+    text = unicodedata.normalize("NFKD", name)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    for pattern, replacement in TRANSLITERATION_RULES:
+        text = pattern.sub(replacement, text)
+    return " ".join(text.split())
+
+
+def trigrams(text):
+    """Trigrams of each word, padded like PostgreSQL's pg_trgm ("  ab", " ab", "ab ")."""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+# Inverted index from trigram to student IDs, kept in sync with the roster
+class TrigramIndex:
+    def __init__(self):
+        self.names = {}  # {student_id: full_name}
+        self._keys = {}  # {student_id: normalized name}
+        self._grams = {}  # {student_id: frozenset of trigrams}
+        self._postings = {}  # {trigram: set of student_ids}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, student_id, name):
+        key = normalize(name)
+        if self._keys.get(student_id) == key:
+            self.names[student_id] = name
+            return
+        self.remove(student_id)
+        grams = frozenset(trigrams(key))
+        self.names[student_id] = name
+        self._keys[student_id] = key
+        self._grams[student_id] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(student_id)
+
+    def remove(self, student_id):
+        grams = self._grams.pop(student_id, ())
+        for gram in grams:
+            postings = self._postings[gram]
+            postings.discard(student_id)
+            if not postings:
+                del self._postings[gram]
+        self.names.pop(student_id, None)
+        self._keys.pop(student_id, None)
+
+    def sync(self, names):
+        """
+        Bring the index in line with `{student_id: full_name}`, touching only what changed.
+
+        Returns:
+            int: Number of students added, renamed or removed.
+        """
+        changed = 0
+        for student_id in [student_id for student_id in self.names if student_id not in names]:
+            self.remove(student_id)
+            changed += 1
+        for student_id, name in names.items():
+            if self.names.get(student_id) != name:
+                self.add(student_id, name)
+                changed += 1
+        return changed
+
+    def search(self, query, limit=10, min_score=0.3):
+        """
+        Rank students by trigram similarity (Dice coefficient) to `query`.
+
+        Returns:
+            list[tuple]: `(student_id, full_name, score)`, best match first.
+        """
+        key = normalize(query)
+        query_grams = trigrams(key)
+        if not query_grams:
+            return []
+
+        overlap = Counter()
+        for gram in query_grams:
+            overlap.update(self._postings.get(gram, ()))
+
+        matches = []
+        for student_id, shared in overlap.items():
+            score = 2 * shared / (len(query_grams) + len(self._grams[student_id]))
+            # Queries are often just a first name; reward names with a word starting with the query
+            name_key = self._keys[student_id]
+            if name_key == key:
+                score = 1.0
+            elif f" {key}" in f" {name_key}":
+                score = max(score, 0.9)
+            if score >= min_score:
+                matches.append((student_id, self.names[student_id], score))
+
+        matches.sort(key=lambda match: (-match[2], match[1]))
+        return matches[:limit]